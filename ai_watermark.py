@@ -7,17 +7,288 @@ AI 水印工具
 
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
+import tkinter.font as tkfont
 import os
 from PIL import Image, ImageTk
-import threading
+import queue
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+from watermark_engine import (PreviewProxy, Watermarker, WatermarkError, default_output_name,
+                              load_watermark)
+
+# 界面线程读取处理结果的间隔（毫秒）
+RESULT_POLL_INTERVAL_MS = 100
+
+# 处理完成后汇总显示的最大错误数
+MAX_REPORTED_ERRORS = 20
+
+# 预览图片的最长边（像素）
+PREVIEW_EDGE = 320
+
+# 滑轨停止移动多久后刷新预览（毫秒），拖动时不会每一步都重新合成
+PREVIEW_DEBOUNCE_MS = 30
+
+# 界面线程检查预览图片是否加载完成的间隔（毫秒）
+PREVIEW_POLL_INTERVAL_MS = 20
+
+# 最多缓存的预览代理图片数量
+PREVIEW_CACHE_SIZE = 8
+
+# 界面中可选的水印布局及其对应的引擎参数
+LAYOUT_CHOICES = {
+    "单个水印": 'single',
+    "四个角落": 'corners',
+    "平铺": 'tiled',
+    "倾斜平铺": 'diagonal',
+}
+
+# 文件列表每行的高度（像素）
+FILE_ROW_HEIGHT = 22
+
+# 文件列表右侧尺寸说明和处理状态两列的宽度（像素）
+FILE_INFO_WIDTH = 150
+FILE_STATUS_WIDTH = 70
+
+# 界面线程读取后台加载的文件信息的间隔（毫秒）
+FILE_INFO_POLL_INTERVAL_MS = 50
+
+# 每种处理状态显示的文字和颜色
+FILE_STATUS_STYLES = {
+    'pending': ("等待处理", "#718096"),
+    'done': ("✓ 完成", "#2d3748"),
+    'failed': ("✗ 失败", "#dc3545"),
+    'cancelled': ("已取消", "#718096"),
+}
+
+
+def format_file_size(size):
+    """把字节数格式化为便于阅读的大小"""
+    if size < 1024:
+        return f"{size} B"
+    for unit in ('KB', 'MB', 'GB'):
+        size /= 1024
+        if size < 1024:
+            break
+    return f"{size:.1f} {unit}"
+
+
+def read_file_info(path):
+    """只读取图片文件头，返回 '宽×高 · 文件大小' 形式的说明"""
+    try:
+        with Image.open(path) as img:
+            width, height = img.size
+        return f"{width}×{height} · {format_file_size(os.path.getsize(path))}"
+    except Exception:
+        return "无法读取"
+
+
+class VirtualFileList(tk.Frame):
+    """
+    只绘制可见行的文件列表
+
+    画布上只保留一屏的行，滚动时改写这些行的文字，选择几万个文件也不需要逐个创建控件。
+    图片尺寸和文件大小在所在行可见时才由后台线程读取文件头取得；每个文件的处理状态
+    单独更新，只重绘该文件所在的行。
+    """
+
+    def __init__(self, parent, bg, fg, select_bg, on_select=None):
+        """
+        Args:
+            parent: 父控件
+            bg (str): 列表背景色
+            fg (str): 文件名颜色
+            select_bg (str): 选中行的背景色
+            on_select (callable): 点击某一行时以该行的序号调用
+        """
+        super().__init__(parent, bg=bg)
+        self.bg = bg
+        self.fg = fg
+        self.select_bg = select_bg
+        self.on_select = on_select
+        
+        self.paths = []
+        self.statuses = {}
+        self.infos = {}
+        self.requested = set()
+        self.top = 0
+        self.selected = None
+        self.width = 0
+        # 每次更换文件时递增，丢弃后台线程为旧文件读取的信息
+        self.generation = 0
+        # 每个可见行的画布元素 (背景, 文件名, 说明, 状态)
+        self.rows = []
+        
+        self.font = tkfont.Font(family="微软雅黑", size=9)
+        self.info_queue = queue.Queue()
+        self.info_executor = ThreadPoolExecutor(max_workers=1)
+        self.info_outstanding = 0
+        self.info_poll_job = None
+        
+        self.canvas = tk.Canvas(self, bg=bg, highlightthickness=1, highlightbackground=select_bg)
+        self.scrollbar = ttk.Scrollbar(self, orient="vertical", command=self.yview)
+        self.canvas.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        
+        self.canvas.bind("<Configure>", self.layout)
+        self.canvas.bind("<Button-1>", self.click)
+        self.canvas.bind("<MouseWheel>", lambda event: self.scroll(-3 if event.delta > 0 else 3))
+        self.canvas.bind("<Button-4>", lambda event: self.scroll(-3))
+        self.canvas.bind("<Button-5>", lambda event: self.scroll(3))
+        
+    def set_files(self, paths):
+        """更换列表中的文件，只重绘可见的行"""
+        self.generation += 1
+        self.paths = list(paths)
+        self.statuses = {}
+        self.infos = {}
+        self.requested = set()
+        self.top = 0
+        self.selected = 0 if self.paths else None
+        self.refresh()
+        
+    def set_status(self, index, status):
+        """更新一个文件的处理状态（见 FILE_STATUS_STYLES），该行可见时只重绘这一行"""
+        self.statuses[index] = status
+        if self.top <= index < self.top + len(self.rows):
+            self.draw_row(index - self.top)
+            
+    def set_all_status(self, status):
+        """把所有文件设为同一处理状态"""
+        self.statuses = dict.fromkeys(range(len(self.paths)), status)
+        self.refresh()
+        
+    def layout(self, event):
+        """列表大小变化时按可容纳的行数重新创建画布元素"""
+        self.width = event.width
+        self.canvas.delete("all")
+        self.rows = []
+        for row in range(max(1, event.height // FILE_ROW_HEIGHT)):
+            y = row * FILE_ROW_HEIGHT
+            middle = y + FILE_ROW_HEIGHT // 2
+            self.rows.append((
+                self.canvas.create_rectangle(0, y, event.width, y + FILE_ROW_HEIGHT, width=0, fill=self.bg),
+                self.canvas.create_text(6, middle, anchor=tk.W, font=self.font, fill=self.fg),
+                self.canvas.create_text(event.width - 6 - FILE_STATUS_WIDTH, middle, anchor=tk.E,
+                                        font=self.font, fill="#718096"),
+                self.canvas.create_text(event.width - 6, middle, anchor=tk.E, font=self.font),
+            ))
+        self.refresh()
+        
+    def refresh(self):
+        """重绘所有可见行并更新滚动条"""
+        self.top = max(0, min(self.top, len(self.paths) - len(self.rows)))
+        for row in range(len(self.rows)):
+            self.draw_row(row)
+        if self.paths:
+            self.scrollbar.set(self.top / len(self.paths),
+                               min(1.0, (self.top + len(self.rows)) / len(self.paths)))
+        else:
+            self.scrollbar.set(0.0, 1.0)
+        self.request_infos()
+        
+    def draw_row(self, row):
+        """把第 row 个可见行改写为对应文件的内容"""
+        background, name_item, info_item, status_item = self.rows[row]
+        index = self.top + row
+        if index >= len(self.paths):
+            self.canvas.itemconfig(background, fill=self.bg)
+            for item in (name_item, info_item, status_item):
+                self.canvas.itemconfig(item, text="")
+            return
+        
+        self.canvas.itemconfig(background, fill=self.select_bg if index == self.selected else self.bg)
+        name_width = self.width - 18 - FILE_INFO_WIDTH - FILE_STATUS_WIDTH
+        self.canvas.itemconfig(name_item, text=self.elide(f"{index + 1}. {Path(self.paths[index]).name}",
+                                                          name_width))
+        self.canvas.itemconfig(info_item, text=self.infos.get(index, ""))
+        text, color = FILE_STATUS_STYLES.get(self.statuses.get(index), ("", self.fg))
+        self.canvas.itemconfig(status_item, text=text, fill=color)
+        
+    def elide(self, text, width):
+        """文字超出宽度时截断并添加省略号"""
+        if self.font.measure(text) <= width:
+            return text
+        while text and self.font.measure(text + "…") > width:
+            text = text[:-1]
+        return text + "…"
+        
+    def yview(self, *args):
+        """响应滚动条的拖动和点击"""
+        if args[0] == 'moveto':
+            self.top = int(float(args[1]) * len(self.paths))
+            self.refresh()
+        elif args[0] == 'scroll':
+            step = len(self.rows) if args[2] == 'pages' else 1
+            self.scroll(int(args[1]) * step)
+            
+    def scroll(self, rows):
+        """向下（正数）或向上（负数）滚动若干行"""
+        self.top += rows
+        self.refresh()
+        
+    def click(self, event):
+        """选中被点击的行"""
+        index = self.top + event.y // FILE_ROW_HEIGHT
+        if index >= len(self.paths):
+            return
+        self.selected = index
+        self.refresh()
+        if self.on_select is not None:
+            self.on_select(index)
+            
+    def request_infos(self):
+        """为可见行中尚未读取信息的文件安排后台读取"""
+        for index in range(self.top, min(self.top + len(self.rows), len(self.paths))):
+            if index in self.infos or index in self.requested:
+                continue
+            self.requested.add(index)
+            self.info_outstanding += 1
+            self.info_executor.submit(self.load_info, self.generation, index, self.paths[index])
+        if self.info_outstanding and self.info_poll_job is None:
+            self.info_poll_job = self.after(FILE_INFO_POLL_INTERVAL_MS, self.poll_infos)
+            
+    def load_info(self, generation, index, path):
+        """后台线程：读取文件信息，已滚动出可见范围或已更换文件时跳过"""
+        if generation != self.generation or not self.top <= index < self.top + len(self.rows):
+            self.info_queue.put((generation, index, None))
+            return
+        self.info_queue.put((generation, index, read_file_info(path)))
+        
+    def poll_infos(self):
+        """界面线程：把后台读取的文件信息写入对应的行"""
+        self.info_poll_job = None
+        skipped = False
+        while True:
+            try:
+                generation, index, info = self.info_queue.get_nowait()
+            except queue.Empty:
+                break
+            self.info_outstanding -= 1
+            if generation != self.generation:
+                continue
+            if info is None:
+                # 跳过的文件再次可见时需要重新读取
+                self.requested.discard(index)
+                skipped = True
+                continue
+            self.infos[index] = info
+            if self.top <= index < self.top + len(self.rows):
+                self.draw_row(index - self.top)
+        
+        if skipped:
+            self.request_infos()
+        if self.info_outstanding and self.info_poll_job is None:
+            self.info_poll_job = self.after(FILE_INFO_POLL_INTERVAL_MS, self.poll_infos)
+
 
 class AIWatermarkApp:
     def __init__(self, root):
         self.root = root
         self.root.title("跟我的AI说去吧！")
-        self.root.geometry("800x650")
+        self.root.geometry("1160x700")
         self.root.resizable(False, False)  # 固定窗口大小
         
         # 设置窗口图标（如果水印图片存在）
@@ -41,6 +312,7 @@ class AIWatermarkApp:
         
         # 加载豆包AI水印图片
         self.watermark_image = self.load_watermark_image()
+        self.watermarker = Watermarker(self.watermark_image) if self.watermark_image is not None else None
         
         # 初始化变量
         self.selected_files = []
@@ -48,7 +320,21 @@ class AIWatermarkApp:
         self.opacity_var = tk.IntVar(value=70)
         self.auto_size_var = tk.BooleanVar(value=True)  # 自动尺寸复选框
         self.manual_size_var = tk.IntVar(value=50)  # 手动尺寸滑轨 (1-100)
+        self.limit_size_var = tk.BooleanVar(value=False)  # 是否缩小输出图片
+        self.max_edge_var = tk.IntVar(value=2048)  # 输出图片最长边 (像素)
+        self.layout_var = tk.StringVar(value="单个水印")  # 水印布局
+        self.workers_var = tk.IntVar(value=os.cpu_count() or 1)  # 并行处理线程数
         self.is_processing = False
+        self.result_queue = queue.Queue()
+        self.executor = None
+        self.batch = None
+        
+        # 预览：后台线程解码缩小的代理图片，界面线程只在代理图片上合成水印区域
+        self.preview_path = None
+        self.preview_proxies = OrderedDict()
+        self.preview_executor = ThreadPoolExecutor(max_workers=1)
+        self.preview_photo = None
+        self.preview_job = None
         
         self.setup_ui()
         self.center_window()
@@ -96,9 +382,9 @@ class AIWatermarkApp:
         watermark_path = Path("doubao_ai_watermark.png")
         if watermark_path.exists():
             try:
-                return Image.open(watermark_path).convert("RGBA")
+                return load_watermark(watermark_path)
             except Exception as e:
-                print(f"加载水印图片失败: {e}")
+                print(e)
                 return None
         else:
             print("未找到豆包AI水印图片文件")
@@ -139,6 +425,13 @@ class AIWatermarkApp:
         
         self.create_settings_section(right_frame)
         
+        # 中间：预览区域 (固定宽度)
+        preview_frame = tk.Frame(content_frame, bg=self.bg_color, width=360)
+        preview_frame.pack(side=tk.RIGHT, fill=tk.Y, padx=(15, 0))
+        preview_frame.pack_propagate(False)
+        
+        self.create_preview_section(preview_frame)
+        
         # 状态区域
         self.create_status_area(main_frame)
         
@@ -197,11 +490,29 @@ class AIWatermarkApp:
         )
         self.select_btn.pack(fill=tk.X)
         
-        # 已选文件列表 (固定高度)
+        # 已选文件列表 (固定高度，只绘制可见的行)
         self.file_list_frame = tk.Frame(input_frame, bg=self.bg_color, height=200)
         self.file_list_frame.pack(fill=tk.X, padx=20, pady=(0, 15))
         self.file_list_frame.pack_propagate(False)  # 保持固定高度
         
+        self.files_label = tk.Label(
+            self.file_list_frame,
+            text="暂未选择文件",
+            font=("微软雅黑", 10, "bold"),
+            fg=self.warning_color,
+            bg=self.bg_color
+        )
+        self.files_label.pack(anchor=tk.W, pady=(5, 8))
+        
+        self.file_list = VirtualFileList(
+            self.file_list_frame,
+            bg="#f8f9fa",
+            fg=self.secondary_color,
+            select_bg=self.border_color,
+            on_select=lambda index: self.set_preview_file(self.selected_files[index])
+        )
+        self.file_list.pack(fill=tk.BOTH, expand=True)
+        
         # 输出路径区域
         output_frame = tk.LabelFrame(
             parent,
@@ -251,6 +562,37 @@ class AIWatermarkApp:
         )
         self.output_btn.pack(side=tk.RIGHT)
         
+    def create_preview_section(self, parent):
+        """创建预览区域"""
+        preview_frame = tk.LabelFrame(
+            parent,
+            text="  🔍 效果预览  ",
+            font=("微软雅黑", 12, "bold"),
+            fg=self.primary_color,
+            bg=self.bg_color,
+            relief=tk.SOLID,
+            borderwidth=1
+        )
+        preview_frame.pack(fill=tk.BOTH, expand=True)
+        
+        # 固定大小的预览画面，图片居中显示
+        canvas_frame = tk.Frame(preview_frame, bg="#f8f9fa", width=PREVIEW_EDGE, height=PREVIEW_EDGE)
+        canvas_frame.pack(padx=10, pady=(15, 10))
+        canvas_frame.pack_propagate(False)
+        
+        self.preview_label = tk.Label(canvas_frame, bg="#f8f9fa")
+        self.preview_label.pack(expand=True)
+        
+        self.preview_caption = tk.Label(
+            preview_frame,
+            text="选择图片后在此预览水印效果",
+            font=("微软雅黑", 9),
+            fg=self.warning_color,
+            bg=self.bg_color,
+            wraplength=PREVIEW_EDGE
+        )
+        self.preview_caption.pack(padx=10)
+        
     def create_settings_section(self, parent):
         """创建设置选项区域"""
         settings_frame = tk.LabelFrame(
@@ -369,6 +711,78 @@ class AIWatermarkApp:
         )
         self.size_value_label.pack(pady=(5, 0))
         
+        # 输出尺寸设置
+        output_size_frame = tk.Frame(settings_content, bg=self.bg_color)
+        output_size_frame.pack(fill=tk.X)
+        
+        tk.Checkbutton(
+            output_size_frame,
+            text="缩小输出，最长边:",
+            variable=self.limit_size_var,
+            font=("微软雅黑", 10),
+            bg=self.bg_color,
+            fg=self.primary_color,
+            selectcolor=self.bg_color,
+            activebackground=self.bg_color,
+            activeforeground=self.primary_color,
+            command=self.schedule_preview
+        ).pack(side=tk.LEFT)
+        
+        tk.Spinbox(
+            output_size_frame,
+            from_=64,
+            to=20000,
+            increment=64,
+            textvariable=self.max_edge_var,
+            font=("微软雅黑", 9),
+            width=6,
+            command=self.schedule_preview
+        ).pack(side=tk.LEFT, padx=(5, 0))
+        
+        # 水印布局设置
+        layout_frame = tk.Frame(settings_content, bg=self.bg_color)
+        layout_frame.pack(fill=tk.X, pady=(10, 0))
+        
+        tk.Label(
+            layout_frame,
+            text="水印布局:",
+            font=("微软雅黑", 10),
+            bg=self.bg_color,
+            fg=self.primary_color
+        ).pack(side=tk.LEFT)
+        
+        layout_combobox = ttk.Combobox(
+            layout_frame,
+            textvariable=self.layout_var,
+            values=list(LAYOUT_CHOICES),
+            state="readonly",
+            font=("微软雅黑", 9),
+            width=10
+        )
+        layout_combobox.pack(side=tk.LEFT, padx=(5, 0))
+        layout_combobox.bind("<<ComboboxSelected>>", self.schedule_preview)
+        
+        # 并行线程数设置
+        workers_frame = tk.Frame(settings_content, bg=self.bg_color)
+        workers_frame.pack(fill=tk.X, pady=(10, 0))
+        
+        tk.Label(
+            workers_frame,
+            text="并行处理线程数:",
+            font=("微软雅黑", 10),
+            bg=self.bg_color,
+            fg=self.primary_color
+        ).pack(side=tk.LEFT)
+        
+        tk.Spinbox(
+            workers_frame,
+            from_=1,
+            to=64,
+            textvariable=self.workers_var,
+            font=("微软雅黑", 9),
+            width=4
+        ).pack(side=tk.LEFT, padx=(5, 0))
+        
         # 处理按钮
         self.process_btn = ttk.Button(
             settings_content,
@@ -387,11 +801,19 @@ class AIWatermarkApp:
         # 进度条
         self.progress = ttk.Progressbar(
             status_frame,
-            mode='indeterminate',
+            mode='determinate',
             length=400,
             style='Custom.Horizontal.TProgressbar'
         )
         
+        # 取消按钮（处理时显示）
+        self.cancel_btn = ttk.Button(
+            status_frame,
+            text="取消",
+            style='Secondary.TButton',
+            command=self.cancel_processing
+        )
+        
         # 状态标签
         self.status_label = tk.Label(
             status_frame,
@@ -405,10 +827,12 @@ class AIWatermarkApp:
     def update_opacity_label(self, value):
         """更新透明度标签"""
         self.opacity_value_label.config(text=f"{value}%")
+        self.schedule_preview()
         
     def update_size_label(self, value):
         """更新尺寸标签"""
         self.size_value_label.config(text=f"{value}%")
+        self.schedule_preview()
         
     def toggle_size_mode(self):
         """切换自动/手动尺寸模式"""
@@ -418,6 +842,77 @@ class AIWatermarkApp:
         else:
             # 手动模式，显示手动调节
             self.manual_size_frame.pack(fill=tk.X, pady=(0, 0))
+        self.schedule_preview()
+        
+    def schedule_preview(self, *args):
+        """滑轨等设置变化时延迟刷新预览，连续变化时只刷新最后一次"""
+        if self.preview_job is not None:
+            self.root.after_cancel(self.preview_job)
+        self.preview_job = self.root.after(PREVIEW_DEBOUNCE_MS, self.update_preview)
+        
+    def set_preview_file(self, file_path):
+        """切换预览的图片，代理图片未缓存时在后台线程中解码"""
+        self.preview_path = file_path
+        if file_path is None:
+            self.preview_label.config(image="")
+            self.preview_photo = None
+            self.preview_caption.config(text="选择图片后在此预览水印效果", fg=self.warning_color)
+            return
+        if file_path in self.preview_proxies:
+            self.preview_proxies.move_to_end(file_path)
+            self.update_preview()
+            return
+        self.preview_caption.config(text=f"正在加载预览: {Path(file_path).name}", fg=self.warning_color)
+        future = self.preview_executor.submit(PreviewProxy, self.watermarker, file_path, PREVIEW_EDGE)
+        self.root.after(PREVIEW_POLL_INTERVAL_MS, self.poll_preview, file_path, future)
+        
+    def poll_preview(self, file_path, future):
+        """等待后台解码的代理图片，完成后缓存并刷新预览"""
+        if not future.done():
+            self.root.after(PREVIEW_POLL_INTERVAL_MS, self.poll_preview, file_path, future)
+            return
+        try:
+            proxy = future.result()
+        except WatermarkError as e:
+            if file_path == self.preview_path:
+                self.preview_label.config(image="")
+                self.preview_photo = None
+                self.preview_caption.config(text=f"无法预览: {e}", fg="#dc3545")
+            return
+        
+        self.preview_proxies[file_path] = proxy
+        while len(self.preview_proxies) > PREVIEW_CACHE_SIZE:
+            self.preview_proxies.popitem(last=False)
+        # 解码期间已切换到其他图片时只缓存，不显示
+        if file_path == self.preview_path:
+            self.update_preview()
+        
+    def update_preview(self):
+        """按当前设置在代理图片上重新合成水印区域并显示"""
+        self.preview_job = None
+        proxy = self.preview_proxies.get(self.preview_path)
+        if proxy is None:
+            return
+        
+        max_edge = None
+        if self.limit_size_var.get():
+            try:
+                max_edge = self.max_edge_var.get()
+            except tk.TclError:
+                max_edge = 0
+            # 输入无效时按原尺寸预览，开始处理时再提示
+            if max_edge < 1:
+                max_edge = None
+        frame = proxy.render(self.opacity_var.get(), self.get_size_setting(), max_edge=max_edge,
+                             layout=LAYOUT_CHOICES[self.layout_var.get()])
+        
+        # 尺寸不变时直接把新画面写入已有的 PhotoImage，不重新创建
+        if self.preview_photo is not None and (self.preview_photo.width(), self.preview_photo.height()) == frame.size:
+            self.preview_photo.paste(frame)
+        else:
+            self.preview_photo = ImageTk.PhotoImage(frame)
+            self.preview_label.config(image=self.preview_photo)
+        self.preview_caption.config(text=Path(self.preview_path).name, fg=self.secondary_color)
         
     def select_images(self):
         """选择图片文件"""
@@ -443,9 +938,11 @@ class AIWatermarkApp:
                 fg=self.primary_color
             )
             self.process_btn.config(state=tk.NORMAL)
+            self.set_preview_file(self.selected_files[0])
         else:
             self.selected_files = []
             self.update_file_list()
+            self.set_preview_file(None)
             self.status_label.config(
                 text="请选择要处理的图片文件",
                 fg=self.secondary_color
@@ -453,58 +950,12 @@ class AIWatermarkApp:
             self.process_btn.config(state=tk.DISABLED)
             
     def update_file_list(self):
-        """更新文件列表显示"""
-        # 清除旧的列表
-        for widget in self.file_list_frame.winfo_children():
-            widget.destroy()
-            
-        if not self.selected_files:
-            no_files_label = tk.Label(
-                self.file_list_frame,
-                text="暂未选择文件",
-                font=("微软雅黑", 10),
-                fg=self.warning_color,
-                bg=self.bg_color
-            )
-            no_files_label.pack(expand=True)
-            return
-            
-        # 显示选中的文件
-        files_label = tk.Label(
-            self.file_list_frame,
-            text=f"已选择 {len(self.selected_files)} 个文件:",
-            font=("微软雅黑", 10, "bold"),
-            fg=self.primary_color,
-            bg=self.bg_color
-        )
-        files_label.pack(anchor=tk.W, pady=(5, 8))
-        
-        # 创建文本框显示文件名 (固定高度，内置滚动)
-        files_text = tk.Text(
-            self.file_list_frame,
-            height=8,
-            font=("微软雅黑", 9),
-            bg="#f8f9fa",
-            fg=self.secondary_color,
-            relief=tk.SOLID,
-            borderwidth=1,
-            wrap=tk.WORD,
-            state=tk.NORMAL
-        )
-        
-        # 添加滚动条
-        scrollbar_files = ttk.Scrollbar(self.file_list_frame, orient="vertical", command=files_text.yview)
-        files_text.configure(yscrollcommand=scrollbar_files.set)
-        
-        for i, file_path in enumerate(self.selected_files, 1):
-            filename = Path(file_path).name
-            files_text.insert(tk.END, f"{i}. {filename}\n")
-            
-        files_text.config(state=tk.DISABLED)
-        
-        # 布局文本框和滚动条
-        files_text.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
-        scrollbar_files.pack(side=tk.RIGHT, fill=tk.Y)
+        """更新文件列表显示（只重绘可见的行，文件信息在后台读取）"""
+        self.file_list.set_files(self.selected_files)
+        if self.selected_files:
+            self.files_label.config(text=f"已选择 {len(self.selected_files)} 个文件:", fg=self.primary_color)
+        else:
+            self.files_label.config(text="暂未选择文件", fg=self.warning_color)
         
     def select_output_directory(self):
         """选择输出目录"""
@@ -514,66 +965,18 @@ class AIWatermarkApp:
         else:
             self.output_directory.set("与原图相同目录")
             
-    def add_watermark(self, image_path, output_path, opacity, size_setting):
+    def get_size_setting(self):
+        """获取水印大小设置：自动模式为 auto，手动模式为相对于自动大小的倍数"""
+        if self.auto_size_var.get():
+            return "auto"
+        # 将滑轨值映射到0.1到1.5倍的缩放范围
+        size_percent = self.manual_size_var.get()
+        return 0.1 + (size_percent / 100.0) * 1.4
+        
+    def add_watermark(self, image_path, output_path, opacity, size_setting, max_edge=None, layout='single'):
         """为单张图片添加豆包AI水印"""
-        try:
-            # 打开原图
-            with Image.open(image_path) as img:
-                # 转换为RGBA模式以支持透明度
-                if img.mode != 'RGBA':
-                    img = img.convert('RGBA')
-                
-                # 计算水印大小
-                if self.auto_size_var.get():
-                    # 自动模式：基于原项目算法
-                    scale = img.width / 864.0
-                else:
-                    # 手动模式：根据滑轨值计算
-                    # 将1-100的值映射到合理的缩放范围
-                    size_percent = self.manual_size_var.get()
-                    # 映射到0.1到1.5的缩放范围
-                    scale = 0.1 + (size_percent / 100.0) * 1.4
-                    scale = scale * (img.width / 864.0)  # 基于图片宽度调整
-                
-                # 确保最小尺寸
-                scale = max(scale, 0.1)
-                
-                # 调整水印大小
-                watermark_width = int(self.watermark_image.width * scale)
-                watermark_height = int(self.watermark_image.height * scale)
-                watermark_resized = self.watermark_image.resize((watermark_width, watermark_height), Image.Resampling.LANCZOS)
-                
-                # 调整水印透明度
-                if opacity < 100:
-                    watermark_with_opacity = Image.new('RGBA', watermark_resized.size, (255, 255, 255, 0))
-                    watermark_data = watermark_resized.getdata()
-                    new_data = []
-                    for item in watermark_data:
-                        new_alpha = int(item[3] * opacity / 100)
-                        new_data.append((item[0], item[1], item[2], new_alpha))
-                    watermark_with_opacity.putdata(new_data)
-                    watermark_resized = watermark_with_opacity
-                
-                # 计算水印位置（右下角，留边距）
-                margin = 12
-                x = img.width - watermark_width - margin
-                y = img.height - watermark_height - margin
-                
-                # 粘贴水印
-                img.paste(watermark_resized, (x, y), watermark_resized)
-                
-                # 转换回RGB模式以保存为JPEG
-                if img.mode == 'RGBA':
-                    rgb_img = Image.new('RGB', img.size, (255, 255, 255))
-                    rgb_img.paste(img, mask=img.split()[-1])
-                    img = rgb_img
-                
-                # 保存图片
-                img.save(output_path, 'JPEG', quality=90)
-                return str(output_path)
-                
-        except Exception as e:
-            raise Exception(f"处理图片 {image_path} 时出错: {str(e)}")
+        return self.watermarker.process_file(image_path, output_path, opacity, size_setting, max_edge,
+                                             layout=layout)
     
     def process_images(self):
         """处理所有选中的图片"""
@@ -588,83 +991,152 @@ class AIWatermarkApp:
         if self.is_processing:
             return
             
-        def process_thread():
+        # 在主线程中读取界面设置
+        opacity = self.opacity_var.get()
+        size_setting = self.get_size_setting()
+        layout = LAYOUT_CHOICES[self.layout_var.get()]
+        output_dir = self.output_directory.get()
+        
+        # 读取输出尺寸限制
+        max_edge = None
+        if self.limit_size_var.get():
             try:
-                self.is_processing = True
-                
-                # 更新UI状态
-                self.root.after(0, lambda: self.process_btn.config(state=tk.DISABLED, text="处理中..."))
-                self.root.after(0, lambda: self.progress.pack(fill=tk.X, pady=(0, 10)))
-                self.root.after(0, lambda: self.progress.start())
-                self.root.after(0, lambda: self.status_label.config(
-                    text="正在处理图片，请稍候...", 
-                    fg=self.warning_color
-                ))
-                
-                opacity = self.opacity_var.get()
-                output_dir = self.output_directory.get()
-                processed_files = []
-                
-                for i, file_path in enumerate(self.selected_files):
-                    self.root.after(0, lambda i=i: self.status_label.config(
-                        text=f"正在处理第 {i+1}/{len(self.selected_files)} 张图片...",
-                        fg=self.warning_color
-                    ))
-                    
-                    try:
-                        # 确定输出路径
-                        file_path_obj = Path(file_path)
-                        if output_dir == "与原图相同目录":
-                            output_path = file_path_obj.parent / f"{file_path_obj.stem}_watermarked{file_path_obj.suffix}"
-                        else:
-                            output_path = Path(output_dir) / f"{file_path_obj.stem}_watermarked{file_path_obj.suffix}"
-                            
-                        result_path = self.add_watermark(file_path, str(output_path), opacity, None)
-                        processed_files.append(result_path)
-                    except Exception as e:
-                        error_msg = f"处理文件 {Path(file_path).name} 时出错: {str(e)}"
-                        self.root.after(0, lambda msg=error_msg: messagebox.showerror("处理错误", msg))
-                
-                # 处理完成
-                self.root.after(0, lambda: self.progress.stop())
-                self.root.after(0, lambda: self.progress.pack_forget())
-                self.root.after(0, lambda: self.process_btn.config(state=tk.NORMAL, text="🚀 开始处理"))
-                
-                if processed_files:
-                    self.root.after(0, lambda: self.status_label.config(
-                        text=f"✅ 成功处理 {len(processed_files)} 张图片！",
-                        fg=self.primary_color
-                    ))
-                    
-                    success_msg = f"成功处理 {len(processed_files)} 张图片！\n\n"
-                    if output_dir == "与原图相同目录":
-                        success_msg += "文件已保存在原图片同目录下，文件名添加了 '_watermarked' 后缀。"
-                    else:
-                        success_msg += f"文件已保存到: {output_dir}"
-                    
-                    self.root.after(0, lambda: messagebox.showinfo("处理完成", success_msg))
-                else:
-                    self.root.after(0, lambda: self.status_label.config(
-                        text="❌ 处理失败，请检查文件和设置",
-                        fg="#dc3545"
-                    ))
-                    
-            except Exception as e:
-                self.root.after(0, lambda: self.progress.stop())
-                self.root.after(0, lambda: self.progress.pack_forget())
-                self.root.after(0, lambda: self.process_btn.config(state=tk.NORMAL, text="🚀 开始处理"))
-                self.root.after(0, lambda e=e: messagebox.showerror("错误", f"处理过程中出现错误: {str(e)}"))
-                self.root.after(0, lambda: self.status_label.config(
-                    text="❌ 处理过程中出现错误",
-                    fg="#dc3545"
-                ))
-            finally:
-                self.is_processing = False
-        
-        # 在后台线程中处理图片
-        thread = threading.Thread(target=process_thread, daemon=True)
-        thread.start()
-
+                max_edge = self.max_edge_var.get()
+            except tk.TclError:
+                max_edge = 0
+            if max_edge < 1:
+                messagebox.showwarning("警告", "请输入有效的输出图片最长边像素数")
+                return
+            
+        # 读取并行线程数
+        try:
+            workers = self.workers_var.get()
+        except tk.TclError:
+            workers = 0
+        if workers < 1:
+            messagebox.showwarning("警告", "请输入有效的并行线程数")
+            return
+        
+        self.is_processing = True
+        self.batch = {
+            'total': len(self.selected_files),
+            'done': 0,
+            'processed': [],
+            'errors': [],
+            'cancelled': 0,
+            'started': time.perf_counter(),
+            'output_dir': output_dir,
+        }
+        
+        # 更新UI状态
+        self.process_btn.config(state=tk.DISABLED, text="处理中...")
+        self.select_btn.config(state=tk.DISABLED)
+        self.progress.config(maximum=self.batch['total'], value=0)
+        self.progress.pack(fill=tk.X, pady=(0, 10), before=self.status_label)
+        self.cancel_btn.config(state=tk.NORMAL, text="取消")
+        self.cancel_btn.pack(pady=(0, 5), after=self.status_label)
+        self.status_label.config(text="正在处理图片，请稍候...", fg=self.warning_color)
+        
+        self.file_list.set_all_status('pending')
+        
+        # 把所有图片交给线程池处理，结果通过队列传回，由界面线程定时读取
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        for index, file_path in enumerate(self.selected_files):
+            file_path_obj = Path(file_path)
+            if output_dir == "与原图相同目录":
+                output_path = file_path_obj.parent / default_output_name(file_path)
+            else:
+                output_path = Path(output_dir) / default_output_name(file_path)
+            
+            future = self.executor.submit(self.add_watermark, file_path, str(output_path), opacity,
+                                          size_setting, max_edge, layout)
+            future.add_done_callback(lambda f, index=index: self.result_queue.put((index, f)))
+        
+        self.root.after(RESULT_POLL_INTERVAL_MS, self.poll_results)
+        
+    def cancel_processing(self):
+        """取消尚未开始的图片，正在处理的图片会继续完成"""
+        if not self.is_processing:
+            return
+        self.cancel_btn.config(state=tk.DISABLED, text="正在取消...")
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        
+    def poll_results(self):
+        """定时读取处理结果并更新进度"""
+        batch = self.batch
+        while True:
+            try:
+                index, future = self.result_queue.get_nowait()
+            except queue.Empty:
+                break
+            batch['done'] += 1
+            if future.cancelled():
+                batch['cancelled'] += 1
+                self.file_list.set_status(index, 'cancelled')
+            elif future.exception() is not None:
+                batch['errors'].append((Path(self.selected_files[index]).name, future.exception()))
+                self.file_list.set_status(index, 'failed')
+            else:
+                batch['processed'].append(future.result())
+                self.file_list.set_status(index, 'done')
+        
+        self.progress.config(value=batch['done'])
+        if batch['done'] >= batch['total']:
+            self.finish_processing()
+            return
+        
+        finished = len(batch['processed']) + len(batch['errors'])
+        elapsed = time.perf_counter() - batch['started']
+        status = f"正在处理 {batch['done']}/{batch['total']} 张图片"
+        if finished and elapsed > 0:
+            rate = finished / elapsed
+            remaining = int((batch['total'] - batch['done']) / rate)
+            status += f"，{rate:.1f} 张/秒，预计剩余 {remaining // 60:02d}:{remaining % 60:02d}"
+        self.status_label.config(text=status, fg=self.warning_color)
+        
+        self.root.after(RESULT_POLL_INTERVAL_MS, self.poll_results)
+        
+    def finish_processing(self):
+        """全部图片处理结束后恢复界面，并汇总显示结果和错误"""
+        batch = self.batch
+        self.executor.shutdown(wait=False)
+        self.is_processing = False
+        
+        self.progress.pack_forget()
+        self.cancel_btn.pack_forget()
+        self.process_btn.config(state=tk.NORMAL, text="🚀 开始处理")
+        self.select_btn.config(state=tk.NORMAL)
+        
+        processed_count = len(batch['processed'])
+        if processed_count:
+            self.status_label.config(
+                text=f"✅ 成功处理 {processed_count} 张图片！",
+                fg=self.primary_color
+            )
+        else:
+            self.status_label.config(
+                text="❌ 处理失败，请检查文件和设置",
+                fg="#dc3545"
+            )
+        
+        summary = f"成功处理 {processed_count} 张图片！\n\n"
+        if processed_count:
+            if batch['output_dir'] == "与原图相同目录":
+                summary += "文件已保存在原图片同目录下，文件名添加了 '_watermarked' 后缀。\n"
+            else:
+                summary += f"文件已保存到: {batch['output_dir']}\n"
+        if batch['cancelled']:
+            summary += f"\n已取消 {batch['cancelled']} 张图片。\n"
+        
+        if batch['errors']:
+            summary += f"\n{len(batch['errors'])} 张图片处理失败:\n"
+            for filename, error in batch['errors'][:MAX_REPORTED_ERRORS]:
+                summary += f"• {filename}: {error}\n"
+            if len(batch['errors']) > MAX_REPORTED_ERRORS:
+                summary += f"……以及其他 {len(batch['errors']) - MAX_REPORTED_ERRORS} 个错误\n"
+            messagebox.showwarning("处理完成", summary)
+        else:
+            messagebox.showinfo("处理完成", summary)
 
 def main():
     """主函数"""
@@ -6,27 +6,58 @@ AI 水印工具 - 命令行版本
 """
 
 import argparse
+import csv
+import io
+import json
 import os
 import sys
+import time
+from collections import deque
+from concurrent.futures import (FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor,
+                                as_completed, wait)
 from pathlib import Path
+
 from PIL import Image
 
+from watermark_stats import NULL_STATS, StageStats
+from watermark_engine import (LAYOUTS, METADATA_KINDS, POSITIONS, SIZE_DIVISORS, Watermarker,
+                              WatermarkError, default_output_name, estimate_image_memory,
+                              is_animation, load_watermark, resolve_format)
+from watermark_server import serve_main
+
+# 进程内共享的水印处理器，首次使用时创建
+_watermarker = None
+
 
 def load_watermark_image():
     """加载豆包AI水印图片"""
     watermark_path = Path("doubao_ai_watermark.png")
     if watermark_path.exists():
         try:
-            return Image.open(watermark_path).convert("RGBA")
+            return load_watermark(watermark_path)
         except Exception as e:
-            print(f"加载水印图片失败: {e}")
+            print(e)
             return None
     else:
         print("未找到豆包AI水印图片文件: doubao_ai_watermark.png")
         return None
 
 
-def add_watermark(image_path, output_path=None, opacity=70, size="auto"):
+def get_watermarker():
+    """获取进程内共享的水印处理器，首次调用时加载水印图片"""
+    global _watermarker
+    if _watermarker is None:
+        watermark_image = load_watermark_image()
+        if watermark_image is None:
+            raise Exception("无法加载豆包AI水印图片")
+        _watermarker = Watermarker(watermark_image)
+    return _watermarker
+
+
+def add_watermark(image_path, output_path=None, opacity=70, size="auto", max_edge=None, max_pixels=None,
+                  output_format=None, save_options=None, stats=NULL_STATS, keep_metadata=(),
+                  auto_orient=True, max_memory=None, lossless_jpeg=False,
+                  position='bottom-right', layout='single'):
     """
     为图片添加豆包AI水印
     
@@ -35,88 +66,532 @@ def add_watermark(image_path, output_path=None, opacity=70, size="auto"):
         output_path (str): 输出图片路径，如果为None则在原文件名后添加_watermarked
         opacity (int): 透明度（30-100）
         size (str): 水印大小（auto/small/medium/large）
+        max_edge (int): 输出图片长边的最大像素数，None表示保持原尺寸
+        max_pixels (int): 输出图片像素总数的上限，None表示不限制
+        output_format (str): 输出格式（jpeg/png/webp），None表示根据输出文件扩展名判断
+        save_options (dict): 按格式名称分组的编码参数，如 {'JPEG': {'quality': 85}}
+        stats (StageStats): 记录各阶段耗时的统计对象，默认不记录
+        keep_metadata (iterable): 写入输出图片的原图元数据类型（exif/icc/xmp），默认不保留
+        auto_orient (bool): 是否按EXIF方向放置水印（输出图片保留方向标记）
+        max_memory (int): 单张图片的内存预算（字节），None表示不限制
+        lossless_jpeg (bool): JPEG只重新编码水印覆盖的区域，其余数据原样保留
+        position (str): 水印位置（bottom-right/bottom-left/top-right/top-left/center），
+            auto 表示按图片内容选择水印最清晰的角落
+        layout (str): 水印布局（single/corners/tiled/diagonal）
     
     Returns:
         str: 输出文件路径
     """
-    # 加载水印图片
-    watermark_image = load_watermark_image()
-    if watermark_image is None:
-        raise Exception("无法加载豆包AI水印图片")
+    return get_watermarker().process_file(image_path, output_path, opacity, size, max_edge, max_pixels,
+                                          output_format, save_options, stats, keep_metadata,
+                                          auto_orient, max_memory, lossless_jpeg, position, layout)
+
+
+# 支持的图片格式
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp', '.gif', '.webp'}
+
+# 增量处理清单的默认文件名
+MANIFEST_NAME = '.ai_watermark_manifest.json'
+
+# 流水线模式默认预读（以及排队等待写出）的图片数量
+PIPELINE_DEPTH = 4
+
+
+def iter_image_files(input_dir, recursive=False, skip_dirs=()):
+    """
+    逐个产出目录中的图片文件
+    
+    使用 os.scandir 单次遍历目录，扩展名不区分大小写，发现一个文件就立即产出，
+    无需等待整个目录扫描完成。
+    
+    Args:
+        input_dir (str): 输入目录
+        recursive (bool): 是否递归处理子目录
+        skip_dirs (iterable): 递归时跳过的目录（如位于输入目录内的输出目录）
+    
+    Yields:
+        Path: 图片文件路径
+    """
+    skip_dirs = {os.path.realpath(d) for d in skip_dirs}
+    pending_dirs = [str(input_dir)]
+    while pending_dirs:
+        current_dir = pending_dirs.pop()
+        try:
+            with os.scandir(current_dir) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        if recursive and os.path.realpath(entry.path) not in skip_dirs:
+                            pending_dirs.append(entry.path)
+                    elif os.path.splitext(entry.name)[1].lower() in IMAGE_EXTENSIONS and entry.is_file():
+                        yield Path(entry.path)
+        except OSError as e:
+            print(f"✗ 错误: 无法读取目录 {current_dir}: {e}")
+
+
+class IncrementalManifest:
+    """
+    增量处理清单
+    
+    记录每张源图片的大小、修改时间、处理参数和输出路径，保存为JSON文件。
+    再次运行时，源图片、参数和输出路径都未变化且输出文件仍存在的图片会被直接跳过。
+    """
+    
+    def __init__(self, path):
+        """
+        Args:
+            path (str): 清单文件路径，不存在时创建新的清单
+        """
+        self.path = Path(path)
+        self.entries = {}
+        if self.path.exists():
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    self.entries = json.load(f).get('files', {})
+            except (OSError, ValueError, AttributeError) as e:
+                print(f"警告: 无法读取增量清单 {self.path}，将重新处理所有图片: {e}")
+                self.entries = {}
+        self.outputs = {entry['output'] for entry in self.entries.values()}
+    
+    def is_output(self, file_path):
+        """判断文件是否为之前生成的输出图片"""
+        return os.path.abspath(file_path) in self.outputs
+    
+    def is_up_to_date(self, key, stat, settings, output_path):
+        """判断源图片的输出是否已是最新（输出路径改变时需要重新处理）"""
+        entry = self.entries.get(key)
+        return (entry is not None
+                and entry['size'] == stat.st_size
+                and entry['mtime_ns'] == stat.st_mtime_ns
+                and entry['settings'] == settings
+                and entry['output'] == os.path.abspath(output_path)
+                and os.path.exists(entry['output']))
+    
+    def record(self, key, stat, settings, output_path):
+        """记录一张处理成功的图片"""
+        output_path = os.path.abspath(output_path)
+        self.entries[key] = {
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'settings': settings,
+            'output': output_path,
+        }
+        self.outputs.add(output_path)
+    
+    def save(self):
+        """写入清单文件（先写临时文件再替换，避免中断时损坏清单）"""
+        tmp_path = self.path.with_name(self.path.name + '.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': 1, 'files': self.entries}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+
+def _iter_tasks(input_path, output_dir, recursive, output_format=None):
+    """产出 (图片文件, 输出路径)，输出目录中保持与输入目录相同的子目录结构"""
+    skip_dirs = [output_dir] if output_dir else []
+    created_dirs = set()
+    for image_file in iter_image_files(input_path, recursive, skip_dirs):
+        if output_dir:
+            output_parent = Path(output_dir) / image_file.parent.relative_to(input_path)
+            if output_parent not in created_dirs:
+                os.makedirs(output_parent, exist_ok=True)
+                created_dirs.add(output_parent)
+            output_path = str(output_parent / default_output_name(image_file, output_format))
+        else:
+            output_path = None
+        yield image_file, output_path
+
+
+def _init_worker():
+    """进程池工作进程初始化：预先加载水印图片，避免每张图片重复加载"""
+    get_watermarker()
+
+
+def _add_watermark_in_worker(collect_stats, image_path, output_path, settings):
+    """
+    在工作进程中处理一张图片
     
+    处理失败时不抛出异常，而是连同耗时一起返回错误信息，使结果日志中失败的图片也有耗时。
+    
+    Returns:
+        tuple: (输出路径, 耗时秒数, 阶段记录, 错误信息)，不需要统计时阶段记录为None，
+            失败时输出路径为None
+    """
+    start = time.perf_counter()
+    stats = StageStats() if collect_stats else NULL_STATS
     try:
-        # 打开原图
-        with Image.open(image_path) as img:
-            # 转换为RGBA模式以支持透明度
-            if img.mode != 'RGBA':
-                img = img.convert('RGBA')
-            
-            # 计算水印大小
-            if size == "auto":
-                # 基于原Android项目的逻辑：原图宽度/864
-                scale = img.width / 864.0
-            elif size == "small":
-                scale = img.width / 1200.0
-            elif size == "medium":
-                scale = img.width / 800.0
-            elif size == "large":
-                scale = img.width / 600.0
-            else:
-                scale = img.width / 864.0
-            
-            # 确保最小尺寸
-            scale = max(scale, 0.2)
-            
-            # 调整水印大小
-            watermark_width = int(watermark_image.width * scale)
-            watermark_height = int(watermark_image.height * scale)
-            watermark_resized = watermark_image.resize((watermark_width, watermark_height), Image.Resampling.LANCZOS)
-            
-            # 调整水印透明度
-            if opacity < 100:
-                # 创建透明度调整后的水印
-                watermark_with_opacity = Image.new('RGBA', watermark_resized.size, (255, 255, 255, 0))
-                
-                # 调整alpha通道
-                watermark_data = watermark_resized.getdata()
-                new_data = []
-                for item in watermark_data:
-                    # item[3] 是alpha通道
-                    new_alpha = int(item[3] * opacity / 100)
-                    new_data.append((item[0], item[1], item[2], new_alpha))
+        result_path, error = add_watermark(image_path, output_path, stats=stats, **settings), None
+    except Exception as e:
+        result_path, error = None, str(e)
+    return result_path, time.perf_counter() - start, stats.to_dict() if collect_stats else None, error
+
+
+def _report_result(index, image_file, future, processed_files, stats):
+    """
+    输出并行任务的处理结果
+    
+    Returns:
+        tuple: (输出路径, 错误信息, 耗时秒数)，失败时输出路径为None；
+            工作进程异常退出时耗时也为None
+    """
+    print(f"处理第 {index} 张图片: {image_file.name}")
+    try:
+        result_path, seconds, worker_stats, error = future.result()
+    except Exception as e:
+        print(f"✗ 错误: {e}")
+        return None, str(e), None
+    
+    if worker_stats is not None:
+        stats.merge(worker_stats)
+    if error:
+        print(f"✗ 错误: {error}")
+        return None, error, seconds
+    processed_files.append(result_path)
+    print(f"✓ 完成: {result_path}")
+    return result_path, None, seconds
+
+
+def _task_settings(opacity, size, max_edge, max_pixels, output_format, save_options, keep_metadata,
+                   auto_orient, max_memory, lossless_jpeg, position, layout):
+    """把处理参数整理为传给 add_watermark() 的关键字参数"""
+    return {'opacity': opacity, 'size': size, 'max_edge': max_edge, 'max_pixels': max_pixels,
+            'output_format': output_format, 'save_options': save_options,
+            'keep_metadata': tuple(keep_metadata), 'auto_orient': auto_orient,
+            'max_memory': max_memory, 'lossless_jpeg': lossless_jpeg, 'position': position,
+            'layout': layout}
+
+
+def _estimate_task_memory(image_file, settings, output_path):
+    """
+    按文件头估算处理一张图片的峰值内存（字节），无法读取时返回0（由处理时报告错误）
+
+    输出为动画时编码器保留全部帧，按输出格式判断，output_path 为None时与原图扩展名相同。
+    """
+    try:
+        with Image.open(image_file) as img:
+            image_format = resolve_format(output_path or getattr(image_file, 'name', image_file),
+                                          settings['output_format'])
+            animation = image_format if is_animation(img, image_format) else None
+            return estimate_image_memory(img, settings['max_edge'], settings['max_pixels'],
+                                         animation=animation)
+    except (OSError, ValueError):
+        return 0
+
+
+def _run_tasks(tasks, jobs, settings, stats=NULL_STATS, record=None, row_settings=None,
+               pipeline=0):
+    """
+    逐张或多进程并行处理图片
+    
+    Args:
+        tasks (iterable): 产出 (图片文件, 输出路径, 附加状态) 的可迭代对象，按需逐个读取
+        jobs (int): 并行进程数，为1时在当前进程中逐张处理
+        settings (dict): 传给 add_watermark() 的处理参数（opacity、size 等）。
+            指定 max_memory 时，同时处理的图片的估算内存总和不超过该预算，
+            超出预算的大图等其他图片处理完后单独处理
+        stats (StageStats): 记录各阶段耗时的统计对象，默认不记录
+        record (callable): 每张图片处理结束后以 (附加状态, 输出路径, 错误信息, 耗时秒数) 调用，
+            失败时输出路径为None
+        row_settings (callable): 以附加状态调用，返回该图片要覆盖的处理参数，
+            None表示所有图片使用相同的参数
+        pipeline (int): 大于0时使用流水线模式，预读的图片数量，见 _run_pipeline()
+    
+    Returns:
+        list: 处理成功的文件列表
+    """
+    if pipeline > 0:
+        return _run_pipeline(tasks, jobs, settings, stats, record, row_settings, pipeline)
+    
+    if record is None:
+        def record(state, result_path, error, seconds):
+            pass
+    
+    def task_settings(state):
+        return dict(settings, **row_settings(state)) if row_settings else settings
+    
+    processed_files = []
+    
+    if jobs <= 1:
+        for index, (image_file, output_path, state) in enumerate(tasks, 1):
+            start = time.perf_counter()
+            try:
+                print(f"处理第 {index} 张图片: {image_file.name}")
+                result_path = add_watermark(str(image_file), output_path, stats=stats,
+                                            **task_settings(state))
+                processed_files.append(result_path)
+                record(state, result_path, None, time.perf_counter() - start)
+                print(f"✓ 完成: {result_path}")
                 
-                watermark_with_opacity.putdata(new_data)
-                watermark_resized = watermark_with_opacity
-            
-            # 计算水印位置（右下角，留边距）
-            margin = 12  # 与原Android项目保持一致
-            x = img.width - watermark_width - margin
-            y = img.height - watermark_height - margin
-            
-            # 粘贴水印
-            img.paste(watermark_resized, (x, y), watermark_resized)
-            
-            # 转换回RGB模式以保存为JPEG
-            if img.mode == 'RGBA':
-                rgb_img = Image.new('RGB', img.size, (255, 255, 255))
-                rgb_img.paste(img, mask=img.split()[-1])
-                img = rgb_img
-            
-            # 确定输出路径
-            if output_path is None:
-                file_path = Path(image_path)
-                output_path = file_path.parent / f"{file_path.stem}_watermarked{file_path.suffix}"
-            
-            # 保存图片
-            img.save(output_path, 'JPEG', quality=90)
+            except Exception as e:
+                print(f"✗ 错误: {e}")
+                record(state, None, str(e), time.perf_counter() - start)
+        return processed_files
+    
+    # 多进程并行处理，每个工作进程初始化时加载一次水印，结果按完成顺序返回
+    budget = settings.get('max_memory')
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker) as executor:
+        pending = {}
+        completed_count = 0
+        reserved = 0
+        for image_file, output_path, state in tasks:
+            image_settings = task_settings(state)
+            cost = 0
+            if budget:
+                cost = min(_estimate_task_memory(image_file, image_settings, output_path), budget)
             
-            return str(output_path)
+            # 限制排队中的任务数量，避免一次性提交全部任务；有内存预算时
+            # 还要等到已提交图片的估算内存加上本张不超过预算
+            while pending and (len(pending) >= jobs * 2 or (budget and reserved + cost > budget)):
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    completed_count += 1
+                    done_file, done_state, done_cost = pending.pop(future)
+                    reserved -= done_cost
+                    record(done_state, *_report_result(completed_count, done_file, future,
+                                                       processed_files, stats))
             
+            future = executor.submit(_add_watermark_in_worker, stats.enabled, str(image_file),
+                                     output_path, image_settings)
+            pending[future] = (image_file, state, cost)
+            reserved += cost
+        
+        for future in as_completed(pending):
+            completed_count += 1
+            done_file, done_state, _ = pending[future]
+            record(done_state, *_report_result(completed_count, done_file, future,
+                                               processed_files, stats))
+    return processed_files
+
+
+def _read_input(image_file, stats):
+    """
+    流水线读取阶段：把一张图片的数据全部读入内存
+    
+    Returns:
+        tuple: (图片数据, 耗时秒数, 错误信息)，读取失败时图片数据为None
+    """
+    start = time.perf_counter()
+    try:
+        with stats.stage('read'):
+            with open(image_file, 'rb') as f:
+                return f.read(), time.perf_counter() - start, None
+    except OSError as e:
+        return None, time.perf_counter() - start, f"读取图片 {image_file} 时出错: {e}"
+
+
+def _render_data(image_file, data, output_path, settings, stats):
+    """流水线处理阶段：为内存中的图片数据添加水印，返回按输出路径确定格式编码后的数据"""
+    output = io.BytesIO()
+    output_format = resolve_format(output_path, settings['output_format'])
+    try:
+        get_watermarker().process_stream(data, output, stats=stats,
+                                         **dict(settings, output_format=output_format))
+    except WatermarkError as e:
+        # 错误信息中带上图片路径，与逐张处理时一致
+        raise WatermarkError(f"处理图片 {image_file} 时出错: {e.__cause__ or e}") from e
+    return output.getvalue()
+
+
+def _render_data_in_worker(collect_stats, image_file, data, output_path, settings):
+    """
+    在工作进程中处理一张图片的数据，失败时与 _add_watermark_in_worker() 一样返回错误信息
+    
+    Returns:
+        tuple: (编码结果, 耗时秒数, 阶段记录, 错误信息)，失败时编码结果为None
+    """
+    start = time.perf_counter()
+    stats = StageStats() if collect_stats else NULL_STATS
+    try:
+        output, error = _render_data(image_file, data, output_path, settings, stats), None
     except Exception as e:
-        raise Exception(f"处理图片 {image_path} 时出错: {str(e)}")
+        output, error = None, str(e)
+    return output, time.perf_counter() - start, stats.to_dict() if collect_stats else None, error
+
+
+def _write_output(output_path, data, stats):
+    """流水线写出阶段：把编码结果写入输出文件，写入失败时不留下不完整的文件"""
+    with stats.stage('write'):
+        with open(output_path, 'wb') as f:
+            try:
+                f.write(data)
+            except OSError:
+                f.close()
+                os.remove(output_path)
+                raise
+    return output_path
+
+
+def _run_pipeline(tasks, jobs, settings, stats=NULL_STATS, record=None, row_settings=None,
+                  depth=PIPELINE_DEPTH):
+    """
+    按读取、处理、写出三个阶段流水线处理图片
+    
+    读取线程按任务顺序预读后续 depth 张图片的数据；处理阶段在当前进程（jobs 为1时）
+    或进程池中为内存中的数据添加水印；写出线程把编码结果写入输出文件。阶段之间的队列
+    都有上限（读取和写出各 depth 张，并行处理最多 2×jobs 张），三个阶段同时进行，
+    慢速磁盘或网络存储上的吞吐量取决于最慢的阶段，而不是各阶段耗时之和。
+    任务迭代和 record 回调都只在当前线程中调用。
+    
+    Args:
+        depth (int): 读取和写出阶段最多排队的图片数量
+        其余参数同 _run_tasks()，record 收到的耗时为处理阶段的耗时（读取失败时为读取耗时）
+    
+    Returns:
+        list: 处理成功的文件列表
+    """
+    if record is None:
+        def record(state, result_path, error, seconds):
+            pass
+    
+    def task_settings(state):
+        return dict(settings, **row_settings(state)) if row_settings else settings
+    
+    processed_files = []
+    tasks = iter(tasks)
+    # 读取和写出线程各用一个统计对象，结束后合并，避免多个线程同时修改同一个统计对象
+    read_stats = StageStats() if stats.enabled else NULL_STATS
+    write_stats = StageStats() if stats.enabled else NULL_STATS
+    reads = deque()    # (图片文件, 输出路径, 附加状态, 读取future)，按任务顺序
+    computing = {}     # 处理future -> (图片文件, 输出路径, 附加状态, 估算内存)
+    writes = deque()   # (图片文件, 附加状态, 写出future, 处理耗时)，按提交顺序
+    budget = settings.get('max_memory') if jobs > 1 else None
+    reserved = 0
+    completed_count = 0
+    
+    def fail(state, error, seconds=None):
+        print(f"✗ 错误: {error}")
+        record(state, None, error, seconds)
+    
+    def fill_reads():
+        """从任务中取出图片交给读取线程，直到预读了 depth 张"""
+        while len(reads) < depth:
+            task = next(tasks, None)
+            if task is None:
+                return
+            image_file, output_path, state = task
+            if output_path is None:
+                output_format = task_settings(state)['output_format']
+                output_path = str(image_file.parent / default_output_name(image_file, output_format))
+            reads.append((image_file, output_path, state,
+                          reader.submit(_read_input, image_file, read_stats)))
+    
+    def take_read():
+        """取出最早预读的图片（必要时等待读取完成），读取失败时记录错误并返回None"""
+        image_file, output_path, state, future = reads.popleft()
+        try:
+            data, seconds, error = future.result()
+        finally:
+            fill_reads()
+        if error:
+            fail(state, error, seconds)
+            return None
+        return image_file, output_path, state, data
+    
+    def finish_write():
+        """等待最早提交的写出完成并记录结果"""
+        image_file, state, future, seconds = writes.popleft()
+        try:
+            result_path = future.result()
+        except OSError as e:
+            fail(state, f"写入图片 {image_file} 的结果时出错: {e}", seconds)
+            return
+        processed_files.append(result_path)
+        record(state, result_path, None, seconds)
+        print(f"✓ 完成: {result_path}")
+    
+    def start_write(image_file, output_path, state, data, seconds):
+        """把编码结果交给写出线程，排队的结果达到 depth 个时先等待最早的写出完成"""
+        while len(writes) >= depth:
+            finish_write()
+        stats.count('bytes_written', len(data))
+        writes.append((image_file, state, writer.submit(_write_output, output_path, data, write_stats),
+                       seconds))
+    
+    def collect(done):
+        """把进程池中处理完成的图片交给写出线程"""
+        nonlocal reserved, completed_count
+        for future in done:
+            if future not in computing:
+                continue
+            image_file, output_path, state, cost = computing.pop(future)
+            reserved -= cost
+            completed_count += 1
+            print(f"处理第 {completed_count} 张图片: {image_file.name}")
+            try:
+                data, seconds, worker_stats, error = future.result()
+            except Exception as e:
+                fail(state, str(e))
+                continue
+            if worker_stats is not None:
+                stats.merge(worker_stats)
+            if error:
+                fail(state, error, seconds)
+                continue
+            start_write(image_file, output_path, state, data, seconds)
+    
+    with ThreadPoolExecutor(max_workers=1) as reader, ThreadPoolExecutor(max_workers=1) as writer:
+        pool = ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker) if jobs > 1 else None
+        try:
+            fill_reads()
+            while reads or computing:
+                if pool is None:
+                    # 在当前进程中逐张处理，读取线程和写出线程同时预读、写出其他图片
+                    item = take_read()
+                    if item is not None:
+                        image_file, output_path, state, data = item
+                        completed_count += 1
+                        print(f"处理第 {completed_count} 张图片: {image_file.name}")
+                        start = time.perf_counter()
+                        try:
+                            output = _render_data(image_file, data, output_path,
+                                                  task_settings(state), stats)
+                        except Exception as e:
+                            fail(state, str(e), time.perf_counter() - start)
+                        else:
+                            start_write(image_file, output_path, state, output,
+                                        time.perf_counter() - start)
+                else:
+                    # 已读取的图片按顺序提交给进程池，有内存预算时还要等到估算内存不超过预算
+                    while reads and len(computing) < jobs * 2 and (reads[0][3].done() or not computing):
+                        item = take_read()
+                        if item is None:
+                            continue
+                        image_file, output_path, state, data = item
+                        image_settings = task_settings(state)
+                        cost = 0
+                        if budget:
+                            cost = min(_estimate_task_memory(io.BytesIO(data), image_settings, output_path),
+                                       budget)
+                        while computing and budget and reserved + cost > budget:
+                            collect(wait(computing, return_when=FIRST_COMPLETED)[0])
+                        future = pool.submit(_render_data_in_worker, stats.enabled, image_file,
+                                             data, output_path, image_settings)
+                        computing[future] = (image_file, output_path, state, cost)
+                        reserved += cost
+                    if computing:
+                        # 等待任意一张图片处理完成，或下一张图片读取完成
+                        waiting = list(computing)
+                        if reads and len(computing) < jobs * 2:
+                            waiting.append(reads[0][3])
+                        collect(wait(waiting, return_when=FIRST_COMPLETED)[0])
+                while writes and writes[0][2].done():
+                    finish_write()
+            while writes:
+                finish_write()
+        finally:
+            if pool is not None:
+                pool.shutdown()
+    
+    if stats.enabled:
+        stats.merge(read_stats.to_dict())
+        stats.merge(write_stats.to_dict())
+    return processed_files
 
 
-def process_directory(input_dir, output_dir=None, opacity=70, size="auto"):
+def process_directory(input_dir, output_dir=None, opacity=70, size="auto", jobs=None,
+                      max_edge=None, max_pixels=None, recursive=False, incremental=False,
+                      manifest_path=None, output_format=None, save_options=None, stats=NULL_STATS,
+                      keep_metadata=(), auto_orient=True, max_memory=None, lossless_jpeg=False,
+                      position='bottom-right', layout='single', pipeline=0):
     """
     批量处理目录中的所有图片
     
@@ -125,6 +600,22 @@ def process_directory(input_dir, output_dir=None, opacity=70, size="auto"):
         output_dir (str): 输出目录，如果为None则在原目录下生成
         opacity (int): 透明度（30-100）
         size (str): 水印大小（auto/small/medium/large）
+        jobs (int): 并行进程数，如果为None则使用CPU核心数，为1时在当前进程中逐张处理
+        max_edge (int): 输出图片长边的最大像素数，None表示保持原尺寸
+        max_pixels (int): 输出图片像素总数的上限，None表示不限制
+        recursive (bool): 是否递归处理子目录
+        incremental (bool): 是否跳过输出已是最新的图片
+        manifest_path (str): 增量清单文件路径，如果为None则保存在输出目录（或输入目录）下
+        output_format (str): 输出格式（jpeg/png/webp），None表示与原图格式相同
+        save_options (dict): 按格式名称分组的编码参数
+        stats (StageStats): 记录各阶段耗时的统计对象，默认不记录
+        keep_metadata (iterable): 写入输出图片的原图元数据类型（exif/icc/xmp），默认不保留
+        auto_orient (bool): 是否按EXIF方向放置水印
+        max_memory (int): 内存预算（字节），同时处理的图片的估算内存总和不超过该值，None表示不限制
+        lossless_jpeg (bool): JPEG只重新编码水印覆盖的区域，其余数据原样保留
+        position (str): 水印位置
+        layout (str): 水印布局
+        pipeline (int): 大于0时按读取、处理、写出三个阶段流水线处理，预读的图片数量
     
     Returns:
         list: 处理成功的文件列表
@@ -133,57 +624,524 @@ def process_directory(input_dir, output_dir=None, opacity=70, size="auto"):
     if not input_path.exists():
         raise ValueError(f"输入目录不存在: {input_dir}")
     
-    # 支持的图片格式
-    image_extensions = {'.jpg', '.jpeg', '.png', '.bmp', '.gif', '.webp'}
+    # 边扫描边处理，不预先构建完整的文件列表
+    tasks = _iter_tasks(input_path, output_dir, recursive, output_format)
+    
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    
+    manifest = None
+    if incremental:
+        if manifest_path is None:
+            manifest_path = Path(output_dir or input_dir) / MANIFEST_NAME
+        manifest = IncrementalManifest(manifest_path)
+    settings = {'opacity': opacity, 'size': size, 'max_edge': max_edge, 'max_pixels': max_pixels,
+                'format': output_format, 'save_options': save_options,
+                'keep_metadata': sorted(keep_metadata), 'auto_orient': auto_orient,
+                'lossless_jpeg': lossless_jpeg, 'position': position, 'layout': layout}
+    
+    found_count = 0
+    skipped_count = 0
+    
+    def pending_tasks():
+        """过滤掉增量模式下无需处理的图片，产出 (图片文件, 输出路径, 源文件状态)"""
+        nonlocal found_count, skipped_count
+        for image_file, output_path in tasks:
+            if manifest is None:
+                found_count += 1
+                yield image_file, output_path, None
+                continue
+            # 跳过之前运行生成的输出图片（清单中记录的输出，以及清单建立之前生成的 *_watermarked 图片）
+            if manifest.is_output(image_file) or image_file.stem.endswith('_watermarked'):
+                continue
+            found_count += 1
+            key = image_file.relative_to(input_path).as_posix()
+            stat = image_file.stat()
+            if output_path is None:
+                # 未指定输出目录时与 add_watermark() 一样保存在原图所在目录
+                output_path = str(image_file.parent / default_output_name(image_file, output_format))
+            if manifest.is_up_to_date(key, stat, settings, output_path):
+                skipped_count += 1
+                continue
+            yield image_file, output_path, (key, stat)
+    
+    def record(source_state, result_path, error=None, seconds=None):
+        """在增量清单中记录处理成功的图片"""
+        if manifest is not None and source_state is not None and result_path:
+            manifest.record(source_state[0], source_state[1], settings, result_path)
     
-    # 找到所有图片文件
-    image_files = []
-    for ext in image_extensions:
-        image_files.extend(input_path.glob(f"*{ext}"))
-        image_files.extend(input_path.glob(f"*{ext.upper()}"))
+    try:
+        processed_files = _run_tasks(pending_tasks(), jobs,
+                                     _task_settings(opacity, size, max_edge, max_pixels, output_format,
+                                                    save_options, keep_metadata, auto_orient,
+                                                    max_memory, lossless_jpeg, position, layout),
+                                     stats, record, pipeline=pipeline)
+    finally:
+        if manifest is not None:
+            manifest.save()
     
-    if not image_files:
+    if found_count == 0:
         print(f"在目录 {input_dir} 中未找到图片文件")
-        return []
+    elif skipped_count:
+        print(f"跳过 {skipped_count} 张未变化的图片")
+        stats.count('skipped', skipped_count)
     
-    processed_files = []
+    return processed_files
+
+
+def iter_path_list(stream, null_separated=False):
+    """
+    逐个产出路径列表中的路径
     
-    for i, image_file in enumerate(image_files, 1):
-        try:
-            print(f"处理第 {i}/{len(image_files)} 张图片: {image_file.name}")
-            
+    按块读取，读到一个完整的路径就立即产出，适合从管道中一边接收一边处理
+    （例如 find -print0 的输出）。空行会被忽略。
+    
+    Args:
+        stream (file-like): 二进制输入流
+        null_separated (bool): 路径以 NUL 字符分隔，否则以换行分隔
+    
+    Yields:
+        str: 文件路径
+    """
+    separator = b'\0' if null_separated else b'\n'
+    read = getattr(stream, 'read1', stream.read)
+    remainder = b''
+    while True:
+        chunk = read(65536)
+        if not chunk:
+            break
+        *paths, remainder = (remainder + chunk).split(separator)
+        for path in paths:
+            if not null_separated:
+                path = path.rstrip(b'\r')
+            if path:
+                yield os.fsdecode(path)
+    if not null_separated:
+        remainder = remainder.rstrip(b'\r')
+    if remainder:
+        yield os.fsdecode(remainder)
+
+
+def process_path_list(list_path, output_dir=None, opacity=70, size="auto", jobs=None,
+                      max_edge=None, max_pixels=None, null_separated=False, output_format=None,
+                      save_options=None, stats=NULL_STATS, keep_metadata=(), auto_orient=True,
+                      max_memory=None, lossless_jpeg=False, position='bottom-right', layout='single',
+                      pipeline=0):
+    """
+    处理路径列表中的图片，路径边读取边处理
+    
+    Args:
+        list_path (str): 路径列表文件，"-" 表示从标准输入读取
+        output_dir (str): 输出目录，如果为None则在原图所在目录下生成
+        null_separated (bool): 路径以 NUL 字符分隔，否则以换行分隔
+        其余参数同 process_directory()
+    
+    Returns:
+        list: 处理成功的文件列表
+    """
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    
+    def tasks(stream):
+        """产出 (图片文件, 输出路径, None)，跳过不存在的文件"""
+        for path in iter_path_list(stream, null_separated):
+            image_file = Path(path)
+            if not image_file.is_file():
+                print(f"✗ 错误: 文件不存在 {path}")
+                continue
+            output_path = None
             if output_dir:
-                output_path = Path(output_dir) / f"{image_file.stem}_watermarked{image_file.suffix}"
-                os.makedirs(output_dir, exist_ok=True)
-            else:
-                output_path = None
-            
-            result_path = add_watermark(str(image_file), str(output_path) if output_path else None, 
-                                      opacity, size)
-            processed_files.append(result_path)
-            print(f"✓ 完成: {result_path}")
-            
-        except Exception as e:
-            print(f"✗ 错误: {e}")
+                output_path = os.path.join(output_dir, default_output_name(image_file, output_format))
+            yield image_file, output_path, None
     
-    return processed_files
+    settings = _task_settings(opacity, size, max_edge, max_pixels, output_format, save_options,
+                              keep_metadata, auto_orient, max_memory, lossless_jpeg, position, layout)
+    if list_path == '-':
+        return _run_tasks(tasks(sys.stdin.buffer), jobs, settings, stats, pipeline=pipeline)
+    with open(list_path, 'rb') as f:
+        return _run_tasks(tasks(f), jobs, settings, stats, pipeline=pipeline)
+
+
+# 批处理任务文件中每行可以指定的字段
+JOB_FIELDS = ('input', 'output', 'opacity', 'size', 'position', 'layout', 'format')
+
+# 批处理任务文件支持的输出格式
+JOB_FORMATS = ('jpeg', 'png', 'webp')
+
+
+def iter_job_rows(job_path):
+    """
+    逐行读取批处理任务文件
+    
+    扩展名为 .csv 时按带表头的CSV读取，否则按 JSON Lines（每行一个JSON对象）读取。
+    边读取边产出，不预先读入整个文件；空行会被忽略。
+    
+    Args:
+        job_path (str): 任务文件路径
+    
+    Yields:
+        tuple: (行号, 行内容)，CSV 为字段字典，JSON Lines 为未解析的行文本
+    """
+    with open(job_path, 'r', encoding='utf-8-sig', newline='') as f:
+        if Path(job_path).suffix.lower() == '.csv':
+            reader = csv.DictReader(f)
+            for row in reader:
+                if any(value and value.strip() for value in row.values() if isinstance(value, str)):
+                    yield reader.line_num, row
+        else:
+            for line_number, line in enumerate(f, 1):
+                if line.strip():
+                    yield line_number, line
+
+
+def parse_job_row(row):
+    """
+    校验批处理任务文件中的一行
+    
+    Args:
+        row (dict | str): CSV 的字段字典，或 JSON Lines 的一行文本（字段见 JOB_FIELDS，
+            空白字段表示使用命令行指定的默认值）
+    
+    Returns:
+        tuple: (输入路径, 输出路径或None, 该行覆盖的处理参数)
+    
+    Raises:
+        ValueError: 格式错误、缺少输入路径或参数无效
+    """
+    if isinstance(row, str):
+        row = json.loads(row)
+        if not isinstance(row, dict):
+            raise ValueError("每行必须是一个JSON对象")
+    if None in row:
+        raise ValueError("字段数量多于表头")
+    row = {key.strip(): value.strip() if isinstance(value, str) else value
+           for key, value in row.items() if value is not None and value != ''}
+    unknown_fields = set(row) - set(JOB_FIELDS)
+    if unknown_fields:
+        raise ValueError(f"未知的字段 {', '.join(sorted(unknown_fields))}，可选: {', '.join(JOB_FIELDS)}")
+    if 'input' not in row:
+        raise ValueError("缺少 input 字段")
+    
+    overrides = {}
+    if 'opacity' in row:
+        opacity = int(row['opacity'])
+        if not 30 <= opacity <= 100:
+            raise ValueError("透明度必须在 30-100 之间")
+        overrides['opacity'] = opacity
+    if 'size' in row:
+        size = row['size']
+        if size not in SIZE_DIVISORS:
+            # 数字表示相对于 auto 大小的倍数
+            size = float(size)
+            if size <= 0:
+                raise ValueError("水印大小必须大于 0")
+        overrides['size'] = size
+    if 'position' in row:
+        if row['position'] not in POSITIONS:
+            raise ValueError(f"不支持的水印位置 {row['position']}，可选: {', '.join(POSITIONS)}")
+        overrides['position'] = row['position']
+    if 'layout' in row:
+        if row['layout'] not in LAYOUTS:
+            raise ValueError(f"不支持的水印布局 {row['layout']}，可选: {', '.join(LAYOUTS)}")
+        overrides['layout'] = row['layout']
+    if 'format' in row:
+        output_format = str(row['format']).lower()
+        if output_format not in JOB_FORMATS:
+            raise ValueError(f"不支持的输出格式 {row['format']}，可选: {', '.join(JOB_FORMATS)}")
+        overrides['output_format'] = output_format
+    return str(row['input']), row.get('output'), overrides
+
+
+class JobResultLog:
+    """
+    批处理结果日志
+    
+    每处理完一行立即写入一条记录（行号、输入、输出、状态、错误信息、耗时），
+    扩展名为 .csv 时写为CSV，否则写为 JSON Lines。
+    """
+    
+    FIELDS = ('line', 'input', 'output', 'status', 'error', 'seconds')
+    
+    def __init__(self, path):
+        self.path = Path(path)
+        self._file = open(self.path, 'w', encoding='utf-8', newline='')
+        self._writer = None
+        if self.path.suffix.lower() == '.csv':
+            self._writer = csv.DictWriter(self._file, fieldnames=self.FIELDS)
+            self._writer.writeheader()
+        self.succeeded = 0
+        self.failed = 0
+    
+    def write(self, line, input_path, output_path=None, error=None, seconds=None):
+        """记录一行的处理结果，error 为None表示成功"""
+        entry = {
+            'line': line,
+            'input': input_path,
+            'output': output_path,
+            'status': 'error' if error else 'ok',
+            'error': error,
+            'seconds': round(seconds, 4) if seconds is not None else None,
+        }
+        if error:
+            self.failed += 1
+        else:
+            self.succeeded += 1
+        if self._writer is not None:
+            self._writer.writerow(entry)
+        else:
+            self._file.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        self._file.flush()
+    
+    def close(self):
+        self._file.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def _job_row_input(row, base_dir):
+    """尽量从无效的行中取出输入路径，用于结果日志，取不到时返回None"""
+    if isinstance(row, str):
+        try:
+            row = json.loads(row)
+        except ValueError:
+            return None
+    if isinstance(row, dict) and isinstance(row.get('input'), str) and row['input'].strip():
+        return str(base_dir / row['input'].strip())
+    return None
+
+
+def default_job_log_path(job_path):
+    """结果日志的默认路径：任务文件旁的 <任务文件名>.results.jsonl（CSV任务文件为 .results.csv）"""
+    job_path = Path(job_path)
+    extension = '.csv' if job_path.suffix.lower() == '.csv' else '.jsonl'
+    return job_path.with_name(f"{job_path.stem}.results{extension}")
+
+
+def process_job_file(job_path, settings, output_dir=None, jobs=None, log_path=None,
+                     stats=NULL_STATS, pipeline=0):
+    """
+    按批处理任务文件处理图片，每行可以指定不同的输入、输出和处理参数
+    
+    所有行在同一次运行中处理，共用已加载的水印和水印缓存（并行时每个工作进程各一份），
+    每行的处理结果和耗时写入结果日志。
+    
+    Args:
+        job_path (str): 任务文件路径（.csv 或 JSON Lines），行内的相对输入路径相对于任务文件所在目录
+        settings (dict): 行内未指定时使用的处理参数，见 _task_settings()
+        output_dir (str): 输出目录，行内的相对输出路径相对于该目录（未指定时相对于任务文件所在目录）；
+            未指定输出路径的行输出到该目录，或原图所在目录
+        jobs (int): 并行进程数，如果为None则使用CPU核心数
+        log_path (str): 结果日志路径，None表示使用 default_job_log_path()
+        stats (StageStats): 记录各阶段耗时的统计对象，默认不记录
+        pipeline (int): 大于0时按读取、处理、写出三个阶段流水线处理，预读的图片数量
+    
+    Returns:
+        tuple: (处理成功的文件列表, 结果日志路径)
+    """
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    job_path = Path(job_path)
+    base_dir = job_path.parent
+    if log_path is None:
+        log_path = default_job_log_path(job_path)
+    
+    with JobResultLog(log_path) as log:
+        def tasks():
+            """产出 (图片文件, 输出路径, (行号, 输入路径, 该行的处理参数))，无效的行直接记录错误"""
+            for line_number, row in iter_job_rows(job_path):
+                try:
+                    input_path, output_path, overrides = parse_job_row(row)
+                except (ValueError, TypeError) as e:
+                    print(f"✗ 错误: 第 {line_number} 行: {e}")
+                    log.write(line_number, _job_row_input(row, base_dir), error=str(e))
+                    continue
+                
+                image_file = base_dir / input_path
+                if output_path is None:
+                    output_format = overrides.get('output_format', settings['output_format'])
+                    output_parent = Path(output_dir) if output_dir else image_file.parent
+                    output_path = output_parent / default_output_name(image_file, output_format)
+                else:
+                    output_path = Path(output_dir or base_dir) / output_path
+                os.makedirs(output_path.parent, exist_ok=True)
+                yield image_file, str(output_path), (line_number, str(image_file), overrides)
+        
+        def record(state, result_path, error, seconds):
+            line_number, input_path, _ = state
+            log.write(line_number, input_path, result_path, error, seconds)
+        
+        processed_files = _run_tasks(tasks(), jobs, settings, stats, record,
+                                     row_settings=lambda state: state[2], pipeline=pipeline)
+    return processed_files, str(log_path)
+
+
+def process_stdio(image_path, output, opacity=70, size="auto", max_edge=None, max_pixels=None,
+                  output_format=None, save_options=None, stats=NULL_STATS, keep_metadata=(),
+                  auto_orient=True, max_memory=None, lossless_jpeg=False,
+                  position='bottom-right', layout='single'):
+    """
+    处理单张图片，输入或输出可以是标准输入/标准输出
+    
+    Args:
+        image_path (str): 输入图片路径，"-" 表示从标准输入读取
+        output (str | file-like): 输出图片路径，或写入图片数据的二进制输出流（如标准输出）
+        output_format (str): 输出格式，None时写入文件按扩展名判断，写入输出流时与原图格式相同
+        其余参数同 add_watermark()
+    
+    Returns:
+        str: 实际使用的格式名称
+    """
+    # 标准输入一次读入内存（不能回退读取），文件则直接交给Pillow按需读取
+    if image_path == '-':
+        source = sys.stdin.buffer.read()
+    else:
+        source = open(image_path, 'rb')
+    
+    try:
+        if not isinstance(output, (str, os.PathLike)):
+            image_format = get_watermarker().process_stream(source, output, opacity, size, max_edge,
+                                                            max_pixels, output_format, save_options,
+                                                            stats, keep_metadata, auto_orient,
+                                                            max_memory, lossless_jpeg, position,
+                                                            layout)
+            output.flush()
+        else:
+            output_format = resolve_format(output, output_format)
+            with open(output, 'wb') as f:
+                try:
+                    image_format = get_watermarker().process_stream(source, f, opacity, size,
+                                                                    max_edge, max_pixels,
+                                                                    output_format, save_options,
+                                                                    stats, keep_metadata,
+                                                                    auto_orient, max_memory,
+                                                                    lossless_jpeg, position, layout)
+                except Exception:
+                    # 不留下不完整的输出文件
+                    f.close()
+                    os.remove(output)
+                    raise
+    finally:
+        if image_path != '-':
+            source.close()
+    
+    if stats.enabled:
+        if image_path != '-':
+            stats.count('bytes_read', os.path.getsize(image_path))
+        if isinstance(output, (str, os.PathLike)):
+            stats.count('bytes_written', os.path.getsize(output))
+    return image_format
+
+
+def build_save_options(args):
+    """根据命令行参数生成按格式分组的编码参数（未指定的参数使用默认值）"""
+    return {
+        'JPEG': {
+            'quality': args.quality,
+            'subsampling': args.subsampling,
+            'progressive': args.progressive or None,
+            'optimize': args.optimize or None,
+        },
+        'PNG': {'compress_level': args.compress_level},
+        'WEBP': {
+            'quality': args.quality,
+            'method': args.webp_method,
+            'lossless': args.lossless or None,
+        },
+    }
 
 
 def main():
     """主函数"""
-    parser = argparse.ArgumentParser(description="AI 水印工具 - 为照片添加豆包AI生成水印")
+    # serve 子命令：启动常驻水印服务
+    if len(sys.argv) > 1 and sys.argv[1] == 'serve':
+        serve_main(sys.argv[2:])
+        return
+    
+    parser = argparse.ArgumentParser(description="AI 水印工具 - 为照片添加豆包AI生成水印",
+                                     epilog="启动常驻服务: %(prog)s serve --help")
     
     # 输入参数
     group = parser.add_mutually_exclusive_group(required=True)
-    group.add_argument('-f', '--file', help='单个图片文件路径')
+    group.add_argument('-f', '--file', help='单个图片文件路径，"-" 表示从标准输入读取')
     group.add_argument('-d', '--dir', help='图片目录路径（批量处理）')
+    group.add_argument('--from-list', metavar='PATH',
+                       help='从文件读取待处理的图片路径（每行一个），"-" 表示从标准输入读取，边读取边处理')
+    group.add_argument('--batch', metavar='PATH',
+                       help='批处理任务文件（.csv 或 JSON Lines），每行可指定 '
+                            f'{"/".join(JOB_FIELDS)}，未指定的参数使用命令行的值')
     
     # 选项参数
-    parser.add_argument('-o', '--output', help='输出路径（文件或目录）')
+    parser.add_argument('-o', '--output', help='输出路径（文件或目录），"-" 表示写入标准输出')
+    parser.add_argument('-0', '--null', action='store_true',
+                       help='--from-list 的路径以 NUL 字符分隔（配合 find -print0）')
+    parser.add_argument('--batch-log', metavar='PATH',
+                       help='--batch 每行处理结果和耗时的日志路径（.csv 或 JSON Lines，'
+                            '默认: 任务文件旁的 <任务文件名>.results.jsonl，CSV任务文件为 .results.csv）')
     parser.add_argument('-p', '--opacity', type=int, default=70, 
                        help='透明度 30-100 (默认: 70)')
     parser.add_argument('-s', '--size', choices=['auto', 'small', 'medium', 'large'], 
                        default='auto', help='水印大小 (默认: auto)')
+    parser.add_argument('--position', choices=POSITIONS, default='bottom-right',
+                       help='水印位置，auto 按图片内容选择水印最清晰的角落 (默认: bottom-right)')
+    parser.add_argument('--layout', choices=LAYOUTS, default='single',
+                       help='水印布局：single 单个，corners 四角，tiled 平铺，diagonal 倾斜错行平铺 '
+                            '(默认: single)')
+    parser.add_argument('-r', '--recursive', action='store_true',
+                       help='递归处理子目录，输出目录保持相同的目录结构')
+    parser.add_argument('--incremental', action='store_true',
+                       help='增量处理：跳过源图片和参数都未变化的图片')
+    parser.add_argument('--manifest',
+                       help=f'增量清单文件路径 (默认: 输出目录下的 {MANIFEST_NAME})')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1,
+                       help='批量处理时的并行进程数 (默认: CPU核心数)')
+    parser.add_argument('--pipeline', type=int, nargs='?', const=PIPELINE_DEPTH, default=0,
+                       metavar='N',
+                       help='批量处理时按读取、处理、写出三个阶段流水线处理：后台预读后续 N 张图片、'
+                            f'后台写出结果，适合慢速磁盘或网络存储 (不指定 N 时为 {PIPELINE_DEPTH})')
+    parser.add_argument('--max-edge', type=int,
+                       help='输出图片长边的最大像素数，超过时按比例缩小 (默认: 保持原尺寸)')
+    parser.add_argument('--max-pixels', type=int,
+                       help='输出图片像素总数上限，超过时按比例缩小 (默认: 不限制)')
+    parser.add_argument('--max-memory', type=int, metavar='MB',
+                       help='图片处理的内存预算（MB，不含每个进程的基础占用）。并行处理时大图排队等待，'
+                            '单张超出预算时按条带处理，仍超出则报错跳过 (默认: 不限制)')
+    
+    # 输出格式和编码参数
+    parser.add_argument('--format', choices=['jpeg', 'png', 'webp'],
+                       help='输出格式 (默认: 根据输出文件扩展名，与原图相同)')
+    parser.add_argument('--quality', type=int,
+                       help='JPEG/WebP 编码质量 1-100 (默认: 90)')
+    parser.add_argument('--subsampling', choices=['4:4:4', '4:2:2', '4:2:0'],
+                       help='JPEG 色度抽样方式')
+    parser.add_argument('--progressive', action='store_true', help='输出渐进式 JPEG')
+    parser.add_argument('--optimize', action='store_true', help='优化 JPEG 霍夫曼表（更小但更慢）')
+    parser.add_argument('--compress-level', type=int, choices=range(10), metavar='0-9',
+                       help='PNG 压缩级别，0最快9最小 (默认: 6)')
+    parser.add_argument('--webp-method', type=int, choices=range(7), metavar='0-6',
+                       help='WebP 编码方法，0最快6最小 (默认: 4)')
+    parser.add_argument('--lossless', action='store_true', help='使用无损 WebP 编码')
+    parser.add_argument('--lossless-jpeg', action='store_true',
+                       help='JPEG原图输出为JPEG时只重新编码水印覆盖的区域，其余数据原样保留'
+                            '（需要原图带重启标记，否则改为完整重新编码）')
+    
+    # 元数据和方向
+    parser.add_argument('--keep-metadata', nargs='?', const=','.join(METADATA_KINDS), default='',
+                       metavar='exif,icc,xmp',
+                       help='保留原图元数据，可用逗号指定类型 (不指定类型时保留全部)')
+    parser.add_argument('--ignore-orientation', action='store_true',
+                       help='忽略EXIF方向，水印按图片存储方向放在右下角')
+    
+    # 性能统计
+    parser.add_argument('--stats', action='store_true',
+                       help='处理结束后输出各阶段耗时、读写字节数和缓存命中率')
+    parser.add_argument('--stats-json', metavar='PATH',
+                       help='将统计结果保存为JSON文件（隐含 --stats）')
     
     args = parser.parse_args()
     
@@ -192,6 +1150,58 @@ def main():
         print("错误: 透明度必须在 30-100 之间")
         sys.exit(1)
     
+    # 验证并行进程数参数
+    if args.jobs < 1:
+        print("错误: 并行进程数必须大于等于 1")
+        sys.exit(1)
+    
+    # 验证流水线预读数量参数
+    if args.pipeline < 0:
+        print("错误: 流水线预读数量必须大于等于 0")
+        sys.exit(1)
+    
+    # 验证输出尺寸参数
+    if (args.max_edge is not None and args.max_edge < 1) or \
+            (args.max_pixels is not None and args.max_pixels < 1):
+        print("错误: 输出尺寸上限必须大于 0")
+        sys.exit(1)
+    
+    # 验证编码质量参数
+    if args.quality is not None and not 1 <= args.quality <= 100:
+        print("错误: 编码质量必须在 1-100 之间")
+        sys.exit(1)
+    
+    # 标准输出只能写入一张图片
+    if args.output == '-' and not args.file:
+        print("错误: 只有处理单个图片时才能输出到标准输出")
+        sys.exit(1)
+    
+    # 图片数据写入标准输出时，提示信息改为输出到标准错误，避免混入图片数据
+    if args.file == '-' and args.output is None:
+        args.output = '-'
+    image_output = args.output
+    if args.output == '-':
+        sys.stdout.flush()
+        image_output = sys.stdout.buffer
+        sys.stdout = sys.stderr
+    
+    # 验证元数据类型参数
+    keep_metadata = tuple(kind.strip().lower() for kind in args.keep_metadata.split(',') if kind.strip())
+    unknown_kinds = set(keep_metadata) - set(METADATA_KINDS)
+    if unknown_kinds:
+        print(f"错误: 未知的元数据类型 {', '.join(sorted(unknown_kinds))}，可选: {', '.join(METADATA_KINDS)}")
+        sys.exit(1)
+    auto_orient = not args.ignore_orientation
+    
+    # 验证内存预算参数
+    if args.max_memory is not None and args.max_memory < 1:
+        print("错误: 内存预算必须大于 0")
+        sys.exit(1)
+    max_memory = args.max_memory * 1024 * 1024 if args.max_memory else None
+    
+    save_options = build_save_options(args)
+    stats = StageStats() if args.stats or args.stats_json else NULL_STATS
+    
     # 检查水印图片是否存在
     if not Path("doubao_ai_watermark.png").exists():
         print("错误: 未找到豆包AI水印图片文件 'doubao_ai_watermark.png'")
@@ -199,7 +1209,22 @@ def main():
         sys.exit(1)
     
     try:
-        if args.file:
+        if args.file == '-' or args.output == '-':
+            # 通过标准输入/标准输出处理单张图片
+            source = "标准输入" if args.file == '-' else args.file
+            if source == args.file and not os.path.exists(args.file):
+                print(f"错误: 文件不存在 {args.file}")
+                sys.exit(1)
+            
+            print(f"处理图片: {source}")
+            print(f"参数: 透明度={args.opacity}%, 大小={args.size}")
+            process_stdio(args.file, image_output, args.opacity, args.size, args.max_edge,
+                          args.max_pixels, args.format, save_options, stats, keep_metadata,
+                          auto_orient, max_memory, args.lossless_jpeg,
+                          args.position, args.layout)
+            print(f"✓ 完成: {'标准输出' if args.output == '-' else args.output}")
+            
+        elif args.file:
             # 处理单个文件
             if not os.path.exists(args.file):
                 print(f"错误: 文件不存在 {args.file}")
@@ -207,15 +1232,55 @@ def main():
             
             print(f"处理图片: {args.file}")
             print(f"参数: 透明度={args.opacity}%, 大小={args.size}")
-            result_path = add_watermark(args.file, args.output, args.opacity, args.size)
+            result_path = add_watermark(args.file, args.output, args.opacity, args.size,
+                                        args.max_edge, args.max_pixels, args.format, save_options,
+                                        stats, keep_metadata, auto_orient, max_memory,
+                                        args.lossless_jpeg, args.position, args.layout)
             print(f"✓ 完成: {result_path}")
             
         elif args.dir:
             # 批量处理目录
             print(f"批量处理目录: {args.dir}")
-            print(f"参数: 透明度={args.opacity}%, 大小={args.size}")
-            processed_files = process_directory(args.dir, args.output, args.opacity, args.size)
+            print(f"参数: 透明度={args.opacity}%, 大小={args.size}, 并行进程数={args.jobs}")
+            processed_files = process_directory(args.dir, args.output, args.opacity, args.size,
+                                                args.jobs, args.max_edge, args.max_pixels,
+                                                args.recursive, args.incremental, args.manifest,
+                                                args.format, save_options, stats, keep_metadata,
+                                                auto_orient, max_memory, args.lossless_jpeg,
+                                                args.position, args.layout, args.pipeline)
+            print(f"\n处理完成! 共处理 {len(processed_files)} 张图片")
+            
+        elif args.from_list:
+            # 处理路径列表中的图片
+            print(f"处理路径列表: {'标准输入' if args.from_list == '-' else args.from_list}")
+            print(f"参数: 透明度={args.opacity}%, 大小={args.size}, 并行进程数={args.jobs}")
+            processed_files = process_path_list(args.from_list, args.output, args.opacity, args.size,
+                                                args.jobs, args.max_edge, args.max_pixels, args.null,
+                                                args.format, save_options, stats, keep_metadata,
+                                                auto_orient, max_memory, args.lossless_jpeg,
+                                                args.position, args.layout, args.pipeline)
+            print(f"\n处理完成! 共处理 {len(processed_files)} 张图片")
+            
+        elif args.batch:
+            # 按批处理任务文件处理，每行使用各自的参数
+            print(f"处理批处理任务: {args.batch}")
+            print(f"默认参数: 透明度={args.opacity}%, 大小={args.size}, 并行进程数={args.jobs}")
+            settings = _task_settings(args.opacity, args.size, args.max_edge, args.max_pixels,
+                                      args.format, save_options, keep_metadata, auto_orient,
+                                      max_memory, args.lossless_jpeg, args.position, args.layout)
+            processed_files, log_path = process_job_file(args.batch, settings, args.output,
+                                                         args.jobs, args.batch_log, stats,
+                                                         args.pipeline)
             print(f"\n处理完成! 共处理 {len(processed_files)} 张图片")
+            print(f"处理结果已保存到: {log_path}")
+        
+        if stats.enabled:
+            print()
+            print(stats.format_report())
+            if args.stats_json:
+                with open(args.stats_json, 'w', encoding='utf-8') as f:
+                    json.dump(stats.summary(), f, ensure_ascii=False, indent=2)
+                print(f"统计结果已保存到: {args.stats_json}")
             
     except Exception as e:
         print(f"错误: {e}")
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+AI 水印工具 - 性能基准测试
+在本地生成不同分辨率和模式的测试图片，分别统计解码、水印准备、合成、编码
+各阶段的耗时，以及命令行版本和图形界面版本的整体吞吐量，结果保存为JSON文件
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import PIL
+from PIL import Image
+
+import ai_watermark_cli
+from watermark_engine import Watermarker, save_image
+from watermark_stats import StageStats
+
+try:
+    import resource
+except ImportError:  # Windows 没有 resource 模块
+    resource = None
+
+# 测试用例：(名称, 模式, 尺寸, 保存格式)
+BENCHMARK_CASES = [
+    ('rgb_vga', 'RGB', (640, 480), 'JPEG'),
+    ('rgb_1080p', 'RGB', (1920, 1080), 'JPEG'),
+    ('rgb_4k', 'RGB', (3840, 2160), 'JPEG'),
+    ('rgba_1080p', 'RGBA', (1920, 1080), 'PNG'),
+    ('p_1080p', 'P', (1920, 1080), 'PNG'),
+    ('l_4k', 'L', (3840, 2160), 'JPEG'),
+]
+
+# 大图测试用例（约5000万像素）
+LARGE_CASES = [
+    ('rgb_50mp', 'RGB', (8660, 5774), 'JPEG'),
+]
+
+# 各格式对应的文件扩展名
+CASE_EXTENSIONS = {'JPEG': '.jpg', 'PNG': '.png'}
+
+# 图形界面版本手动尺寸滑轨默认值（50%）对应的水印大小
+GUI_SIZE_SETTING = 0.1 + 0.5 * 1.4
+
+
+def generate_image(mode, size):
+    """生成带噪声和渐变的测试图片，避免纯色图片让编码器过快"""
+    noise = Image.effect_noise(size, 64)
+    gradient = Image.linear_gradient('L').resize(size)
+    rgb = Image.merge('RGB', (noise, gradient, noise.transpose(Image.Transpose.FLIP_LEFT_RIGHT)))
+    if mode == 'RGBA':
+        return Image.merge('RGBA', (*rgb.split(), gradient))
+    if mode == 'P':
+        return rgb.quantize(256)
+    return rgb.convert(mode)
+
+
+def peak_rss_mb():
+    """当前进程的峰值内存占用（MB），无法获取时返回None"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 以KB为单位，macOS 以字节为单位
+    if sys.platform == 'darwin':
+        return peak / (1024 * 1024)
+    return peak / 1024
+
+
+def time_stages(watermarker, image_path, image_format, size, opacity):
+    """
+    分阶段处理一张图片并计时（编码写入内存，不计磁盘写入）
+
+    Returns:
+        dict: 各阶段耗时（秒）
+    """
+    stats = StageStats()
+
+    with Image.open(image_path) as img:
+        with stats.stage('decode'):
+            img.load()
+
+        # 清空缓存，统计首次准备水印（缩放+透明度）的开销
+        watermarker.cache.clear()
+        img = watermarker.apply(img, opacity, size, stats)
+
+        with stats.stage('encode'):
+            save_image(img, io.BytesIO(), image_format)
+
+    return {stage: durations[0] for stage, durations in stats.durations.items()}
+
+
+def load_gui_add_watermark(watermark):
+    """
+    获取可直接调用的图形界面版本处理函数（不创建窗口）
+
+    Returns:
+        callable: add_watermark(image_path, output_path, opacity)，无法导入tkinter时返回None
+    """
+    try:
+        from ai_watermark import AIWatermarkApp
+    except ImportError as e:
+        print(f"跳过图形界面版本: {e}")
+        return None
+
+    app = AIWatermarkApp.__new__(AIWatermarkApp)
+    app.watermarker = Watermarker(watermark)
+
+    def add_watermark(image_path, output_path, opacity):
+        return app.add_watermark(image_path, output_path, opacity, GUI_SIZE_SETTING)
+
+    return add_watermark
+
+
+def run_case(case, work_dir, watermark, repeat, opacity, gui_add_watermark):
+    """运行一个测试用例，返回每条处理路径的统计结果"""
+    name, mode, size, image_format = case
+    extension = CASE_EXTENSIONS[image_format]
+    image_path = os.path.join(work_dir, f"{name}{extension}")
+    output_path = os.path.join(work_dir, f"{name}_watermarked{extension}")
+    generate_image(mode, size).save(image_path, image_format)
+    megapixels = size[0] * size[1] / 1_000_000
+
+    paths = {
+        'cli': ('auto', lambda: ai_watermark_cli.add_watermark(image_path, output_path, opacity)),
+    }
+    if gui_add_watermark is not None:
+        paths['gui'] = (GUI_SIZE_SETTING, lambda: gui_add_watermark(image_path, output_path, opacity))
+
+    watermarker = Watermarker(watermark)
+    results = []
+    for path_name, (size_setting, end_to_end) in paths.items():
+        # 先不计时地运行一次，排除首次调用的一次性开销（如首次按扩展名查找格式时加载全部图片插件），
+        # 否则每次运行的第一条结果偏慢，不同运行之间无法比较
+        time_stages(watermarker, image_path, image_format, size_setting, opacity)
+        end_to_end()
+
+        stage_totals = {}
+        for _ in range(repeat):
+            for stage, elapsed in time_stages(watermarker, image_path, image_format,
+                                              size_setting, opacity).items():
+                stage_totals[stage] = stage_totals.get(stage, 0.0) + elapsed
+
+        start = time.perf_counter()
+        for _ in range(repeat):
+            end_to_end()
+        end_to_end_seconds = (time.perf_counter() - start) / repeat
+
+        results.append({
+            'path': path_name,
+            'case': name,
+            'mode': mode,
+            'format': image_format,
+            'width': size[0],
+            'height': size[1],
+            'megapixels': round(megapixels, 3),
+            'stages': {stage: total / repeat for stage, total in stage_totals.items()},
+            'end_to_end': end_to_end_seconds,
+            'images_per_sec': 1 / end_to_end_seconds,
+            'mp_per_sec': megapixels / end_to_end_seconds,
+            'peak_rss_mb': peak_rss_mb(),
+        })
+
+    os.remove(image_path)
+    if os.path.exists(output_path):
+        os.remove(output_path)
+    return results
+
+
+def print_result(result):
+    """输出一条统计结果"""
+    stages = ", ".join(f"{stage}={seconds * 1000:.1f}ms" for stage, seconds in result['stages'].items())
+    print(f"[{result['path']}] {result['case']:<12} {result['images_per_sec']:8.2f} 张/秒 "
+          f"{result['mp_per_sec']:8.2f} MP/秒  ({stages})")
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="AI 水印工具 - 性能基准测试")
+    parser.add_argument('-o', '--output', default='benchmark_results.json',
+                       help='结果JSON文件路径 (默认: benchmark_results.json)')
+    parser.add_argument('-n', '--repeat', type=int, default=3,
+                       help='每个用例的重复次数 (默认: 3)')
+    parser.add_argument('-p', '--opacity', type=int, default=70,
+                       help='透明度 30-100 (默认: 70)')
+    parser.add_argument('--skip-large', action='store_true',
+                       help='跳过约5000万像素的大图用例')
+    parser.add_argument('--no-gui', action='store_true',
+                       help='不测试图形界面版本')
+    args = parser.parse_args()
+
+    if args.repeat < 1:
+        print("错误: 重复次数必须大于等于 1")
+        sys.exit(1)
+
+    # 水印图片按相对路径加载，切换到脚本所在目录运行
+    output_file = os.path.abspath(args.output)
+    os.chdir(Path(__file__).resolve().parent)
+    watermark = ai_watermark_cli.get_watermarker().watermark
+    gui_add_watermark = None if args.no_gui else load_gui_add_watermark(watermark)
+
+    cases = BENCHMARK_CASES if args.skip_large else BENCHMARK_CASES + LARGE_CASES
+    results = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        for case in cases:
+            for result in run_case(case, work_dir, watermark, args.repeat, args.opacity,
+                                   gui_add_watermark):
+                print_result(result)
+                results.append(result)
+
+    report = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'pillow': PIL.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'repeat': args.repeat,
+        'opacity': args.opacity,
+        'peak_rss_mb': peak_rss_mb(),
+        'results': results,
+    }
+    with open(output_file, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n结果已保存到: {output_file}")
+
+
+if __name__ == "__main__":
+    main()
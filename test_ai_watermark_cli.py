@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+命令行版本批处理的回归测试
+
+    python -m pytest -q
+"""
+
+import json
+from pathlib import Path
+
+import pytest
+from PIL import Image
+
+import ai_watermark_cli
+
+HERE = Path(__file__).resolve().parent
+
+
+@pytest.mark.parametrize('jobs, pipeline', [(1, 0), (2, 0), (1, 2), (2, 2)])
+def test_job_log_records_seconds_for_failed_rows(tmp_path, monkeypatch, jobs, pipeline):
+    # 命令行版本从当前目录加载水印图片
+    monkeypatch.chdir(HERE)
+    Image.new('RGB', (320, 240), 'gray').save(tmp_path / 'ok.jpg')
+    (tmp_path / 'bad.jpg').write_bytes(b'not an image')
+    job_path = tmp_path / 'jobs.jsonl'
+    job_path.write_text('\n'.join(json.dumps({'input': name})
+                                  for name in ('ok.jpg', 'missing.jpg', 'bad.jpg')), encoding='utf-8')
+
+    settings = ai_watermark_cli._task_settings(70, 'auto', None, None, None, None, (), True, None,
+                                               False, 'bottom-right', 'single')
+    processed_files, log_path = ai_watermark_cli.process_job_file(job_path, settings, tmp_path / 'out',
+                                                                  jobs, pipeline=pipeline)
+
+    assert len(processed_files) == 1
+    with open(log_path, encoding='utf-8') as f:
+        entries = {entry['line']: entry for entry in map(json.loads, f)}
+    assert [entries[line]['status'] for line in (1, 2, 3)] == ['ok', 'error', 'error']
+    assert all(entry['seconds'] is not None for entry in entries.values())
+
+
+@pytest.mark.parametrize('incremental', [False, True])
+def test_watermarked_names_skipped_only_in_incremental_mode(tmp_path, monkeypatch, incremental):
+    monkeypatch.chdir(HERE)
+    source = tmp_path / 'photos'
+    source.mkdir()
+    for name in ('a.jpg', 'b_watermarked.jpg'):
+        Image.new('RGB', (320, 240), 'gray').save(source / name)
+
+    processed_files = ai_watermark_cli.process_directory(source, tmp_path / 'out', jobs=1,
+                                                         incremental=incremental)
+
+    names = sorted(Path(path).name for path in processed_files)
+    if incremental:
+        assert names == ['a_watermarked.jpg']
+    else:
+        assert names == ['a_watermarked.jpg', 'b_watermarked_watermarked.jpg']
+
+
+@pytest.mark.parametrize('pipeline', [0, 2])
+def test_incremental_reprocesses_when_output_dir_changes(tmp_path, monkeypatch, pipeline):
+    monkeypatch.chdir(HERE)
+    source = tmp_path / 'photos'
+    (source / 'sub').mkdir(parents=True)
+    for name in ('a.jpg', 'sub/b.png'):
+        Image.new('RGB', (320, 240), 'gray').save(source / name)
+    manifest = tmp_path / 'manifest.json'
+
+    def run(output_dir):
+        return ai_watermark_cli.process_directory(source, output_dir, jobs=1, recursive=True,
+                                                  incremental=True, manifest_path=manifest,
+                                                  pipeline=pipeline)
+
+    assert len(run(tmp_path / 'm1')) == 2
+    assert run(tmp_path / 'm1') == []
+    # 换一个输出目录时，清单中记录的输出路径不再适用
+    assert len(run(tmp_path / 'm2')) == 2
+    assert (tmp_path / 'm2' / 'sub' / 'b_watermarked.png').exists()
+    # 不指定输出目录时按原图所在目录判断
+    assert len(run(None)) == 2
+    assert run(None) == []
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+水印处理公共模块的回归测试
+与最初逐像素实现的输出逐字节比较
+
+    python -m pytest -q
+"""
+
+import io
+from pathlib import Path
+
+import pytest
+from PIL import Image, ImageChops, ImageSequence
+
+import ai_watermark_cli
+from watermark_engine import (Watermarker, WatermarkError, apply_opacity, estimate_image_memory,
+                              load_watermark)
+
+HERE = Path(__file__).resolve().parent
+WATERMARK_PATH = HERE / 'doubao_ai_watermark.png'
+
+# 最初版本中各水印大小对应的除数
+LEGACY_DIVISORS = {'auto': 864.0, 'small': 1200.0, 'medium': 800.0, 'large': 600.0}
+
+
+def legacy_apply_opacity(watermark, opacity):
+    """最初的逐像素实现：getdata() 逐个计算 alpha 后 putdata()"""
+    if opacity >= 100:
+        return watermark
+    watermark_with_opacity = Image.new('RGBA', watermark.size, (255, 255, 255, 0))
+    new_data = []
+    for item in watermark.getdata():
+        new_data.append((item[0], item[1], item[2], int(item[3] * opacity / 100)))
+    watermark_with_opacity.putdata(new_data)
+    return watermark_with_opacity
+
+
+def legacy_add_watermark(image_path, output_path, opacity=70, size='auto'):
+    """最初版本的 add_watermark()：整幅转换为RGBA、粘贴水印后以白色背景展平"""
+    watermark_image = Image.open(WATERMARK_PATH).convert('RGBA')
+    with Image.open(image_path) as img:
+        if img.mode != 'RGBA':
+            img = img.convert('RGBA')
+        scale = max(img.width / LEGACY_DIVISORS[size], 0.2)
+        watermark_width = int(watermark_image.width * scale)
+        watermark_height = int(watermark_image.height * scale)
+        watermark = watermark_image.resize((watermark_width, watermark_height), Image.Resampling.LANCZOS)
+        watermark = legacy_apply_opacity(watermark, opacity)
+        x = img.width - watermark_width - 12
+        y = img.height - watermark_height - 12
+        img.paste(watermark, (x, y), watermark)
+        rgb_img = Image.new('RGB', img.size, (255, 255, 255))
+        rgb_img.paste(img, mask=img.split()[-1])
+        rgb_img.save(output_path, 'JPEG', quality=90)
+
+
+def sample_image(mode, size=(640, 480)):
+    """生成带渐变和噪声的测试图片，RGBA 带半透明区域"""
+    gray = Image.linear_gradient('L').resize(size)
+    noise = Image.effect_noise(size, 40)
+    rgb = Image.merge('RGB', (gray, noise, gray.transpose(Image.Transpose.FLIP_LEFT_RIGHT)))
+    if mode == 'RGBA':
+        alpha = Image.linear_gradient('L').rotate(90).resize(size)
+        return Image.merge('RGBA', (*rgb.split(), alpha))
+    if mode == 'P':
+        return rgb.convert('P', palette=Image.Palette.ADAPTIVE)
+    return rgb.convert(mode)
+
+
+@pytest.fixture(scope='module')
+def watermark():
+    return load_watermark(WATERMARK_PATH).resize((200, 60), Image.Resampling.LANCZOS)
+
+
+# 最初的实现使用了 Pillow 已弃用的 getdata()
+@pytest.mark.filterwarnings('ignore::DeprecationWarning')
+@pytest.mark.parametrize('opacity', range(30, 101))
+def test_apply_opacity_matches_pixel_loop(watermark, opacity):
+    expected = legacy_apply_opacity(watermark, opacity)
+    actual = apply_opacity(watermark, opacity)
+    assert actual.mode == 'RGBA'
+    assert actual.tobytes() == expected.tobytes()
+
+
+@pytest.mark.filterwarnings('ignore::DeprecationWarning')
+@pytest.mark.parametrize('mode, extension', [('RGB', 'jpg'), ('RGBA', 'png'), ('P', 'png'), ('L', 'png')])
+@pytest.mark.parametrize('opacity, size', [(30, 'small'), (70, 'auto'), (100, 'large')])
+def test_add_watermark_matches_original_output(tmp_path, monkeypatch, mode, extension, opacity, size):
+    # 命令行版本从当前目录加载水印图片
+    monkeypatch.chdir(HERE)
+    source = tmp_path / f'source.{extension}'
+    sample_image(mode).save(source)
+
+    expected_path = tmp_path / 'expected.jpg'
+    actual_path = tmp_path / 'actual.jpg'
+    legacy_add_watermark(source, expected_path, opacity, size)
+    result = ai_watermark_cli.add_watermark(str(source), str(actual_path), opacity, size)
+
+    assert result == str(actual_path)
+    assert actual_path.read_bytes() == expected_path.read_bytes()
+
+
+@pytest.mark.parametrize('layout', ['single', 'tiled'])
+@pytest.mark.parametrize('output_format', ['PNG', 'WEBP'])
+def test_transparent_png_keeps_alpha(tmp_path, layout, output_format):
+    source = sample_image('RGBA')
+    # 左半部分完全透明
+    source.paste((0, 0, 0, 0), (0, 0, source.width // 2, source.height))
+    source_path = tmp_path / 'source.png'
+    source.save(source_path)
+    output_path = tmp_path / f'output.{output_format.lower()}'
+
+    watermarker = Watermarker(WATERMARK_PATH)
+    watermarker.process_file(str(source_path), str(output_path), layout=layout,
+                             save_options={'WEBP': {'lossless': True}})
+
+    with Image.open(output_path) as result:
+        assert result.mode == 'RGBA'
+        alpha = result.getchannel('A')
+    # 水印之外的透明度与原图逐像素一致，水印覆盖的区域不透明度只会增加
+    difference = ImageChops.difference(alpha, source.getchannel('A'))
+    assert difference.getbbox() is not None
+    stamps = watermarker.stamps(source.size, layout=layout, img=source)
+    covered = Image.new('L', source.size)
+    for watermark, position in stamps:
+        covered.paste(255, (*position, position[0] + watermark.width, position[1] + watermark.height))
+    assert ImageChops.multiply(difference, ImageChops.invert(covered)).getbbox() is None
+    assert ImageChops.subtract(source.getchannel('A'), alpha).getbbox() is None
+
+
+@pytest.mark.parametrize('output_format', ['GIF', 'WEBP', 'PNG'])
+def test_transparent_animation_keeps_transparency(output_format):
+    # 透明背景上移动的方块，另有一个半透明像素，使 WebP 也保存透明通道
+    frames = []
+    for index in range(3):
+        frame = Image.new('RGBA', (200, 150), (0, 0, 0, 0))
+        frame.paste((200, 30, 30, 255), (index * 50, 0, index * 50 + 40, 40))
+        frame.putpixel((199, 0), (0, 0, 0, 128))
+        frames.append(frame)
+    source = io.BytesIO()
+    frames[0].save(source, output_format, save_all=True, append_images=frames[1:],
+                   duration=[100, 200, 300], loop=0, disposal=2)
+
+    output = Watermarker(WATERMARK_PATH).process_bytes(source.getvalue(), output_format=output_format)
+
+    with Image.open(io.BytesIO(output)) as result:
+        assert result.n_frames == 3
+        for index, frame in enumerate(ImageSequence.Iterator(result)):
+            alpha = frame.convert('RGBA').getchannel('A')
+            # WebP 在加载帧数据后才给出该帧的时长
+            assert frame.info['duration'] == (index + 1) * 100
+            # 方块所在位置不透明，其他位置保持透明（不会露出上一帧），右下角有水印
+            for square in range(3):
+                assert alpha.getpixel((square * 50 + 5, 5)) == (255 if square == index else 0)
+            assert alpha.getpixel((5, 100)) == 0
+            assert alpha.crop((100, 100, 200, 150)).getbbox() is not None
+
+
+def test_animation_memory_counts_all_frames():
+    frames = [Image.new('RGB', (400, 300), (index * 20, 0, 0)) for index in range(10)]
+    source = io.BytesIO()
+    frames[0].save(source, 'WEBP', save_all=True, append_images=frames[1:], duration=50)
+    data = source.getvalue()
+
+    with Image.open(io.BytesIO(data)) as img:
+        single = estimate_image_memory(img)
+        animated = estimate_image_memory(img, animation='WEBP')
+    assert animated >= single + 10 * 400 * 300 * 4
+
+    watermarker = Watermarker(WATERMARK_PATH)
+    with pytest.raises(WatermarkError, match='10 帧'):
+        watermarker.process_bytes(data, max_memory=animated - 1)
+    # 只保存第一帧时按单帧估算
+    assert watermarker.process_bytes(data, max_memory=animated - 1, output_format='JPEG')
+    assert watermarker.process_bytes(data, max_memory=animated)
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+JPEG 局部重编码的回归测试
+霍夫曼解码后重新编码必须与原始熵编码数据逐位一致
+
+    python -m pytest -q
+"""
+
+import io
+
+import pytest
+from PIL import Image
+
+from watermark_engine import composite_watermark
+from watermark_jpeg import (JpegLayout, JpegPatchError, _block_tables, decode_interval,
+                            encode_interval, patch_jpeg, unstuff)
+
+
+def restart_jpeg(size=(500, 300), subsampling=2, quality=90, restart_marker_blocks=4):
+    """生成带重启标记的测试JPEG（宽高不是MCU的整数倍）"""
+    gray = Image.linear_gradient('L').resize(size)
+    noise = Image.effect_noise(size, 50)
+    img = Image.merge('RGB', (gray, noise, gray.rotate(90).resize(size)))
+    output = io.BytesIO()
+    img.save(output, 'JPEG', quality=quality, subsampling=subsampling,
+             restart_marker_blocks=restart_marker_blocks)
+    return output.getvalue()
+
+
+@pytest.mark.parametrize('subsampling', [0, 1, 2])
+def test_interval_round_trip_is_bit_exact(subsampling):
+    data = restart_jpeg(subsampling=subsampling)
+    layout = JpegLayout(data)
+    assert layout.restart_interval
+    decode_tables = _block_tables(layout, 0)
+    encode_tables = _block_tables(layout, 1)
+    columns, rows = layout.mcu_grid
+    total = columns * rows
+    per_interval = layout.mcus_per_interval
+    assert len(layout.intervals) == -(-total // per_interval)
+
+    for index, (start, end) in enumerate(layout.intervals):
+        count = min(per_interval, total - index * per_interval)
+        unstuffed = unstuff(data[start:end])
+        mcus, offsets = decode_interval(unstuffed, decode_tables, count)
+        assert len(mcus) == count
+        assert encode_interval(mcus, encode_tables) == data[start:end]
+        # 从区间中间开始重新编码，之前的 MCU 按位复制
+        first = count // 2
+        if first:
+            assert encode_interval(mcus, encode_tables, first, (unstuffed, offsets)) == data[start:end]
+
+
+def decode_all(data):
+    """解码整张JPEG的量化系数，返回 (JpegLayout, 按光栅顺序的 MCU 列表)"""
+    layout = JpegLayout(data)
+    tables = _block_tables(layout, 0)
+    columns, rows = layout.mcu_grid
+    total = columns * rows
+    per_interval = layout.mcus_per_interval
+    mcus = []
+    for index, (start, end) in enumerate(layout.intervals):
+        count = min(per_interval, total - index * per_interval)
+        mcus.extend(decode_interval(unstuff(data[start:end]), tables, count)[0])
+    return layout, mcus
+
+
+def test_patch_jpeg_only_changes_watermark_blocks():
+    data = restart_jpeg()
+    watermark = Image.new('RGBA', (60, 30), (255, 0, 0, 160))
+    position = (400, 250)
+    patched = patch_jpeg(data, watermark, position,
+                         lambda region, offset: composite_watermark(region, watermark, offset))
+
+    with Image.open(io.BytesIO(patched)) as result:
+        assert result.size == (500, 300)
+    layout, original_mcus = decode_all(data)
+    patched_layout, patched_mcus = decode_all(patched)
+    assert patched_layout.restart_interval == layout.restart_interval
+
+    # 系数发生变化的 MCU 都在水印覆盖的范围内，且水印区域确实被修改
+    columns = layout.mcu_grid[0]
+    mcu_width, mcu_height = layout.mcu_size
+    changed = {divmod(index, columns) for index, (before, after)
+               in enumerate(zip(original_mcus, patched_mcus)) if before != after}
+    assert changed
+    for row, column in changed:
+        assert position[0] // mcu_width <= column <= (position[0] + watermark.width - 1) // mcu_width
+        assert position[1] // mcu_height <= row <= (position[1] + watermark.height - 1) // mcu_height
+
+    # 不含水印的重启区间按字节原样复制
+    assert patched[slice(*patched_layout.intervals[0])] == data[slice(*layout.intervals[0])]
+
+
+def test_patch_jpeg_requires_restart_markers():
+    data = restart_jpeg(restart_marker_blocks=0)
+    watermark = Image.new('RGBA', (20, 20), (255, 0, 0, 160))
+    with pytest.raises(JpegPatchError):
+        patch_jpeg(data, watermark, (10, 10),
+                   lambda region, offset: composite_watermark(region, watermark, offset))
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+常驻服务的回归测试，只监听本机端口
+
+    python -m pytest -q
+"""
+
+import http.client
+import io
+import json
+import socket
+import threading
+import time
+from pathlib import Path
+
+import pytest
+from PIL import Image
+
+from watermark_engine import Watermarker
+from watermark_server import WatermarkService, create_server
+
+HERE = Path(__file__).resolve().parent
+
+
+@pytest.fixture
+def server():
+    """workers=1、max_queue=0 的服务，同时只接受一个请求"""
+    watermarker = Watermarker(str(HERE / 'doubao_ai_watermark.png'))
+    service = WatermarkService(watermarker, workers=1, max_queue=0, max_body=1024 * 1024)
+    server = create_server(service, port=0, quiet=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+
+def post(server, body, headers=None, query=''):
+    """发送 POST /watermark，返回 (状态码, 响应头, 响应体)"""
+    connection = http.client.HTTPConnection(*server.server_address[:2], timeout=10)
+    try:
+        connection.putrequest('POST', '/watermark' + query)
+        for key, value in (headers or {'Content-Length': str(len(body))}).items():
+            connection.putheader(key, value)
+        connection.endheaders(body)
+        response = connection.getresponse()
+        return response.status, response.headers, response.read()
+    finally:
+        connection.close()
+
+
+def sample_jpeg():
+    output = io.BytesIO()
+    Image.new('RGB', (320, 240), 'gray').save(output, 'JPEG')
+    return output.getvalue()
+
+
+def wait_for_pending(service, count):
+    deadline = time.monotonic() + 5
+    while service.status()['pending'] != count:
+        assert time.monotonic() < deadline, "排队数没有变化"
+        time.sleep(0.01)
+
+
+def test_post_returns_watermarked_image(server):
+    status, headers, body = post(server, sample_jpeg(), query='?opacity=80')
+    assert status == 200
+    assert headers['Content-Type'] == 'image/jpeg'
+    with Image.open(io.BytesIO(body)) as result:
+        assert result.size == (320, 240)
+    assert server.service.status()['pending'] == 0
+
+
+def test_rejects_body_over_limit(server):
+    status, headers, body = post(server, b'', {'Content-Length': str(2 * 1024 * 1024)})
+    assert status == 413
+    assert headers['Connection'] == 'close'
+    assert server.service.status()['pending'] == 0
+
+
+@pytest.mark.parametrize('length', ['-1', 'abc'])
+def test_rejects_invalid_content_length(server, length):
+    status, headers, body = post(server, b'', {'Content-Length': length})
+    assert status == 400
+    assert headers['Connection'] == 'close'
+    assert server.service.status()['pending'] == 0
+    # 没有占用排队位置，之后的请求正常处理
+    assert post(server, sample_jpeg())[0] == 200
+
+
+def test_returns_503_when_queue_is_full(server):
+    data = sample_jpeg()
+    # 只发送一半请求体的客户端占用唯一的排队位置
+    stalled = socket.create_connection(server.server_address[:2], timeout=10)
+    try:
+        stalled.sendall(f'POST /watermark HTTP/1.1\r\nHost: localhost\r\n'
+                        f'Content-Length: {len(data)}\r\n\r\n'.encode('ascii') + data[:len(data) // 2])
+        wait_for_pending(server.service, 1)
+
+        status, headers, body = post(server, data)
+        assert status == 503
+        assert headers['Retry-After'] == '1'
+        assert headers['Connection'] == 'close'
+        assert 'error' in json.loads(body)
+        assert server.service.status()['rejected'] == 1
+    finally:
+        stalled.close()
+
+    # 客户端断开后归还排队位置
+    wait_for_pending(server.service, 0)
+    assert post(server, data)[0] == 200
@@ -0,0 +1,1509 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+AI 水印工具 - 水印处理引擎
+图形界面版本和命令行版本共用的水印处理流程，不依赖tkinter，可直接嵌入其他程序使用
+
+    from watermark_engine import Watermarker
+
+    watermarker = Watermarker()
+    watermarker.process_file("photo.jpg", opacity=80, size="large")
+"""
+
+import io
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+from PIL import ExifTags, Image, ImageChops, ImageStat, PngImagePlugin
+
+from watermark_jpeg import JpegPatchError, patch_jpeg
+from watermark_stats import NULL_STATS
+
+# 默认的豆包AI水印图片（与本模块位于同一目录）
+DEFAULT_WATERMARK_PATH = Path(__file__).resolve().with_name('doubao_ai_watermark.png')
+
+# 预设水印大小对应的宽度除数：水印缩放比例 = 图片宽度 / 除数（基于原Android项目的 宽度/864）
+SIZE_DIVISORS = {
+    'auto': 864.0,
+    'small': 1200.0,
+    'medium': 800.0,
+    'large': 600.0,
+}
+
+# 水印的最小缩放比例
+MIN_SCALE = 0.2
+
+# 水印与图片边缘的边距，与原Android项目保持一致
+MARGIN = 12
+
+# 水印可以放置的位置（按图片显示方向），默认右下角；auto 表示根据图片内容自动选择
+POSITIONS = ('bottom-right', 'bottom-left', 'top-right', 'top-left', 'center', 'auto')
+
+# 自动选择位置时比较的候选位置，得分相同时靠前的优先
+AUTO_CANDIDATES = ('bottom-right', 'bottom-left', 'top-right', 'top-left')
+
+# 自动选择位置时，候选区域缩小到的长边像素数（只统计缩略图，不统计原图像素）
+ANALYSIS_EDGE = 32
+
+# 水印布局：single 单个水印（位置见 POSITIONS），corners 四个角落各一个，
+# tiled 行列对齐平铺，diagonal 倾斜后错行平铺
+LAYOUTS = ('single', 'corners', 'tiled', 'diagonal')
+
+# 平铺时相邻水印之间的空隙，相对于水印尺寸的比例
+TILE_SPACING = 0.5
+
+# diagonal 布局中水印逆时针旋转的角度
+DIAGONAL_ANGLE = 30
+
+# 最多缓存的平铺图案数量（每个图案只含一个水印和各水印的坐标，占用很小）
+PATTERN_CACHE_SIZE = 16
+
+# 按条带展平带透明通道的大图时，每个条带占用的内存上限（字节）
+STRIP_BYTES = 16 * 1024 * 1024
+
+# 各输出格式的默认编码参数
+ENCODER_DEFAULTS = {
+    'JPEG': {'quality': 90},
+    'PNG': {'compress_level': 6},
+    'WEBP': {'quality': 90, 'method': 4},
+}
+
+# 可以保存透明信息的输出格式，带透明通道的原图保存为这些格式时不以白色背景展平
+ALPHA_FORMATS = {'GIF', 'PNG', 'WEBP'}
+
+# 可以保存为动画的输出格式（GIF、WebP、APNG），其他格式只保存第一帧
+ANIMATED_FORMATS = {'GIF', 'PNG', 'WEBP'}
+
+# Pillow 的动画编码器在写入之前保留全部帧，内存按整帧RGBA大小的倍数估算：
+# (每帧的倍数, 编码时另需的整帧缓冲数)。GIF 保留调色板帧（每像素1字节），
+# APNG 编码器复制传入的全部帧，WebP 编码器另有几张工作画布（按实测峰值留出余量）
+ANIMATION_MEMORY = {'GIF': (0.3, 12), 'PNG': (2, 7), 'WEBP': (1, 9)}
+
+# 可以保留的元数据类型
+METADATA_KINDS = ('exif', 'icc', 'xmp')
+
+# 可以写入EXIF（包括方向标记）的输出格式
+EXIF_FORMATS = {'JPEG', 'PNG', 'WEBP'}
+
+# ICC配置文件适用于RGB输出的原图模式（灰度、CMYK图片转换为RGB后原配置文件不再适用）
+ICC_MODES = {'RGB', 'RGBA', 'P', 'PA'}
+
+# 为按EXIF方向显示的图片准备水印时，对水印进行的变换（显示时旋转的逆变换）
+ORIENTATION_TRANSPOSE = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_90,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_270,
+}
+
+# 把按存储方向解码的图片转到EXIF方向显示的画面所需的变换（用于预览）
+DISPLAY_TRANSPOSE = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
+
+# 指定输出格式时默认使用的扩展名
+FORMAT_EXTENSIONS = {
+    'JPEG': '.jpg',
+    'PNG': '.png',
+    'WEBP': '.webp',
+}
+
+
+class WatermarkError(Exception):
+    """水印处理失败"""
+
+
+def load_watermark(path=DEFAULT_WATERMARK_PATH):
+    """
+    加载水印图片
+
+    Args:
+        path (str): 水印图片路径
+
+    Returns:
+        Image.Image: RGBA模式的水印图片
+
+    Raises:
+        WatermarkError: 文件不存在或无法读取
+    """
+    try:
+        with Image.open(path) as watermark:
+            return watermark.convert('RGBA')
+    except (OSError, ValueError) as e:
+        raise WatermarkError(f"加载水印图片失败: {e}") from e
+
+
+def default_output_name(image_path, output_format=None):
+    """生成默认的输出文件名：原文件名后添加_watermarked，指定格式时使用该格式的扩展名"""
+    file_path = Path(image_path)
+    suffix = FORMAT_EXTENSIONS[output_format.upper()] if output_format else file_path.suffix
+    return f"{file_path.stem}_watermarked{suffix}"
+
+
+def apply_opacity(watermark, opacity):
+    """
+    按透明度缩放水印的alpha通道
+
+    结果与逐像素计算 int(a * opacity / 100) 完全一致，
+    但通过查找表一次性处理整个alpha通道。
+
+    Args:
+        watermark (Image.Image): RGBA模式的水印图片
+        opacity (int): 透明度（30-100）
+
+    Returns:
+        Image.Image: 调整透明度后的水印图片（opacity >= 100 时返回原图）
+    """
+    if opacity >= 100:
+        return watermark
+
+    # 预先计算0-255每个alpha值对应的结果，保持原有的截断取整规则
+    alpha_table = [int(a * opacity / 100) for a in range(256)]
+
+    r, g, b, a = watermark.split()
+    return Image.merge('RGBA', (r, g, b, a.point(alpha_table)))
+
+
+def reduced_size(size, max_edge=None, max_pixels=None):
+    """
+    计算按长边或像素总数上限缩小后的尺寸
+
+    Returns:
+        tuple: 缩小后的尺寸 (宽, 高)，无需缩小时返回None
+    """
+    width, height = size
+    factor = 1.0
+    if max_edge:
+        factor = min(factor, max_edge / max(size))
+    if max_pixels:
+        factor = min(factor, (max_pixels / (width * height)) ** 0.5)
+    if factor >= 1.0:
+        return None
+    return max(1, int(width * factor)), max(1, int(height * factor))
+
+
+def reduce_image(img, max_edge=None, max_pixels=None):
+    """
+    按长边或像素总数上限缩小图片
+
+    必须在图片解码之前调用：JPEG图片会先用草稿模式直接以 1/2、1/4 或 1/8
+    的比例解码，再用LANCZOS缩放到精确尺寸，从而减少解码时间和内存占用。
+
+    Args:
+        img (Image.Image): 刚打开、尚未加载像素数据的图片
+        max_edge (int): 输出长边的最大像素数，None表示不限制
+        max_pixels (int): 输出像素总数的上限，None表示不限制
+
+    Returns:
+        Image.Image: 缩小后的图片（无需缩小时返回原图）
+    """
+    target = reduced_size(img.size, max_edge, max_pixels)
+    if target is None:
+        return img
+
+    # JPEG草稿模式：解码器直接输出不小于目标尺寸的缩小图像
+    if img.format == 'JPEG':
+        img.draft(img.mode, target)
+
+    if img.size != target:
+        # 调色板图片无法用LANCZOS缩放，先转换为真彩色
+        if img.mode in ('1', 'P'):
+            img = img.convert('RGBA' if 'transparency' in img.info else 'RGB')
+        img = img.resize(target, Image.Resampling.LANCZOS)
+    return img
+
+
+def _is_opaque(img):
+    """判断图片是否不含透明信息（可以只在水印区域内合成）"""
+    return img.mode in ('RGB', 'L', 'P', 'CMYK') and 'transparency' not in img.info
+
+
+def composite_watermark(img, watermark, position, low_memory=False):
+    """
+    将水印合成到图片上，返回可直接保存为JPEG的RGB图片
+
+    不透明的图片保持原有模式（必要时只转换为RGB），仅对水印覆盖的区域进行
+    alpha混合，避免整幅图片的RGBA转换和第二张RGB画布；带透明通道的图片
+    仍按整幅RGBA合成后以白色背景展平。两种方式的输出完全一致。
+
+    Args:
+        img (Image.Image): 原图，不透明图片可能被直接修改
+        watermark (Image.Image): 处理好的RGBA水印
+        position (tuple): 水印左上角坐标 (x, y)
+        low_memory (bool): 带透明通道的图片按条带转换和展平，不创建整幅RGBA副本，
+            输出与整幅处理完全一致
+
+    Returns:
+        Image.Image: 合成后的RGB图片
+    """
+    if _is_opaque(img):
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+
+        # 只取出水印覆盖的区域进行合成，再贴回原图
+        x, y = position
+        box = (x, y, x + watermark.width, y + watermark.height)
+        region = img.crop(box).convert('RGBA')
+        region.paste(watermark, (0, 0), watermark)
+        flattened = Image.new('RGB', region.size, (255, 255, 255))
+        flattened.paste(region, mask=region.split()[-1])
+        img.paste(flattened, (x, y))
+        return img
+
+    return _flatten_stamps(img, [(watermark, position)], low_memory)
+
+
+def _flatten_stamps(img, stamps, low_memory=False):
+    """
+    带透明信息的图片：整幅转换为RGBA后依次粘贴各个水印，再以白色背景展平
+
+    Args:
+        img (Image.Image): 原图
+        stamps (list): (处理好的RGBA水印, 左上角坐标) 列表
+        low_memory (bool): 按条带转换和展平，见 _flatten_in_strips()
+
+    Returns:
+        Image.Image: 合成后的RGB图片
+    """
+    if low_memory:
+        return _flatten_in_strips(img, stamps)
+
+    if img.mode != 'RGBA':
+        img = img.convert('RGBA')
+    for watermark, position in stamps:
+        img.paste(watermark, position, watermark)
+    rgb_img = Image.new('RGB', img.size, (255, 255, 255))
+    rgb_img.paste(img, mask=img.split()[-1])
+    return rgb_img
+
+
+def composite_stamps(img, stamps, low_memory=False, keep_alpha=False):
+    """
+    依次合成多个水印，见 composite_watermark()
+
+    带透明通道的图片只能展平一次：所有水印粘贴到同一个RGBA副本上后再整体展平。
+
+    Args:
+        img (Image.Image): 原图，不透明图片和 keep_alpha 时的RGBA图片可能被直接修改
+        stamps (list): (处理好的RGBA水印或 BlendedLayer, 左上角坐标) 列表
+        low_memory (bool): 带透明通道的图片按条带展平
+        keep_alpha (bool): 带透明信息的图片不展平，返回保留透明通道的RGBA图片
+            （输出格式见 ALPHA_FORMATS）。RGBA原图直接修改，不需要额外内存，
+            其他模式只转换出一张RGBA副本，不超过按条带展平的内存估算
+
+    Returns:
+        Image.Image: 合成后的RGB图片，keep_alpha 时带透明信息的图片为RGBA
+    """
+    if keep_alpha and not _is_opaque(img):
+        if img.mode != 'RGBA':
+            img = img.convert('RGBA')
+        for watermark, (x, y) in stamps:
+            # 按 alpha 叠加，透明背景上的水印保持自身的不透明度；平铺时的负坐标裁掉超出部分
+            img.alpha_composite(watermark, (max(x, 0), max(y, 0)), (max(-x, 0), max(-y, 0)))
+        return img
+
+    if not stamps:
+        # 没有水印落在图片内（图片比边距还小）时，仍按同样的规则转换为RGB
+        stamps = [(Image.new('RGBA', (1, 1), (0, 0, 0, 0)), (0, 0))]
+    if not _is_opaque(img):
+        return _flatten_stamps(img, stamps, low_memory)
+
+    for watermark, position in stamps:
+        if isinstance(watermark, BlendedLayer):
+            if img.mode != 'RGB':
+                img = img.convert('RGB')
+            img.paste(watermark.color, position, watermark.mask)
+        else:
+            img = composite_watermark(img, watermark, position)
+    return img
+
+
+def blend_watermark(watermark):
+    """
+    把水印转换为可以一次粘贴到不透明图片上的颜色和蒙版
+
+    composite_watermark() 对不透明图片先按水印alpha混合到RGBA区域，再以白色背景展平，
+    两步合起来等价于原图与颜色 c 按比例 k 的线性混合，c、k 只取决于水印本身。
+    预先算出 c 和 k 后，合成只需一次以 k 为蒙版的 paste()，
+    结果与 composite_watermark() 每个通道最多相差几个色阶（中间结果的取整不同）。
+
+    Returns:
+        Image.Image: RGBA图片，RGB为颜色 c，alpha为蒙版 k
+    """
+    weights, whites, masks = [], [], []
+    for a in range(256):
+        alpha = a / 255
+        # 第一步混合后区域的alpha，展平时以此为蒙版
+        remaining = 1 - alpha + alpha * alpha
+        k = 1 - (1 - alpha) * remaining
+        weight = alpha * remaining / k if k else 0.0
+        weights.append(round(255 * weight))
+        whites.append(round(255 * (1 - weight)) if k else 0)
+        masks.append(round(255 * k))
+
+    alpha = watermark.getchannel('A')
+    weight = alpha.point(weights)
+    white = alpha.point(whites)
+    color = [ImageChops.add(ImageChops.multiply(band, weight), white) for band in watermark.split()[:3]]
+    return Image.merge('RGBA', (*color, alpha.point(masks)))
+
+
+class BlendedLayer:
+    """
+    预先混合好的平铺水印（见 blend_watermark()），只能合成到不透明图片上
+
+    颜色和蒙版分开保存，合成时直接作为 paste() 的参数，不需要逐次转换模式。
+    """
+
+    __slots__ = ('color', 'mask')
+
+    def __init__(self, color, mask):
+        self.color = color
+        self.mask = mask
+
+    @property
+    def size(self):
+        return self.color.size
+
+    @property
+    def width(self):
+        return self.color.width
+
+    @property
+    def height(self):
+        return self.color.height
+
+
+def tile_stamp(stamp, layout):
+    """
+    平铺使用的水印：diagonal 布局旋转 DIAGONAL_ANGLE 度，tiled 布局保持原样
+
+    Args:
+        stamp (Image.Image): 处理好的RGBA水印
+        layout (str): tiled 或 diagonal
+
+    Returns:
+        Image.Image: RGBA水印
+    """
+    if layout == 'diagonal':
+        return stamp.rotate(DIAGONAL_ANGLE, Image.Resampling.BICUBIC, expand=True)
+    return stamp
+
+
+def tile_positions(size, stamp_size, margin=MARGIN, layout='tiled'):
+    """
+    计算平铺时每个水印的左上角坐标
+
+    相邻水印之间留出 TILE_SPACING 比例的空隙、互不重叠，因此各个水印可以分别粘贴，
+    不需要先排列到与图片同样大小的图层上。
+
+    Args:
+        size (tuple): 图片尺寸 (宽, 高)
+        stamp_size (tuple): 平铺的水印尺寸 (宽, 高)，见 tile_stamp()
+        margin (int): 第一行、第一列与图片边缘的距离
+        layout (str): tiled 行列对齐平铺，diagonal 错行平铺
+
+    Returns:
+        list: 与图片相交的各个水印的左上角坐标 (x, y)
+    """
+    step_x = stamp_size[0] + max(1, int(stamp_size[0] * TILE_SPACING))
+    step_y = stamp_size[1] + max(1, int(stamp_size[1] * TILE_SPACING))
+    positions = []
+    for row, y in enumerate(range(margin, size[1], step_y)):
+        # diagonal 布局的奇数行错开半个间距，左侧露出半个水印
+        shift = step_x // 2 if layout == 'diagonal' and row % 2 else 0
+        positions.extend((x, y) for x in range(margin - shift, size[0], step_x))
+    return positions
+
+
+def watermark_luminance(watermark):
+    """
+    计算水印主体（alpha不低于一半的像素）的平均亮度
+
+    Returns:
+        float: 平均亮度 0-255，水印没有这样的像素时统计全部像素
+    """
+    mask = watermark.getchannel('A').point(lambda a: 255 if a >= 128 else 0)
+    if mask.getbbox() is None:
+        mask = None
+    return ImageStat.Stat(watermark.convert('L'), mask).mean[0]
+
+
+def region_contrast(img, box, luminance):
+    """
+    估计水印放在图片某个区域时的清晰程度
+
+    区域先缩小到长边约 ANALYSIS_EDGE 像素再统计灰度：区域平均亮度与水印亮度相差越大、
+    区域越平坦（亮度标准差越小），水印越清晰。
+
+    Args:
+        img (Image.Image): 已加载的图片
+        box (tuple): 区域 (左, 上, 右, 下)，超出图片的部分不统计
+        luminance (float): 水印的平均亮度，见 watermark_luminance()
+
+    Returns:
+        float: 得分，越大越清晰；区域完全在图片外时返回负无穷
+    """
+    box = (max(0, box[0]), max(0, box[1]), min(img.width, box[2]), min(img.height, box[3]))
+    if box[0] >= box[2] or box[1] >= box[3]:
+        return float('-inf')
+
+    factor = max(1, max(box[2] - box[0], box[3] - box[1]) // ANALYSIS_EDGE)
+    if img.mode in ('1', 'P', 'PA', 'I;16'):
+        # 这些模式不支持 reduce()，先裁出区域再转换
+        thumbnail = img.crop(box).convert('RGBA').reduce(factor)
+    else:
+        thumbnail = img.reduce(factor, box)
+    if thumbnail.mode in ('RGBA', 'LA', 'La', 'RGBa'):
+        # 与输出一样以白色背景展平透明区域
+        flattened = Image.new('RGB', thumbnail.size, (255, 255, 255))
+        flattened.paste(thumbnail, mask=thumbnail.getchannel('A'))
+        thumbnail = flattened
+
+    stat = ImageStat.Stat(thumbnail.convert('L'))
+    return abs(stat.mean[0] - luminance) - stat.stddev[0]
+
+
+def _flatten_in_strips(img, stamps):
+    """
+    按水平条带把带透明信息的图片转换为RGBA、粘贴水印并以白色背景展平
+
+    每次只转换一个条带，峰值内存为原图加一张RGB画布，再加一个条带。
+    """
+    strip_height = max(1, STRIP_BYTES // (img.width * 8))
+    rgb_img = Image.new('RGB', img.size, (255, 255, 255))
+    for top in range(0, img.height, strip_height):
+        bottom = min(top + strip_height, img.height)
+        strip = img.crop((0, top, img.width, bottom))
+        if strip.mode != 'RGBA':
+            strip = strip.convert('RGBA')
+        # 粘贴超出条带的部分会被裁掉，水印跨越多个条带时分别贴入各自的部分
+        for watermark, (x, y) in stamps:
+            if top < y + watermark.height and y < bottom:
+                strip.paste(watermark, (x, y - top), watermark)
+        rgb_img.paste(strip, (0, top), mask=strip.getchannel('A'))
+    return rgb_img
+
+
+def pixel_bytes(mode):
+    """Pillow 在内存中存储一个像素占用的字节数"""
+    if mode in ('1', 'L', 'P'):
+        return 1
+    if mode.startswith('I;16'):
+        return 2
+    return 4
+
+
+def estimate_image_memory(img, max_edge=None, max_pixels=None, low_memory=False, animation=None):
+    """
+    估算为刚打开的图片添加水印时的峰值内存
+
+    只使用文件头中的尺寸和模式，不解码像素，可在分配任务前调用。
+
+    Args:
+        img (Image.Image): 刚打开、尚未加载像素数据的图片
+        max_edge (int): 输出长边的最大像素数，None表示不限制
+        max_pixels (int): 输出像素总数的上限，None表示不限制
+        low_memory (bool): 是否按条带展平带透明通道的图片
+        animation (str): 逐帧处理并保存为动画时的输出格式（见 is_animation()），
+            None表示只处理一帧
+
+    Returns:
+        int: 估算的峰值字节数
+    """
+    target = reduced_size(img.size, max_edge, max_pixels)
+    frame_memory = _estimate_frame_memory(img, target, low_memory)
+    if animation is None:
+        return frame_memory
+    # 编码器保留的全部帧和工作缓冲，另加解码、合成当前帧的内存
+    per_frame, buffers = ANIMATION_MEMORY[animation]
+    width, height = target or img.size
+    return int((per_frame * img.n_frames + buffers) * width * height * 4) + frame_memory
+
+
+def _estimate_frame_memory(img, target, low_memory=False):
+    """估算解码、缩小和合成一帧的峰值内存，target 为缩小后的尺寸，None表示不缩小"""
+    has_transparency = 'transparency' in img.info
+    if target is None:
+        return estimate_memory(img.size, img.mode, has_transparency, low_memory)
+
+    # 缩小时解码后的原图和缩小后的图片同时存在；JPEG按草稿模式的比例解码
+    scale = 1
+    if img.format == 'JPEG':
+        ratio = min(img.width // target[0], img.height // target[1])
+        scale = next(s for s in (8, 4, 2, 1) if ratio >= s)
+    decoded_pixels = -(-img.width // scale) * -(-img.height // scale)
+    total = decoded_pixels * pixel_bytes(img.mode)
+    mode = img.mode
+    if mode in ('1', 'P'):
+        # 调色板图片先转换为真彩色再缩放
+        mode = 'RGBA' if has_transparency else 'RGB'
+        total += decoded_pixels * 4
+        has_transparency = False
+    return total + estimate_memory(target, mode, has_transparency, low_memory)
+
+
+def plan_memory(img, max_memory, max_edge=None, max_pixels=None, animation=None):
+    """
+    按内存预算决定处理方式
+
+    Args:
+        img (Image.Image): 刚打开、尚未加载像素数据的图片
+        max_memory (int): 内存预算（字节），None表示不限制
+        animation (str): 保存为动画时的输出格式，编码器保留的全部帧计入估算
+
+    Returns:
+        bool: 是否需要按条带处理（low_memory）
+
+    Raises:
+        WatermarkError: 按条带处理仍会超出内存预算
+    """
+    if not max_memory or estimate_image_memory(img, max_edge, max_pixels, animation=animation) <= max_memory:
+        return False
+    needed = estimate_image_memory(img, max_edge, max_pixels, low_memory=True, animation=animation)
+    if needed > max_memory:
+        frames = f"（共 {img.n_frames} 帧）" if animation else ""
+        raise WatermarkError(f"图片尺寸 {img.width}x{img.height}{frames} 处理约需 {needed / 1024 / 1024:.0f} MB 内存，"
+                             f"超出内存预算 {max_memory / 1024 / 1024:.0f} MB")
+    return True
+
+
+def is_animation(img, image_format):
+    """图片是否为多帧动画且输出格式可以保存动画（见 ANIMATED_FORMATS），此时逐帧添加水印"""
+    return getattr(img, 'is_animated', False) and image_format in ANIMATED_FORMATS
+
+
+def estimate_memory(size, mode, has_transparency=False, low_memory=False):
+    """
+    估算为一张图片添加水印时的峰值内存（不含解释器本身和编码器的缓冲区）
+
+    Args:
+        size (tuple): 解码后的图片尺寸 (宽, 高)
+        mode (str): 解码后的图片模式
+        has_transparency (bool): 图片是否带透明信息（调色板透明色等）
+        low_memory (bool): 是否按条带展平带透明通道的图片
+
+    Returns:
+        int: 估算的峰值字节数
+    """
+    pixels = size[0] * size[1]
+    source = pixels * pixel_bytes(mode)
+    opaque = mode in ('RGB', 'L', 'P', 'CMYK') and not has_transparency
+    if opaque:
+        # 原图 + 非RGB图片转换出的RGB副本
+        return source + (0 if mode == 'RGB' else pixels * 4)
+    if low_memory:
+        # 原图 + RGB画布 + 一个条带（RGBA条带和展平用的alpha通道）
+        return source + pixels * 4 + min(STRIP_BYTES, pixels * 8)
+    # 原图 + 整幅RGBA副本 + RGB画布 + 拆分出的各通道
+    return source + (0 if mode == 'RGBA' else pixels * 4) + pixels * 4 + pixels * 4
+
+
+def resolve_format(output_path, output_format=None):
+    """
+    确定输出图片的编码格式
+
+    Args:
+        output_path (str): 输出图片路径
+        output_format (str): 指定的格式（如 jpeg/png/webp），None表示根据扩展名判断
+
+    Returns:
+        str: Pillow格式名称，无法识别的扩展名按JPEG处理
+    """
+    if output_format:
+        return output_format.upper()
+    extension = os.path.splitext(str(output_path))[1].lower()
+    return Image.registered_extensions().get(extension, 'JPEG')
+
+
+def save_image(img, output_path, output_format=None, save_options=None, **extra_params):
+    """
+    按输出格式编码并保存图片
+
+    Args:
+        img (Image.Image): 要保存的图片
+        output_path (str | file-like): 输出图片路径或输出流（输出流需要指定格式）
+        output_format (str): 指定的格式，None表示根据扩展名判断
+        save_options (dict): 覆盖默认值的编码参数，只传给支持该参数的格式
+            （如 JPEG 的 quality/subsampling/progressive/optimize，
+            PNG 的 compress_level，WebP 的 quality/method/lossless）
+        **extra_params: 直接传给 Image.save() 的其他参数（如动画的 save_all、append_images）
+
+    Returns:
+        str: 实际使用的格式名称
+    """
+    image_format = resolve_format(output_path, output_format)
+    params = dict(ENCODER_DEFAULTS.get(image_format, {}))
+    for key, value in (save_options or {}).get(image_format, {}).items():
+        if value is not None:
+            params[key] = value
+    params.update(extra_params)
+    img.save(output_path, image_format, **params)
+    return image_format
+
+
+def read_orientation(img):
+    """
+    读取图片的EXIF方向标记
+
+    只解析已读入的EXIF数据，不解码像素，也不旋转图片。
+
+    Returns:
+        int: 方向值 1-8，没有或无效时返回1
+    """
+    orientation = img.getexif().get(ExifTags.Base.Orientation, 1)
+    return orientation if orientation in ORIENTATION_TRANSPOSE else 1
+
+
+def stored_position(position, watermark_size, display_size, orientation):
+    """
+    把显示方向上的水印左上角坐标转换为图片存储方向上的坐标
+
+    Args:
+        position (tuple): 显示方向上的水印左上角坐标 (x, y)
+        watermark_size (tuple): 显示方向上的水印尺寸 (宽, 高)
+        display_size (tuple): 按EXIF方向显示时的图片尺寸 (宽, 高)
+        orientation (int): EXIF方向值 1-8
+
+    Returns:
+        tuple: 存储方向上的水印左上角坐标 (x, y)
+    """
+    x0, y0 = position
+    x1, y1 = x0 + watermark_size[0], y0 + watermark_size[1]
+    width, height = display_size
+    return {
+        1: (x0, y0),
+        2: (width - x1, y0),
+        3: (width - x1, height - y1),
+        4: (x0, height - y1),
+        5: (y0, x0),
+        6: (y0, width - x1),
+        7: (height - y1, width - x1),
+        8: (height - y1, x0),
+    }[orientation]
+
+
+def metadata_params(img, image_format, keep_metadata=(), orientation=1):
+    """
+    生成把原图元数据写入输出图片所需的保存参数
+
+    Args:
+        img (Image.Image): 已加载的原图（读取其 info 中的元数据）
+        image_format (str): 输出格式名称
+        keep_metadata (iterable): 要保留的元数据类型，见 METADATA_KINDS
+        orientation (int): 水印按此EXIF方向放置；不保留EXIF时也会写入只含方向标记的EXIF，
+            保证查看器按相同方向显示
+
+    Returns:
+        dict: 传给 save_image() 的额外参数
+    """
+    params = {}
+    exif = img.info.get('exif')
+    if 'exif' in keep_metadata and exif and image_format in EXIF_FORMATS:
+        params['exif'] = exif
+    elif orientation != 1:
+        orientation_exif = Image.Exif()
+        orientation_exif[ExifTags.Base.Orientation] = orientation
+        params['exif'] = orientation_exif.tobytes()
+
+    icc_profile = img.info.get('icc_profile')
+    if 'icc' in keep_metadata and icc_profile and img.mode in ICC_MODES:
+        params['icc_profile'] = icc_profile
+
+    xmp = img.info.get('xmp')
+    if 'xmp' in keep_metadata and xmp:
+        if image_format == 'PNG':
+            # PNG 以 iTXt 文本块保存XMP
+            if isinstance(xmp, bytes):
+                xmp = xmp.decode('utf-8', 'replace')
+            pnginfo = PngImagePlugin.PngInfo()
+            pnginfo.add_itxt('XML:com.adobe.xmp', xmp)
+            params['pnginfo'] = pnginfo
+        elif image_format in ('JPEG', 'WEBP'):
+            params['xmp'] = xmp.encode('utf-8') if isinstance(xmp, str) else xmp
+    return params
+
+
+class MemoryReader(io.RawIOBase):
+    """
+    以只读文件的方式读取内存缓冲区（bytearray、memoryview 等）
+
+    解码器按块读取数据，每次只复制读取的部分，不会复制整个缓冲区。
+    """
+
+    def __init__(self, buffer):
+        super().__init__()
+        self._view = memoryview(buffer).cast('B')
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self._position + offset
+        elif whence == io.SEEK_END:
+            position = len(self._view) + offset
+        else:
+            raise ValueError(f"无效的 whence: {whence}")
+        if position < 0:
+            raise ValueError("偏移量不能为负数")
+        self._position = position
+        return position
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            end = len(self._view)
+        else:
+            end = min(self._position + size, len(self._view))
+        data = self._view[self._position:end].tobytes()
+        self._position = max(self._position, end)
+        return data
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+def open_source(source):
+    """
+    把图片数据转换为 Image.open() 可以读取的对象
+
+    Args:
+        source (bytes | bytearray | memoryview | file-like): 图片数据或已打开的文件对象
+
+    Returns:
+        file-like: 可读取、可定位的文件对象
+    """
+    if isinstance(source, bytes):
+        # BytesIO 直接共享 bytes 的内存，不会复制
+        return io.BytesIO(source)
+    if isinstance(source, (bytearray, memoryview)):
+        return MemoryReader(source)
+    return source
+
+
+class WatermarkCache:
+    """
+    已处理水印的LRU缓存
+
+    以（最终像素尺寸, 透明度, EXIF方向）为键缓存缩放并调整透明度后的RGBA水印，
+    同一批次中尺寸相同的图片只需一次字典查找即可取得水印。
+    """
+
+    def __init__(self, watermark, maxsize=32):
+        """
+        Args:
+            watermark (Image.Image): 原始RGBA水印图片
+            maxsize (int): 最多缓存的水印数量
+        """
+        self.source = watermark
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, size, opacity, stats=NULL_STATS, orientation=1):
+        """
+        获取指定尺寸和透明度的水印
+
+        Args:
+            size (tuple): 水印的像素尺寸 (宽, 高)
+            opacity (int): 透明度（30-100）
+            stats (StageStats): 记录缓存命中情况的统计对象
+            orientation (int): 图片的EXIF方向，不为1时水印按存储方向旋转或翻转
+
+        Returns:
+            Image.Image: 处理好的RGBA水印，调用方不应修改
+        """
+        key = (tuple(size), opacity, orientation)
+        with self._lock:
+            prepared = self._entries.get(key)
+            if prepared is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                stats.count('cache_hits')
+                return prepared
+            self.misses += 1
+        stats.count('cache_misses')
+
+        # 缩放和透明度调整放在锁外进行，避免阻塞其他线程的缓存命中
+        prepared = self.source.resize(key[0], Image.Resampling.LANCZOS)
+        prepared = apply_opacity(prepared, opacity)
+        if orientation in ORIENTATION_TRANSPOSE:
+            prepared = prepared.transpose(ORIENTATION_TRANSPOSE[orientation])
+
+        with self._lock:
+            self._entries[key] = prepared
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return prepared
+
+    def clear(self):
+        """清空缓存和命中计数"""
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """
+        获取缓存统计信息
+
+        Returns:
+            dict: 包含 hits、misses、size、maxsize 的字典
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+            }
+
+
+class Watermarker:
+    """
+    可复用的水印处理器
+
+    持有预先加载的水印图片和已处理水印的缓存，同一个实例处理多张图片时
+    只需加载一次水印，尺寸相同的图片直接复用缓存中的水印。可在多个线程中共用。
+    """
+
+    def __init__(self, watermark=None, cache_size=32, min_scale=MIN_SCALE, margin=MARGIN):
+        """
+        Args:
+            watermark (Image.Image | str): 水印图片或其路径，None表示使用默认的豆包AI水印
+            cache_size (int): 最多缓存的已处理水印数量
+            min_scale (float): 水印的最小缩放比例
+            margin (int): 水印与图片右下角的边距
+        """
+        if watermark is None:
+            watermark = DEFAULT_WATERMARK_PATH
+        if not isinstance(watermark, Image.Image):
+            watermark = load_watermark(watermark)
+        elif watermark.mode != 'RGBA':
+            watermark = watermark.convert('RGBA')
+        self.cache = WatermarkCache(watermark, cache_size)
+        self.min_scale = min_scale
+        self.margin = margin
+        self.luminance = watermark_luminance(watermark)
+        self._patterns = OrderedDict()
+        self._patterns_lock = threading.Lock()
+
+    @property
+    def watermark(self):
+        """原始RGBA水印图片"""
+        return self.cache.source
+
+    def watermark_size(self, image_width, size='auto'):
+        """
+        计算水印的像素尺寸
+
+        Args:
+            image_width (int): 图片宽度
+            size (str | float): 预设大小（auto/small/medium/large），
+                或相对于 auto 大小的倍数（如 1.5）
+
+        Returns:
+            tuple: 水印尺寸 (宽, 高)
+        """
+        if isinstance(size, str):
+            scale = image_width / SIZE_DIVISORS.get(size, SIZE_DIVISORS['auto'])
+        else:
+            scale = size * (image_width / SIZE_DIVISORS['auto'])
+        scale = max(scale, self.min_scale)
+        return int(self.watermark.width * scale), int(self.watermark.height * scale)
+
+    def watermark_position(self, image_size, watermark_size, position='bottom-right'):
+        """
+        计算水印左上角坐标（靠边时留边距）
+
+        Args:
+            image_size (tuple): 图片尺寸 (宽, 高)
+            watermark_size (tuple): 水印尺寸 (宽, 高)
+            position (str): 水印位置，见 POSITIONS
+
+        Returns:
+            tuple: 水印左上角坐标 (x, y)
+        """
+        if position not in POSITIONS:
+            raise ValueError(f"不支持的水印位置: {position}，可选: {', '.join(POSITIONS)}")
+        if position == 'auto':
+            raise ValueError("auto 位置需要根据图片内容选择，见 best_position()")
+        if position == 'center':
+            return ((image_size[0] - watermark_size[0]) // 2,
+                    (image_size[1] - watermark_size[1]) // 2)
+        vertical, horizontal = position.split('-')
+        x = self.margin if horizontal == 'left' else image_size[0] - watermark_size[0] - self.margin
+        y = self.margin if vertical == 'top' else image_size[1] - watermark_size[1] - self.margin
+        return x, y
+
+    def best_position(self, img, image_size, watermark_size, orientation=1):
+        """
+        在 AUTO_CANDIDATES 中选出水印最清晰的位置，见 region_contrast()
+
+        Args:
+            img (Image.Image): 已加载的图片（按存储方向），可以是等比缩小的缩略图
+            image_size (tuple): 图片按存储方向的尺寸 (宽, 高)
+            watermark_size (tuple): 显示方向上的水印尺寸 (宽, 高)
+            orientation (int): 图片的EXIF方向
+
+        Returns:
+            str: 选中的位置名称
+        """
+        display_size = image_size[::-1] if orientation >= 5 else image_size
+        stored_size = watermark_size[::-1] if orientation >= 5 else watermark_size
+        scale = img.width / image_size[0]
+
+        best, best_score = AUTO_CANDIDATES[0], float('-inf')
+        for candidate in AUTO_CANDIDATES:
+            x, y = self.watermark_position(display_size, watermark_size, candidate)
+            if orientation != 1:
+                x, y = stored_position((x, y), watermark_size, display_size, orientation)
+            box = (int(x * scale), int(y * scale),
+                   int((x + stored_size[0]) * scale), int((y + stored_size[1]) * scale))
+            score = region_contrast(img, box, self.luminance)
+            if score > best_score:
+                best, best_score = candidate, score
+        return best
+
+    def placement(self, image_size, opacity=70, size='auto', stats=NULL_STATS, orientation=1,
+                  position='bottom-right', img=None):
+        """
+        准备水印并计算其在图片存储方向上的位置
+
+        Args:
+            image_size (tuple): 图片按存储方向的尺寸 (宽, 高)
+            img (Image.Image): 位置为 auto 时用于选择位置的已加载图片或等比缩小的缩略图
+            其余参数同 apply()
+
+        Returns:
+            tuple: (处理好的RGBA水印, 水印左上角坐标)
+        """
+        display_size = image_size[::-1] if orientation >= 5 else image_size
+        watermark_size = self.watermark_size(display_size[0], size)
+        with stats.stage('prepare'):
+            watermark = self.cache.get(watermark_size, opacity, stats, orientation)
+
+        if position == 'auto':
+            if img is None:
+                raise ValueError("auto 位置需要提供图片内容")
+            with stats.stage('analyze'):
+                position = self.best_position(img, image_size, watermark_size, orientation)
+        position = self.watermark_position(display_size, watermark_size, position)
+        if orientation != 1:
+            position = stored_position(position, watermark_size, display_size, orientation)
+        return watermark, position
+
+    def tile_pattern(self, display_size, watermark_size, opacity=70, orientation=1, layout='tiled',
+                     stats=NULL_STATS, blend=False):
+        """
+        获取平铺图案：平铺用的水印（见 tile_stamp()）和各个水印的坐标（见 tile_positions()）
+
+        水印按显示方向排列后转换到存储方向。图案只含一个水印和坐标列表，不随图片尺寸
+        占用内存，按（图片尺寸, 水印尺寸, 透明度, EXIF方向, 布局, 是否预先混合）缓存，
+        同一批次中尺寸相同的图片只需计算一次。
+
+        Args:
+            blend (bool): 水印转换为预先混合的 BlendedLayer，合成到不透明图片上每个水印只需一次 paste()
+
+        Returns:
+            tuple: (RGBA水印或 BlendedLayer, 按存储方向的左上角坐标列表)
+        """
+        key = (tuple(display_size), tuple(watermark_size), opacity, orientation, layout, blend)
+        with self._patterns_lock:
+            if key in self._patterns:
+                self._patterns.move_to_end(key)
+                stats.count('layer_hits')
+                return self._patterns[key]
+        stats.count('layer_misses')
+
+        stamp = tile_stamp(self.cache.get(watermark_size, opacity, stats), layout)
+        positions = tile_positions(display_size, stamp.size, self.margin, layout)
+        if orientation in ORIENTATION_TRANSPOSE:
+            positions = [stored_position(position, stamp.size, display_size, orientation)
+                         for position in positions]
+            stamp = stamp.transpose(ORIENTATION_TRANSPOSE[orientation])
+        if blend:
+            # 在旋转之后转换，与旋转后的水印直接合成的结果一致
+            stamp = blend_watermark(stamp)
+            stamp = BlendedLayer(stamp.convert('RGB'), stamp.getchannel('A'))
+        pattern = stamp, positions
+
+        with self._patterns_lock:
+            self._patterns[key] = pattern
+            while len(self._patterns) > PATTERN_CACHE_SIZE:
+                self._patterns.popitem(last=False)
+        return pattern
+
+    def stamps(self, image_size, opacity=70, size='auto', stats=NULL_STATS, orientation=1,
+               position='bottom-right', img=None, layout='single'):
+        """
+        按布局准备需要合成的所有水印
+
+        Args:
+            img (Image.Image): 要合成的图片，用于选择 auto 位置；平铺布局时据此判断能否使用
+                预先混合的水印（只适用于不透明图片）
+            layout (str): 水印布局，见 LAYOUTS；position 只用于 single 布局
+            其余参数同 placement()
+
+        Returns:
+            list: (处理好的RGBA水印或 BlendedLayer, 左上角坐标) 列表
+        """
+        if layout not in LAYOUTS:
+            raise ValueError(f"不支持的水印布局: {layout}，可选: {', '.join(LAYOUTS)}")
+        if layout == 'single':
+            return [self.placement(image_size, opacity, size, stats, orientation, position, img)]
+        if layout == 'corners':
+            return [self.placement(image_size, opacity, size, stats, orientation, corner)
+                    for corner in AUTO_CANDIDATES]
+
+        display_size = image_size[::-1] if orientation >= 5 else image_size
+        watermark_size = self.watermark_size(display_size[0], size)
+        # 不透明图片使用预先混合的水印，每个水印只需一次 paste()
+        blend = img is not None and _is_opaque(img)
+        with stats.stage('prepare'):
+            stamp, positions = self.tile_pattern(display_size, watermark_size, opacity, orientation,
+                                                 layout, stats, blend)
+        return [(stamp, position) for position in positions]
+
+    def apply(self, img, opacity=70, size='auto', stats=NULL_STATS, orientation=1, low_memory=False,
+              position='bottom-right', layout='single', keep_alpha=False):
+        """
+        为已打开的图片添加水印
+
+        Args:
+            img (Image.Image): 原图，不透明图片可能被直接修改
+            opacity (int): 透明度（30-100）
+            size (str | float): 水印大小，见 watermark_size()
+            stats (StageStats): 记录各阶段耗时的统计对象，默认不记录
+            orientation (int): 图片的EXIF方向。水印按旋转后显示的画面放置，
+                只旋转水印本身，不旋转原图
+            low_memory (bool): 带透明通道的图片按条带展平，见 composite_watermark()
+            position (str): 水印位置，见 POSITIONS；auto 表示按图片内容选择最清晰的角落
+            layout (str): 水印布局，见 LAYOUTS。平铺布局的图案按图片尺寸缓存，见 tile_pattern()
+            keep_alpha (bool): 带透明信息的图片保留透明通道，见 composite_stamps()
+
+        Returns:
+            Image.Image: 添加水印后的RGB图片，keep_alpha 时带透明信息的图片为RGBA
+        """
+        stamps = self.stamps(img.size, opacity, size, stats, orientation, position, img, layout)
+        with stats.stage('composite'):
+            return composite_stamps(img, stamps, low_memory, keep_alpha)
+
+    def process_file(self, image_path, output_path=None, opacity=70, size='auto', max_edge=None,
+                     max_pixels=None, output_format=None, save_options=None, stats=NULL_STATS,
+                     keep_metadata=(), auto_orient=True, max_memory=None, lossless_jpeg=False,
+                     position='bottom-right', layout='single'):
+        """
+        为图片文件添加水印并保存
+
+        Args:
+            image_path (str): 输入图片路径
+            output_path (str): 输出图片路径，如果为None则在原文件名后添加_watermarked
+            opacity (int): 透明度（30-100）
+            size (str | float): 水印大小，见 watermark_size()
+            max_edge (int): 输出图片长边的最大像素数，None表示保持原尺寸
+            max_pixels (int): 输出图片像素总数的上限，None表示不限制
+            output_format (str): 输出格式（jpeg/png/webp），None表示根据输出文件扩展名判断
+            save_options (dict): 按格式名称分组的编码参数，如 {'JPEG': {'quality': 85}}
+            stats (StageStats): 记录各阶段耗时的统计对象，默认不记录
+            keep_metadata (iterable): 写入输出图片的原图元数据类型（exif/icc/xmp），默认不保留
+            auto_orient (bool): 是否按EXIF方向放置水印（输出图片保留方向标记）
+            max_memory (int): 内存预算（字节）。估算超出时按条带处理带透明通道的图片，
+                仍超出时不解码直接报错；None表示不限制
+            lossless_jpeg (bool): JPEG原图输出为JPEG时只重新编码水印覆盖的MCU，
+                其余数据原样保留（见 watermark_jpeg）；原图不适合时改为完整重新编码
+            position (str): 水印位置（bottom-right/bottom-left/top-right/top-left/center），
+                auto 表示按图片内容选择水印最清晰的角落
+            layout (str): 水印布局（single/corners/tiled/diagonal），平铺布局的图案按图片尺寸缓存
+
+        Returns:
+            str: 输出文件路径
+
+        Raises:
+            WatermarkError: 图片处理失败
+        """
+        try:
+            with Image.open(image_path) as img:
+                if output_path is None:
+                    output_path = Path(image_path).parent / default_output_name(image_path, output_format)
+
+                self._render(img, output_path, opacity, size, max_edge, max_pixels,
+                             output_format, save_options, stats, keep_metadata, auto_orient,
+                             max_memory, lossless_jpeg, position, layout)
+
+                if stats.enabled:
+                    stats.count('bytes_read', os.path.getsize(image_path))
+                    stats.count('bytes_written', os.path.getsize(output_path))
+
+                return str(output_path)
+
+        except Exception as e:
+            raise WatermarkError(f"处理图片 {image_path} 时出错: {str(e)}") from e
+
+    def process_stream(self, source, destination, opacity=70, size='auto', max_edge=None,
+                       max_pixels=None, output_format=None, save_options=None, stats=NULL_STATS,
+                       keep_metadata=(), auto_orient=True, max_memory=None, lossless_jpeg=False,
+                       position='bottom-right', layout='single'):
+        """
+        为内存中的图片数据添加水印，并把编码结果写入输出流
+
+        Args:
+            source (bytes | bytearray | memoryview | file-like): 输入图片数据或文件对象
+            destination (file-like): 写入编码结果的输出流
+            output_format (str): 输出格式，None表示与输入格式相同（Pillow无法编码时使用JPEG）
+            其余参数同 process_file()
+
+        Returns:
+            str: 实际使用的格式名称
+
+        Raises:
+            WatermarkError: 图片处理失败
+        """
+        try:
+            with Image.open(open_source(source)) as img:
+                if output_format is None:
+                    output_format = img.format if img.format in Image.SAVE else 'JPEG'
+
+                image_format = self._render(img, destination, opacity, size, max_edge, max_pixels,
+                                            output_format, save_options, stats, keep_metadata,
+                                            auto_orient, max_memory, lossless_jpeg, position,
+                                            layout)
+
+                if stats.enabled and isinstance(source, (bytes, bytearray, memoryview)):
+                    stats.count('bytes_read', memoryview(source).nbytes)
+
+                return image_format
+
+        except Exception as e:
+            raise WatermarkError(f"处理图片数据时出错: {str(e)}") from e
+
+    def process_bytes(self, source, **settings):
+        """
+        为内存中的图片数据添加水印
+
+        Args:
+            source (bytes | bytearray | memoryview | file-like): 输入图片数据或文件对象
+            **settings: 传给 process_stream() 的处理参数
+
+        Returns:
+            bytes: 编码后的图片数据
+        """
+        output = io.BytesIO()
+        self.process_stream(source, output, **settings)
+        return output.getvalue()
+
+    def _render(self, img, destination, opacity, size, max_edge, max_pixels, output_format,
+                save_options, stats, keep_metadata=(), auto_orient=True, max_memory=None,
+                lossless_jpeg=False, position='bottom-right', layout='single'):
+        """解码、添加水印并编码到输出路径或输出流，返回实际使用的格式名称"""
+        image_format = resolve_format(destination, output_format)
+        if lossless_jpeg and img.format == 'JPEG' and image_format == 'JPEG':
+            try:
+                return self._render_lossless(img, destination, opacity, size, max_edge, max_pixels,
+                                             stats, keep_metadata, auto_orient, position, layout)
+            except JpegPatchError:
+                stats.count('lossless_fallback')
+
+        # 解码前按文件头估算内存，超出预算时改为按条带处理或直接报错
+        animation = image_format if is_animation(img, image_format) else None
+        low_memory = plan_memory(img, max_memory, max_edge, max_pixels, animation)
+        if low_memory:
+            stats.count('low_memory')
+
+        if animation:
+            return self._render_animation(img, destination, opacity, size, max_edge, max_pixels,
+                                          image_format, save_options, stats, keep_metadata,
+                                          low_memory, position, layout)
+
+        # 按需缩小输出尺寸（JPEG直接以缩小比例解码），水印按缩小后的宽度计算
+        with stats.stage('decode'):
+            source = reduce_image(img, max_edge, max_pixels)
+            source.load()
+
+        # 输出格式无法记录方向标记时，查看器会按存储方向显示，水印也按存储方向放置
+        orientation = 1
+        if auto_orient and image_format in EXIF_FORMATS:
+            orientation = read_orientation(img)
+        # 元数据从原图读取（缩小后的图片不带 info），在合成之前取得以判断原图模式
+        extra_params = metadata_params(img, image_format, keep_metadata, orientation)
+
+        # 输出格式支持透明信息时保留原图的透明通道，JPEG/BMP 等格式仍以白色背景展平
+        img = self.apply(source, opacity, size, stats, orientation, low_memory, position, layout,
+                         keep_alpha=image_format in ALPHA_FORMATS)
+
+        with stats.stage('encode'):
+            save_image(img, destination, image_format, save_options, **extra_params)
+
+        stats.count('images')
+        return image_format
+
+    def _render_lossless(self, img, destination, opacity, size, max_edge, max_pixels, stats,
+                         keep_metadata=(), auto_orient=True, position='bottom-right', layout='single'):
+        """
+        不解码整幅图片，只重新编码水印覆盖的MCU，见 watermark_jpeg.patch_jpeg()
+
+        corners 布局依次修补四个角落，每次只重新编码该角落所在的重启区间。
+
+        Raises:
+            JpegPatchError: 需要缩小输出尺寸、使用平铺布局，或原图不适合局部重编码
+        """
+        if reduced_size(img.size, max_edge, max_pixels) is not None:
+            raise JpegPatchError("缩小输出尺寸时无法局部重编码")
+        if layout in ('tiled', 'diagonal'):
+            raise JpegPatchError("平铺水印覆盖整幅图片，无法局部重编码")
+
+        with stats.stage('decode'):
+            # 尚未加载像素数据，读取原始编码数据（与 Pillow 解码时一样从头读取）
+            img.fp.seek(0)
+            data = img.fp.read()
+
+        orientation = read_orientation(img) if auto_orient else 1
+        extra_params = metadata_params(img, 'JPEG', keep_metadata, orientation)
+
+        thumbnail = None
+        if position == 'auto' and layout == 'single':
+            # 不解码整幅图片：以草稿模式只解码 1/8 大小的灰度缩略图用于选择位置
+            with stats.stage('decode'):
+                thumbnail = Image.open(io.BytesIO(data))
+                thumbnail.draft('L', (img.width // 8, img.height // 8))
+                thumbnail.load()
+        stamps = self.stamps(img.size, opacity, size, stats, orientation, position, thumbnail, layout)
+
+        with stats.stage('patch'):
+            output = data
+            for watermark, origin in stamps:
+                output = patch_jpeg(output, watermark, origin,
+                                    lambda region, offset, watermark=watermark:
+                                        composite_watermark(region, watermark, offset),
+                                    **extra_params)
+
+        with stats.stage('encode'):
+            if hasattr(destination, 'write'):
+                destination.write(output)
+            else:
+                with open(destination, 'wb') as f:
+                    f.write(output)
+
+        stats.count('images')
+        stats.count('lossless')
+        return 'JPEG'
+
+    def _render_animation(self, img, destination, opacity, size, max_edge, max_pixels,
+                          output_format, save_options, stats, keep_metadata=(), low_memory=False,
+                          position='bottom-right', layout='single'):
+        """
+        逐帧添加水印并编码为动画，保留每帧时长、循环次数和透明区域
+
+        所有帧尺寸相同，水印只准备一次。Pillow 的 GIF/WebP/APNG 编码器都会在写入之前
+        保留全部合成后的帧，峰值内存随帧数增长，plan_memory() 按帧数估算（见 ANIMATION_MEMORY）
+        并在超出预算时报错。
+        """
+        loop = img.info.get('loop')
+        image_format = resolve_format(destination, output_format)
+        extra_params = metadata_params(img, image_format, keep_metadata)
+        frame_seconds = 0.0
+        stamps = None
+
+        def frames():
+            nonlocal frame_seconds, stamps
+            for index in range(img.n_frames):
+                start = time.perf_counter()
+                with stats.stage('decode'):
+                    img.seek(index)
+                    # 合成可能直接修改帧，而解码后续帧仍需要原始画面，因此先复制
+                    frame = img.copy()
+                    # WebP 在加载帧数据后才给出该帧的时长
+                    duration = img.info.get('duration', 0)
+                    frame = reduce_image(frame, max_edge, max_pixels)
+
+                if stamps is None:
+                    # 自动选择位置时按第一帧选择，所有帧使用同一位置
+                    stamps = self.stamps(frame.size, opacity, size, stats, position=position,
+                                         img=frame, layout=layout)
+
+                with stats.stage('composite'):
+                    # 动画格式都能保存透明信息，透明的帧保留透明通道
+                    frame = composite_stamps(frame, stamps, low_memory, keep_alpha=True)
+                frame.info = {'duration': duration}
+                frame_seconds += time.perf_counter() - start
+                yield frame
+
+        frame_iter = frames()
+        first_frame = next(frame_iter)
+        params = dict(extra_params, save_all=True, append_images=frame_iter)
+        if image_format != 'GIF':
+            # WebP 编码器只从参数读取时长，APNG 编码器会遍历两次追加的帧，都需要先生成全部帧；
+            # GIF 编码器自己遍历帧，但同样会把全部帧保留到写入时
+            rest_frames = list(frame_iter)
+            params['append_images'] = rest_frames
+            params['duration'] = [frame.info['duration'] for frame in [first_frame, *rest_frames]]
+        elif image_format == 'GIF' and first_frame.mode == 'RGBA':
+            # 每帧都是合成好的完整画面，透明的帧在显示下一帧之前要清除，否则会露出上一帧
+            params['disposal'] = 2
+        if loop is not None:
+            params['loop'] = loop
+
+        frame_seconds = 0.0
+        start = time.perf_counter()
+        save_image(first_frame, destination, image_format, save_options, **params)
+        # 编码期间逐帧解码和合成的耗时已分别记录，不计入编码阶段
+        stats.add('encode', time.perf_counter() - start - frame_seconds)
+
+        stats.count('images')
+        stats.count('frames', img.n_frames)
+        return image_format
+
+    def process_batch(self, tasks, stats=NULL_STATS, **settings):
+        """
+        依次处理多张图片
+
+        Args:
+            tasks (iterable): 图片路径，或 (输入路径, 输出路径) 元组
+            stats (StageStats): 记录各阶段耗时的统计对象，默认不记录
+            **settings: 传给 process_file() 的处理参数（opacity、size 等）
+
+        Yields:
+            tuple: (输入路径, 输出路径, 错误)，成功时错误为None，失败时输出路径为None
+        """
+        for task in tasks:
+            image_path, output_path = task if isinstance(task, tuple) else (task, None)
+            try:
+                result_path = self.process_file(image_path, output_path, stats=stats, **settings)
+            except WatermarkError as e:
+                yield image_path, None, e
+            else:
+                yield image_path, result_path, None
+
+
+class PreviewProxy:
+    """
+    用于实时预览的缩小版图片
+
+    创建时只解码一次缩小的代理图片（JPEG以草稿模式直接缩小解码），并按EXIF方向
+    转到显示方向。之后每次调整参数只把上一次水印覆盖的区域从干净的代理图片中恢复，
+    再在新位置合成缩小后的水印，不重新解码原图，也不处理整幅图片。
+
+    水印尺寸和位置按输出图片的尺寸计算后再等比缩小，与实际输出的比例一致。
+    render() 会修改并返回同一张图片，应只在一个线程中调用。
+    """
+
+    def __init__(self, watermarker, image_path, max_edge=640):
+        """
+        Args:
+            watermarker (Watermarker): 提供水印和水印缓存的处理器
+            image_path (str): 原图路径
+            max_edge (int): 代理图片长边的最大像素数
+
+        Raises:
+            WatermarkError: 图片无法读取
+        """
+        self.watermarker = watermarker
+        try:
+            with Image.open(image_path) as img:
+                orientation = read_orientation(img)
+                # 原图按EXIF方向显示时的尺寸，水印尺寸和位置都以此计算
+                self.source_size = img.size[::-1] if orientation >= 5 else img.size
+                proxy = reduce_image(img, max_edge)
+                if _is_opaque(proxy):
+                    proxy = proxy.convert('RGB')
+                else:
+                    # 与输出一样以白色背景展平透明区域
+                    rgba = proxy.convert('RGBA')
+                    proxy = Image.new('RGB', rgba.size, (255, 255, 255))
+                    proxy.paste(rgba, mask=rgba.getchannel('A'))
+        except Exception as e:
+            raise WatermarkError(f"读取预览图片 {image_path} 时出错: {str(e)}") from e
+
+        if orientation in DISPLAY_TRANSPOSE:
+            proxy = proxy.transpose(DISPLAY_TRANSPOSE[orientation])
+        self.base = proxy
+        self.frame = proxy.copy()
+        self._box = None
+
+    @property
+    def size(self):
+        """代理图片的尺寸 (宽, 高)"""
+        return self.base.size
+
+    def render(self, opacity=70, size='auto', position='bottom-right', max_edge=None, max_pixels=None,
+               layout='single'):
+        """
+        按当前参数在代理图片上合成水印
+
+        Args:
+            opacity (int): 透明度（30-100）
+            size (str | float): 水印大小，见 Watermarker.watermark_size()
+            position (str): 水印位置，见 POSITIONS
+            max_edge (int): 输出图片长边的最大像素数，水印按缩小后的输出尺寸计算
+            max_pixels (int): 输出图片像素总数的上限
+            layout (str): 水印布局，见 LAYOUTS
+
+        Returns:
+            Image.Image: 添加水印后的RGB预览图片
+        """
+        if layout not in LAYOUTS:
+            raise ValueError(f"不支持的水印布局: {layout}，可选: {', '.join(LAYOUTS)}")
+        reference = reduced_size(self.source_size, max_edge, max_pixels) or self.source_size
+        factor = self.base.width / reference[0]
+        watermark_size = self.watermarker.watermark_size(reference[0], size)
+        proxy_size = (max(1, round(watermark_size[0] * factor)), max(1, round(watermark_size[1] * factor)))
+        watermark = self.watermarker.cache.get(proxy_size, opacity)
+
+        if layout in ('tiled', 'diagonal'):
+            # 直接用缩小的水印和边距在代理图片上排列，与输出的平铺图案等比例
+            stamp = tile_stamp(watermark, layout)
+            stamps = [(stamp, position) for position in
+                      tile_positions(self.base.size, stamp.size, round(self.watermarker.margin * factor),
+                                     layout)]
+        else:
+            if layout == 'corners':
+                positions = AUTO_CANDIDATES
+            elif position == 'auto':
+                # 代理图片已转到显示方向，直接按显示方向比较各个角落
+                positions = [self.watermarker.best_position(self.base, reference, watermark_size)]
+            else:
+                positions = [position]
+            stamps = []
+            for candidate in positions:
+                x, y = self.watermarker.watermark_position(reference, watermark_size, candidate)
+                stamps.append((watermark, (round(x * factor), round(y * factor))))
+
+        # 先恢复上一次水印覆盖的区域，再只在新区域内合成
+        if self._box is not None:
+            self.frame.paste(self.base.crop(self._box), self._box[:2])
+        self._box = None
+        for stamp, (x, y) in stamps:
+            self.frame = composite_watermark(self.frame, stamp, (x, y))
+            box = (max(x, 0), max(y, 0), min(x + stamp.width, self.frame.width),
+                   min(y + stamp.height, self.frame.height))
+            if self._box is not None:
+                box = (min(box[0], self._box[0]), min(box[1], self._box[1]),
+                       max(box[2], self._box[2]), max(box[3], self._box[3]))
+            self._box = box
+        return self.frame
@@ -0,0 +1,597 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+AI 水印工具 - JPEG 局部重编码
+只重新编码水印覆盖的 MCU（最小编码单元），其余 DCT 数据按字节原样复制
+
+依赖 JPEG 文件中的重启标记（DRI/RSTn）：相邻两个重启标记之间的熵编码数据
+可以独立解码，因此只需对水印所在的重启区间做霍夫曼解码和重新编码，
+图片其他部分的数据完全不变，耗时与水印面积而不是图片面积成正比。
+
+    from watermark_jpeg import patch_jpeg
+
+    jpeg_bytes = patch_jpeg(data, watermark, position, composite)
+"""
+
+import io
+import re
+
+from PIL import Image
+
+# 查找熵编码数据中的标记：0xFF 后跟非 0x00 字节（0xFF00 是数据中的转义）
+MARKER_PATTERN = re.compile(rb'\xff+([^\x00])')
+
+# 重启标记 RST0-RST7
+RST_MARKERS = range(0xD0, 0xD8)
+
+# 基线/扩展顺序霍夫曼编码（SOF0、SOF1）
+SEQUENTIAL_SOF = {0xC0, 0xC1}
+
+# 其他帧类型（渐进式、无损、算术编码），无法局部重编码
+UNSUPPORTED_SOF = {0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+# 没有长度字段的独立标记
+STANDALONE_MARKERS = {0x01, *RST_MARKERS}
+
+# 输出时保留的原图头部段：JFIF（APP0）和 Adobe（APP14，记录颜色变换）；
+# 其他 APPn 和注释按 keep_metadata 重新生成，与完整重新编码的输出一致
+KEPT_APP_MARKERS = {0xE0, 0xEE}
+
+# 亮度分量的采样因子对应的 Pillow 色度抽样参数（色度分量均为 1x1）
+SUBSAMPLING_BY_FACTORS = {(1, 1): 0, (2, 1): 1, (2, 2): 2}
+
+# 每个 APP2 段最多容纳的 ICC 配置文件字节数
+ICC_CHUNK_SIZE = 65519
+
+
+class JpegPatchError(Exception):
+    """JPEG 无法局部重编码（调用方应改为完整解码和重新编码）"""
+    pass
+
+
+class JpegLayout:
+    """已解析的 JPEG 文件结构（只解析文件头，不解码熵编码数据）"""
+
+    def __init__(self, data):
+        self.data = data
+        self.width = self.height = 0
+        self.components = []      # [(分量ID, 水平采样, 垂直采样, 量化表ID)]，按帧头顺序
+        self.scan_components = [] # [(分量序号, DC表ID, AC表ID)]，按扫描顺序
+        self.qtables = {}         # 量化表ID -> 64个系数（Z字形顺序）
+        self.dc_tables = {}       # 表ID -> (查找表, 编码表)
+        self.ac_tables = {}
+        self.restart_interval = 0
+        self.adobe_transform = None
+        self.segments = []        # 扫描前的头部段 [(标记, 起始, 结束)]
+        self.sof_segment = None   # (起始, 结束)
+        self.sos_segment = None
+        self.intervals = []       # 各重启区间熵编码数据的 (起始, 结束)
+        self.scan_end = 0          # 文件结束标记之后的位置
+
+        self._parse_header()
+        self._find_intervals()
+
+    @property
+    def max_sampling(self):
+        """最大的 (水平, 垂直) 采样因子"""
+        return (max(h for _, h, _, _ in self.components),
+                max(v for _, _, v, _ in self.components))
+
+    @property
+    def mcu_size(self):
+        """MCU 的像素尺寸 (宽, 高)"""
+        h_max, v_max = self.max_sampling
+        return 8 * h_max, 8 * v_max
+
+    @property
+    def mcu_grid(self):
+        """图片在水平、垂直方向上的 MCU 数量"""
+        mcu_width, mcu_height = self.mcu_size
+        return -(-self.width // mcu_width), -(-self.height // mcu_height)
+
+    @property
+    def mcus_per_interval(self):
+        """每个重启区间包含的 MCU 数量（没有重启标记时为全部 MCU）"""
+        columns, rows = self.mcu_grid
+        return self.restart_interval or columns * rows
+
+    def block_units(self):
+        """
+        一个 MCU 内各个 8x8 块的排列
+
+        Returns:
+            list: 按编码顺序排列的 (扫描分量序号, 块列, 块行)
+        """
+        units = []
+        for scan_index, (component, _, _) in enumerate(self.scan_components):
+            _, h, v, _ = self.components[component]
+            units.extend((scan_index, bx, by) for by in range(v) for bx in range(h))
+        return units
+
+    def component_qtables(self):
+        """各分量（按帧头顺序）实际使用的量化表"""
+        return [self.qtables.get(tq) for _, _, _, tq in self.components]
+
+    def _parse_header(self):
+        data = self.data
+        if data[:2] != b'\xff\xd8':
+            raise JpegPatchError("不是JPEG文件")
+
+        position = 2
+        while True:
+            if position + 4 > len(data) or data[position] != 0xFF:
+                raise JpegPatchError("JPEG文件头已损坏")
+            while data[position + 1] == 0xFF:  # 标记前的填充字节
+                position += 1
+            marker = data[position + 1]
+            if marker in STANDALONE_MARKERS:
+                position += 2
+                continue
+
+            length = int.from_bytes(data[position + 2:position + 4], 'big')
+            start, end = position, position + 2 + length
+            body = data[position + 4:end]
+            self.segments.append((marker, start, end))
+
+            if marker in SEQUENTIAL_SOF:
+                self._parse_sof(body)
+                self.sof_segment = (start, end)
+            elif marker in UNSUPPORTED_SOF or marker == 0xCC:
+                raise JpegPatchError("只支持基线（非渐进式）霍夫曼编码的JPEG")
+            elif marker == 0xC4:
+                self._parse_dht(body)
+            elif marker == 0xDB:
+                self._parse_dqt(body)
+            elif marker == 0xDD:
+                self.restart_interval = int.from_bytes(body[:2], 'big')
+            elif marker == 0xEE and body.startswith(b'Adobe') and len(body) >= 12:
+                self.adobe_transform = body[11]
+            elif marker == 0xDA:
+                self._parse_sos(body)
+                self.segments.pop()
+                self.sos_segment = (start, end)
+                return
+            position = end
+
+    def _parse_sof(self, body):
+        if body[0] != 8:
+            raise JpegPatchError("只支持8位精度的JPEG")
+        self.height = int.from_bytes(body[1:3], 'big')
+        self.width = int.from_bytes(body[3:5], 'big')
+        for index in range(body[5]):
+            component_id, sampling, tq = body[6 + 3 * index:9 + 3 * index]
+            self.components.append((component_id, sampling >> 4, sampling & 0x0F, tq))
+        if self.width == 0 or self.height == 0:
+            raise JpegPatchError("JPEG尺寸由DNL标记给出，不支持")
+
+    def _parse_dht(self, body):
+        position = 0
+        while position < len(body):
+            table_class, table_id = body[position] >> 4, body[position] & 0x0F
+            counts = body[position + 1:position + 17]
+            symbols = body[position + 17:position + 17 + sum(counts)]
+            tables = self.ac_tables if table_class else self.dc_tables
+            tables[table_id] = build_huffman_table(counts, symbols)
+            position += 17 + sum(counts)
+
+    def _parse_dqt(self, body):
+        position = 0
+        while position < len(body):
+            precision, table_id = body[position] >> 4, body[position] & 0x0F
+            if precision:
+                values = body[position + 1:position + 129]
+                table = [int.from_bytes(values[i:i + 2], 'big') for i in range(0, 128, 2)]
+                position += 129
+            else:
+                table = list(body[position + 1:position + 65])
+                position += 65
+            self.qtables[table_id] = table
+
+    def _parse_sos(self, body):
+        component_ids = [component_id for component_id, _, _, _ in self.components]
+        for index in range(body[0]):
+            component_id, tables = body[1 + 2 * index:3 + 2 * index]
+            if component_id not in component_ids:
+                raise JpegPatchError("扫描引用了不存在的分量")
+            self.scan_components.append((component_ids.index(component_id), tables >> 4, tables & 0x0F))
+
+    def _find_intervals(self):
+        """按重启标记切分熵编码数据，扫描之后只能是文件结束标记"""
+        start = self.sos_segment[1]
+        for match in MARKER_PATTERN.finditer(self.data, start):
+            self.intervals.append((start, match.start()))
+            if match.group(1)[0] not in RST_MARKERS:
+                self.scan_end = match.end()
+                if match.group(1) != b'\xd9':
+                    raise JpegPatchError("只支持单次扫描的JPEG")
+                return
+            start = match.end()
+        raise JpegPatchError("JPEG文件不完整")
+
+
+def build_huffman_table(counts, symbols):
+    """
+    根据 DHT 段中的码长计数和符号生成霍夫曼查找表和编码表
+
+    Returns:
+        tuple: (查找表, 编码表)。查找表以16位前缀为下标，值为 (符号, 码长)；
+            编码表以符号为下标，值为 (码字, 码长)，表中没有的符号为None
+    """
+    lookup = [None] * 65536
+    codes = [None] * 256
+    code = 0
+    index = 0
+    for length, count in enumerate(counts, 1):
+        for _ in range(count):
+            symbol = symbols[index]
+            index += 1
+            shift = 16 - length
+            lookup[code << shift:(code + 1) << shift] = [(symbol, length)] * (1 << shift)
+            codes[symbol] = (code, length)
+            code += 1
+        code <<= 1
+    return lookup, codes
+
+
+def unstuff(data):
+    """去掉熵编码数据中 0xFF 之后用于转义的 0x00"""
+    return data.replace(b'\xff\x00', b'\xff')
+
+
+def decode_interval(data, block_tables, mcu_count):
+    """
+    对一个重启区间的熵编码数据做霍夫曼解码
+
+    Args:
+        data (bytes): 区间内去掉转义后的熵编码数据，见 unstuff()
+        block_tables (list): MCU 内每个块的 (扫描分量序号, DC查找表, AC查找表)
+        mcu_count (int): 区间内的 MCU 数量
+
+    Returns:
+        tuple: (MCU列表, 各MCU起始位置)。每个 MCU 是块的列表，每块为 Z 字形顺序的
+            64个量化系数（DC为绝对值）；起始位置以位为单位
+    """
+    data += b'\xff' * 4
+    predictors = [0] * len(block_tables)
+    accumulator = bits = position = 0
+    mcus = []
+    offsets = []
+    try:
+        for _ in range(mcu_count):
+            offsets.append(position * 8 - bits)
+            blocks = []
+            for component, dc_lookup, ac_lookup in block_tables:
+                coefficients = [0] * 64
+
+                while bits < 16:
+                    accumulator = ((accumulator & 0xFFFF) << 8) | data[position]
+                    position += 1
+                    bits += 8
+                size, length = dc_lookup[(accumulator >> (bits - 16)) & 0xFFFF]
+                bits -= length
+                if size:
+                    while bits < 16:
+                        accumulator = ((accumulator & 0xFFFF) << 8) | data[position]
+                        position += 1
+                        bits += 8
+                    value = (accumulator >> (bits - size)) & ((1 << size) - 1)
+                    bits -= size
+                    if value < 1 << (size - 1):
+                        value -= (1 << size) - 1
+                    predictors[component] += value
+                coefficients[0] = predictors[component]
+
+                k = 1
+                while k < 64:
+                    while bits < 16:
+                        accumulator = ((accumulator & 0xFFFF) << 8) | data[position]
+                        position += 1
+                        bits += 8
+                    symbol, length = ac_lookup[(accumulator >> (bits - 16)) & 0xFFFF]
+                    bits -= length
+                    run, size = symbol >> 4, symbol & 0x0F
+                    if size:
+                        k += run
+                        while bits < 16:
+                            accumulator = ((accumulator & 0xFFFF) << 8) | data[position]
+                            position += 1
+                            bits += 8
+                        value = (accumulator >> (bits - size)) & ((1 << size) - 1)
+                        bits -= size
+                        if value < 1 << (size - 1):
+                            value -= (1 << size) - 1
+                        coefficients[k] = value
+                        k += 1
+                    elif run == 15:
+                        k += 16
+                    else:
+                        break
+                blocks.append(coefficients)
+            mcus.append(blocks)
+    except (TypeError, IndexError) as e:
+        # 查找表中没有的码字（TypeError）或数据提前结束、系数越界（IndexError）
+        raise JpegPatchError("JPEG熵编码数据已损坏") from e
+    return mcus, offsets
+
+
+def encode_interval(mcus, block_tables, first=0, original=None):
+    """
+    把量化系数重新霍夫曼编码为一个重启区间的熵编码数据
+
+    Args:
+        mcus (list): decode_interval() 返回的 MCU 列表
+        block_tables (list): MCU 内每个块的 (扫描分量序号, DC编码表, AC编码表)
+        first (int): 从第几个 MCU 开始编码，之前的 MCU 从原始数据按位复制
+        original (tuple): first 大于0时需要，(去掉转义的原始数据, 各MCU起始位置)
+
+    Returns:
+        bytes: 含 0xFF00 转义、以1补齐到整字节的熵编码数据
+
+    Raises:
+        JpegPatchError: 原图的霍夫曼表（如经过优化的表）缺少需要的符号
+    """
+    output = bytearray()
+    predictors = [0] * len(block_tables)
+    accumulator = bits = 0
+    if first:
+        data, offsets = original
+        whole, bits = divmod(offsets[first], 8)
+        output += data[:whole]
+        if bits:
+            accumulator = data[whole] >> (8 - bits)
+        for (component, _, _), coefficients in zip(block_tables, mcus[first - 1]):
+            predictors[component] = coefficients[0]
+
+    try:
+        for blocks in mcus[first:]:
+            for (component, dc_codes, ac_codes), coefficients in zip(block_tables, blocks):
+                difference = coefficients[0] - predictors[component]
+                predictors[component] = coefficients[0]
+                size = abs(difference).bit_length()
+                code, length = dc_codes[size]
+                if difference < 0:
+                    difference += (1 << size) - 1
+                accumulator = (((accumulator << length) | code) << size) | difference
+                bits += length + size
+
+                run = 0
+                for k in range(1, 64):
+                    value = coefficients[k]
+                    if value == 0:
+                        run += 1
+                        continue
+                    while run > 15:
+                        code, length = ac_codes[0xF0]
+                        accumulator = (accumulator << length) | code
+                        bits += length
+                        run -= 16
+                    size = abs(value).bit_length()
+                    code, length = ac_codes[(run << 4) | size]
+                    if value < 0:
+                        value += (1 << size) - 1
+                    accumulator = (((accumulator << length) | code) << size) | value
+                    bits += length + size
+                    run = 0
+                    if bits >= 32:
+                        bits -= 32
+                        output += (accumulator >> bits).to_bytes(4, 'big')
+                        accumulator &= (1 << bits) - 1
+                if run:
+                    code, length = ac_codes[0x00]
+                    accumulator = (accumulator << length) | code
+                    bits += length
+                if bits >= 32:
+                    bits -= 32
+                    output += (accumulator >> bits).to_bytes(4, 'big')
+                    accumulator &= (1 << bits) - 1
+    except TypeError as e:
+        raise JpegPatchError("原图的霍夫曼表缺少所需符号") from e
+
+    # 以1补齐最后一个字节，再统一转义数据中的 0xFF
+    padding = -bits % 8
+    accumulator = (accumulator << padding) | ((1 << padding) - 1)
+    output += accumulator.to_bytes((bits + padding) // 8, 'big')
+    return bytes(output).replace(b'\xff', b'\xff\x00')
+
+
+def metadata_segments(exif=None, icc_profile=None, xmp=None):
+    """
+    生成写入元数据的 APP1/APP2 段（参数与 save_image() 的元数据参数相同）
+
+    Returns:
+        bytes: 依次排列的 EXIF、ICC、XMP 段
+    """
+    def segment(marker, payload):
+        if len(payload) + 2 > 0xFFFF:
+            raise JpegPatchError("元数据过大，无法写入单个JPEG段")
+        return bytes((0xFF, marker)) + (len(payload) + 2).to_bytes(2, 'big') + payload
+
+    output = b''
+    if exif:
+        output += segment(0xE1, exif if exif.startswith(b'Exif\x00\x00') else b'Exif\x00\x00' + exif)
+    if icc_profile:
+        chunks = [icc_profile[i:i + ICC_CHUNK_SIZE] for i in range(0, len(icc_profile), ICC_CHUNK_SIZE)]
+        for index, chunk in enumerate(chunks, 1):
+            output += segment(0xE2, b'ICC_PROFILE\x00' + bytes((index, len(chunks))) + chunk)
+    if xmp:
+        output += segment(0xE1, b'http://ns.adobe.com/xap/1.0/\x00' + xmp)
+    return output
+
+
+def _check_patchable(layout):
+    """检查 JPEG 是否可以局部重编码，返回对应的 Pillow 色度抽样参数"""
+    if not layout.restart_interval:
+        raise JpegPatchError("JPEG没有重启标记，无法只重新编码水印区域")
+    columns, rows = layout.mcu_grid
+    if len(layout.intervals) != -(-columns * rows // layout.restart_interval):
+        raise JpegPatchError("JPEG重启标记数量与图片尺寸不符")
+    if len(layout.components) != 3 or len(layout.scan_components) != 3:
+        raise JpegPatchError("只支持YCbCr彩色JPEG")
+    component_ids = tuple(component_id for component_id, _, _, _ in layout.components)
+    if layout.adobe_transform == 0 or component_ids == (82, 71, 66):
+        raise JpegPatchError("只支持YCbCr彩色JPEG")
+    if any((h, v) != (1, 1) for _, h, v, _ in layout.components[1:]):
+        raise JpegPatchError("不支持的色度抽样方式")
+    subsampling = SUBSAMPLING_BY_FACTORS.get(layout.components[0][1:3])
+    if subsampling is None:
+        raise JpegPatchError("不支持的色度抽样方式")
+    for _, dc_id, ac_id in layout.scan_components:
+        if dc_id not in layout.dc_tables or ac_id not in layout.ac_tables:
+            raise JpegPatchError("扫描引用了未定义的霍夫曼表")
+    if None in layout.component_qtables():
+        raise JpegPatchError("分量引用了未定义的量化表")
+    return subsampling
+
+
+def _block_tables(layout, table_index):
+    """MCU 内每个块的 (扫描分量序号, DC表, AC表)，table_index 为0取查找表、为1取编码表"""
+    tables = []
+    for scan_index, _, _ in layout.block_units():
+        _, dc_id, ac_id = layout.scan_components[scan_index]
+        tables.append((scan_index,
+                       layout.dc_tables[dc_id][table_index],
+                       layout.ac_tables[ac_id][table_index]))
+    return tables
+
+
+def _build_region_jpeg(layout, size, mcus):
+    """用原图的量化表、霍夫曼表和给定的 MCU 组成一张只含该区域的JPEG"""
+    data = layout.data
+    sof_start, sof_end = layout.sof_segment
+    sof = bytearray(data[sof_start:sof_end])
+    sof[5:7] = size[1].to_bytes(2, 'big')
+    sof[7:9] = size[0].to_bytes(2, 'big')
+
+    header = [b'\xff\xd8']
+    for marker, start, end in layout.segments:
+        if marker in (0xC4, 0xDB):
+            header.append(data[start:end])
+    header.append(bytes(sof))
+    header.append(data[slice(*layout.sos_segment)])
+    entropy = encode_interval(mcus, _block_tables(layout, 1))
+    return b''.join(header) + entropy + b'\xff\xd9'
+
+
+def patch_jpeg(data, watermark, position, composite, exif=None, icc_profile=None, xmp=None):
+    """
+    只重新编码水印覆盖的 MCU，生成添加水印后的 JPEG
+
+    水印区域解码为像素、合成水印后，用原图的量化表和色度抽样重新压缩，
+    只替换水印实际覆盖（透明度不为0）的 8x8 块；其余块的量化系数不变，
+    不含水印的重启区间按字节原样复制。原图的 JFIF/Adobe 段保留，
+    其他元数据段按参数重新生成。
+
+    Args:
+        data (bytes): 原图的 JPEG 数据
+        watermark (Image.Image): 处理好的RGBA水印
+        position (tuple): 水印左上角在图片中的坐标 (x, y)
+        composite (callable): composite(region, position) 把水印合成到RGB区域图片上，
+            返回合成后的RGB图片
+        exif (bytes): 写入的EXIF数据，None表示不写入
+        icc_profile (bytes): 写入的ICC配置文件
+        xmp (bytes): 写入的XMP数据
+
+    Returns:
+        bytes: 添加水印后的 JPEG 数据
+
+    Raises:
+        JpegPatchError: 图片不适合局部重编码（没有重启标记、渐进式等）
+    """
+    layout = JpegLayout(data)
+    subsampling = _check_patchable(layout)
+
+    x, y = position
+    if x < 0 or y < 0 or x + watermark.width > layout.width or y + watermark.height > layout.height:
+        raise JpegPatchError("水印超出图片范围")
+
+    mcu_width, mcu_height = layout.mcu_size
+    columns = layout.mcu_grid[0]
+    per_interval = layout.mcus_per_interval
+    first_column, last_column = x // mcu_width, (x + watermark.width - 1) // mcu_width
+    first_row, last_row = y // mcu_height, (y + watermark.height - 1) // mcu_height
+    region_origin = (first_column * mcu_width, first_row * mcu_height)
+    region_size = ((last_column - first_column + 1) * mcu_width,
+                   (last_row - first_row + 1) * mcu_height)
+    offset = (x - region_origin[0], y - region_origin[1])
+
+    # 对覆盖水印所在 MCU 的重启区间做霍夫曼解码
+    decode_tables = _block_tables(layout, 0)
+    intervals = {}
+    total = columns * layout.mcu_grid[1]
+    for row in range(first_row, last_row + 1):
+        for index in range((row * columns + first_column) // per_interval,
+                           (row * columns + last_column) // per_interval + 1):
+            if index not in intervals:
+                start, end = layout.intervals[index]
+                count = min(per_interval, total - index * per_interval)
+                unstuffed = unstuff(data[start:end])
+                intervals[index] = (unstuffed, *decode_interval(unstuffed, decode_tables, count))
+
+    def region_mcus():
+        for row in range(first_row, last_row + 1):
+            for column in range(first_column, last_column + 1):
+                index, within = divmod(row * columns + column, per_interval)
+                yield row, column, index, within
+
+    # 区域解码为像素并合成水印，再用原图的量化表和色度抽样重新压缩
+    region_jpeg = _build_region_jpeg(layout, region_size,
+                                     [intervals[index][1][within]
+                                      for _, _, index, within in region_mcus()])
+    with Image.open(io.BytesIO(region_jpeg)) as region:
+        region.load()
+        qtables = region.quantization
+        patched = composite(region.convert('RGB'), offset)
+    encoded = io.BytesIO()
+    patched.save(encoded, 'JPEG', qtables=qtables, subsampling=subsampling)
+    patched_layout = JpegLayout(encoded.getvalue())
+    if (patched_layout.component_qtables() != layout.component_qtables()
+            or [c[1:3] for c in patched_layout.components] != [c[1:3] for c in layout.components]):
+        raise JpegPatchError("重新压缩时无法还原原图的量化表")
+    start, end = patched_layout.intervals[0]
+    region_count = (last_row - first_row + 1) * (last_column - first_column + 1)
+    patched_mcus, _ = decode_interval(unstuff(patched_layout.data[start:end]),
+                                      _block_tables(patched_layout, 0), region_count)
+
+    # 只替换水印实际覆盖（透明度不为0）的块：按各分量块的像素范围缩小水印覆盖范围，
+    # 缩小后不为0的像素对应需要替换的块
+    coverage = Image.new('L', region_size)
+    coverage.paste(watermark.getchannel('A').point(lambda a: 255 if a else 0), offset)
+    h_max, v_max = layout.max_sampling
+    block_maps = []
+    for scan_index, bx, by in layout.block_units():
+        _, h, v, _ = layout.components[layout.scan_components[scan_index][0]]
+        width, height = 8 * h_max // h, 8 * v_max // v
+        block_maps.append((bx, by, width, height))
+    reduced = {(width, height): coverage.reduce((width, height))
+               for _, _, width, height in block_maps}
+
+    # 重启区间序号 -> 区间内第一个改动的 MCU
+    changed = {}
+    for (row, column, index, within), new_blocks in zip(region_mcus(), patched_mcus):
+        for unit, (bx, by, width, height) in enumerate(block_maps):
+            x_blocks, y_blocks = mcu_width // width, mcu_height // height
+            if reduced[width, height].getpixel(((column - first_column) * x_blocks + bx,
+                                                (row - first_row) * y_blocks + by)):
+                intervals[index][1][within][unit] = new_blocks[unit]
+                changed[index] = min(changed.get(index, within), within)
+
+    # 重新编码含有改动的重启区间（第一个改动的 MCU 之前按位复制），其余区间按字节复制
+    encode_tables = _block_tables(layout, 1)
+    pieces = [b'\xff\xd8']
+    pieces.extend(data[start:end] for marker, start, end in layout.segments if marker == 0xE0)
+    pieces.append(metadata_segments(exif, icc_profile, xmp))
+    for marker, start, end in layout.segments:
+        if marker == 0xE0 or marker == 0xFE:
+            continue
+        if 0xE0 <= marker <= 0xEF and marker not in KEPT_APP_MARKERS:
+            continue
+        pieces.append(data[start:end])
+    position = layout.sos_segment[0]
+    for index in sorted(changed):
+        start, end = layout.intervals[index]
+        pieces.append(data[position:start])
+        unstuffed, mcus, offsets = intervals[index]
+        pieces.append(encode_interval(mcus, encode_tables, changed[index], (unstuffed, offsets)))
+        position = end
+    pieces.append(data[position:layout.scan_end])
+    return b''.join(pieces)
@@ -0,0 +1,418 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+AI 水印工具 - 常驻服务
+保持水印处理器和缓存常驻内存，通过本地 HTTP 或 Unix socket 接收图片数据并返回添加水印后的图片
+
+    python ai_watermark_cli.py serve --port 8765
+    curl --data-binary @photo.jpg "http://127.0.0.1:8765/watermark?opacity=80" -o out.jpg
+"""
+
+import argparse
+import io
+import json
+import os
+import signal
+import socketserver
+import sys
+import threading
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from PIL import Image
+
+from watermark_engine import (ENCODER_DEFAULTS, LAYOUTS, METADATA_KINDS, POSITIONS, SIZE_DIVISORS,
+                              Watermarker, WatermarkError)
+
+
+class ServiceBusy(Exception):
+    """等待处理的请求已满"""
+
+
+class WatermarkService:
+    """
+    带并发上限和排队上限的水印处理服务
+
+    同时处理的请求数不超过 workers，另有最多 max_queue 个请求排队等待；
+    超出时立即拒绝（HTTP 503），由调用方稍后重试，避免请求无限堆积。
+    HTTP 接口在读取请求体之前先占用排队位置（见 reserve()），
+    因此同时读入内存的请求体也不超过 workers + max_queue 个。
+    """
+
+    def __init__(self, watermarker, workers=None, max_queue=64, max_body=50 * 1024 * 1024):
+        """
+        Args:
+            watermarker (Watermarker): 水印处理器
+            workers (int): 同时处理的请求数，None表示使用CPU核心数
+            max_queue (int): 最多排队等待的请求数
+            max_body (int): 请求体的最大字节数
+        """
+        self.watermarker = watermarker
+        self.workers = workers or os.cpu_count() or 1
+        self.max_queue = max_queue
+        self.max_body = max_body
+        self._slots = threading.BoundedSemaphore(self.workers)
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+
+    def render(self, data, opacity=70, size='auto', max_edge=None, max_pixels=None,
+               output_format=None, save_options=None, keep_metadata=(), auto_orient=True,
+               lossless_jpeg=False, position='bottom-right', layout='single'):
+        """
+        为图片数据添加水印
+
+        Args:
+            data (bytes): 输入图片数据
+            output_format (str): 输出格式，None表示与输入格式相同（Pillow无法编码时使用JPEG）
+            其余参数同 Watermarker.process_file()
+
+        Returns:
+            tuple: (输出图片数据的 memoryview, 格式名称)
+        """
+        output = io.BytesIO()
+        image_format = self.watermarker.process_stream(data, output, opacity, size, max_edge,
+                                                       max_pixels, output_format, save_options,
+                                                       keep_metadata=keep_metadata,
+                                                       auto_orient=auto_orient,
+                                                       lossless_jpeg=lossless_jpeg,
+                                                       position=position, layout=layout)
+        return output.getbuffer(), image_format
+
+    def reserve(self):
+        """
+        占用一个排队位置，排队已满时抛出 ServiceBusy
+
+        占用成功后必须调用 submit(reserved=True) 或 release() 归还。
+        """
+        with self._lock:
+            if self.pending >= self.workers + self.max_queue:
+                self.rejected += 1
+                raise ServiceBusy()
+            self.pending += 1
+
+    def release(self):
+        """归还 reserve() 占用的排队位置"""
+        with self._lock:
+            self.pending -= 1
+
+    def submit(self, data, reserved=False, **settings):
+        """
+        在并发上限内处理一张图片，排队已满时抛出 ServiceBusy
+
+        Args:
+            data (bytes): 输入图片数据
+            reserved (bool): 调用方已通过 reserve() 占用了排队位置，处理结束后归还
+            其余参数同 render()
+
+        Returns:
+            tuple: (输出图片数据, 格式名称)
+        """
+        if not reserved:
+            self.reserve()
+        try:
+            with self._slots:
+                result = self.render(data, **settings)
+            with self._lock:
+                self.completed += 1
+            return result
+        finally:
+            self.release()
+
+    def status(self):
+        """服务状态，用于健康检查"""
+        with self._lock:
+            status = {
+                'status': 'ok',
+                'workers': self.workers,
+                'max_queue': self.max_queue,
+                'pending': self.pending,
+                'completed': self.completed,
+                'rejected': self.rejected,
+            }
+        status['cache'] = self.watermarker.cache.stats()
+        return status
+
+
+def parse_settings(query):
+    """
+    解析请求参数
+
+    Returns:
+        dict: 传给 WatermarkService.submit() 的处理参数
+
+    Raises:
+        ValueError: 参数无效
+    """
+    params = {key: values[-1] for key, values in parse_qs(query).items()}
+    settings = {}
+
+    opacity = int(params.get('opacity', 70))
+    if not 30 <= opacity <= 100:
+        raise ValueError("透明度必须在 30-100 之间")
+    settings['opacity'] = opacity
+
+    size = params.get('size', 'auto')
+    if size not in SIZE_DIVISORS:
+        size = float(size)
+        if size <= 0:
+            raise ValueError("水印大小必须大于 0")
+    settings['size'] = size
+
+    if 'position' in params:
+        if params['position'] not in POSITIONS:
+            raise ValueError(f"不支持的水印位置: {params['position']}")
+        settings['position'] = params['position']
+
+    if 'layout' in params:
+        if params['layout'] not in LAYOUTS:
+            raise ValueError(f"不支持的水印布局: {params['layout']}")
+        settings['layout'] = params['layout']
+
+    for key in ('max_edge', 'max_pixels'):
+        if key in params:
+            value = int(params[key])
+            if value < 1:
+                raise ValueError("输出尺寸上限必须大于 0")
+            settings[key] = value
+
+    if 'format' in params:
+        output_format = params['format'].upper()
+        if output_format not in ENCODER_DEFAULTS:
+            raise ValueError(f"不支持的输出格式: {params['format']}")
+        settings['output_format'] = output_format
+
+    if 'quality' in params:
+        quality = int(params['quality'])
+        if not 1 <= quality <= 100:
+            raise ValueError("编码质量必须在 1-100 之间")
+        settings['save_options'] = {'JPEG': {'quality': quality}, 'WEBP': {'quality': quality}}
+
+    if 'keep_metadata' in params:
+        kinds = tuple(kind for kind in params['keep_metadata'].lower().split(',') if kind)
+        unknown_kinds = set(kinds) - set(METADATA_KINDS)
+        if unknown_kinds:
+            raise ValueError(f"未知的元数据类型: {', '.join(sorted(unknown_kinds))}")
+        settings['keep_metadata'] = kinds
+
+    if 'auto_orient' in params:
+        settings['auto_orient'] = params['auto_orient'].lower() not in ('0', 'false', 'no')
+
+    if 'lossless_jpeg' in params:
+        settings['lossless_jpeg'] = params['lossless_jpeg'].lower() not in ('0', 'false', 'no')
+
+    return settings
+
+
+class WatermarkRequestHandler(BaseHTTPRequestHandler):
+    """
+    HTTP 接口
+
+    POST /watermark   请求体为图片数据，查询参数 opacity/size/max_edge/max_pixels/format/quality/
+                      keep_metadata/auto_orient/lossless_jpeg/position/layout，返回添加水印后的图片数据
+    GET  /health      返回服务状态和缓存命中情况（JSON）
+    """
+
+    server_version = 'AIWatermark/1.0'
+    protocol_version = 'HTTP/1.1'
+
+    def address_string(self):
+        # Unix socket 连接没有客户端地址
+        if isinstance(self.client_address, tuple) and self.client_address:
+            return str(self.client_address[0])
+        return 'unix'
+
+    def send_json(self, status, payload):
+        """发送JSON响应"""
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        if status == HTTPStatus.SERVICE_UNAVAILABLE:
+            self.send_header('Retry-After', '1')
+        if self.close_connection:
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_json(self, status, message):
+        """发送错误响应"""
+        self.send_json(status, {'error': message})
+
+    def do_GET(self):
+        if urlsplit(self.path).path == '/health':
+            self.send_json(HTTPStatus.OK, self.server.service.status())
+        else:
+            self.send_error_json(HTTPStatus.NOT_FOUND, "未知的接口")
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        if url.path != '/watermark':
+            self.send_error_json(HTTPStatus.NOT_FOUND, "未知的接口")
+            return
+
+        service = self.server.service
+        length = self.headers.get('Content-Length')
+        if length is None:
+            self.close_connection = True
+            self.send_error_json(HTTPStatus.LENGTH_REQUIRED, "缺少 Content-Length")
+            return
+        try:
+            length = int(length)
+        except ValueError:
+            length = -1
+        if length < 0:
+            # 负数长度会让 rfile.read() 一直读到连接关闭，不受大小限制
+            self.close_connection = True
+            self.send_error_json(HTTPStatus.BAD_REQUEST, "Content-Length 无效")
+            return
+        if length > service.max_body:
+            # 不读取过大的请求体，直接关闭连接
+            self.close_connection = True
+            self.send_error_json(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, "图片数据过大")
+            return
+
+        # 以下错误都在读取请求体之前返回，未读取的请求体不能留在连接中，因此关闭连接
+        try:
+            settings = parse_settings(url.query)
+        except ValueError as e:
+            self.close_connection = True
+            self.send_error_json(HTTPStatus.BAD_REQUEST, f"参数无效: {e}")
+            return
+
+        # 先占用排队位置再读取请求体，排队已满时不把请求体读入内存
+        try:
+            service.reserve()
+        except ServiceBusy:
+            self.close_connection = True
+            self.send_error_json(HTTPStatus.SERVICE_UNAVAILABLE, "服务繁忙，请稍后重试")
+            return
+        try:
+            data = self.rfile.read(length)
+        except BaseException:
+            service.release()
+            raise
+        if len(data) < length:
+            # 客户端在发送完请求体之前断开
+            service.release()
+            self.close_connection = True
+            return
+
+        try:
+            body, image_format = service.submit(data, reserved=True, **settings)
+        except WatermarkError as e:
+            self.send_error_json(HTTPStatus.BAD_REQUEST, str(e))
+            return
+
+        self.send_response(HTTPStatus.OK)
+        self.send_header('Content-Type', Image.MIME.get(image_format, 'application/octet-stream'))
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+
+class WatermarkHTTPServer(ThreadingHTTPServer):
+    """监听 TCP 端口的水印服务"""
+
+    daemon_threads = True
+
+    def __init__(self, address, service, quiet=False):
+        self.service = service
+        self.quiet = quiet
+        super().__init__(address, WatermarkRequestHandler)
+
+
+if hasattr(socketserver, 'UnixStreamServer'):
+    class WatermarkUnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        """监听 Unix socket 的水印服务"""
+
+        daemon_threads = True
+
+        def __init__(self, path, service, quiet=False):
+            self.service = service
+            self.quiet = quiet
+            super().__init__(path, WatermarkRequestHandler)
+
+        def server_close(self):
+            super().server_close()
+            if os.path.exists(self.server_address):
+                os.remove(self.server_address)
+else:  # Windows 不支持 Unix socket
+    WatermarkUnixServer = None
+
+
+def create_server(service, host='127.0.0.1', port=8765, unix_socket=None, quiet=False):
+    """
+    创建水印服务
+
+    Args:
+        service (WatermarkService): 水印处理服务
+        host (str): 监听地址
+        port (int): 监听端口，0表示自动分配
+        unix_socket (str): Unix socket 路径，指定时忽略 host 和 port
+        quiet (bool): 是否关闭访问日志
+
+    Returns:
+        socketserver.BaseServer: 调用 serve_forever() 开始服务
+    """
+    if unix_socket:
+        if WatermarkUnixServer is None:
+            raise ValueError("当前系统不支持 Unix socket")
+        if os.path.exists(unix_socket):
+            os.remove(unix_socket)
+        return WatermarkUnixServer(unix_socket, service, quiet)
+    return WatermarkHTTPServer((host, port), service, quiet)
+
+
+def serve_main(argv=None):
+    """serve 子命令入口"""
+    parser = argparse.ArgumentParser(prog='ai_watermark_cli.py serve',
+                                     description="AI 水印工具 - 常驻水印服务")
+    parser.add_argument('--host', default='127.0.0.1', help='监听地址 (默认: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8765, help='监听端口，0表示自动分配 (默认: 8765)')
+    parser.add_argument('--unix-socket', metavar='PATH', help='监听 Unix socket 而不是 TCP 端口')
+    parser.add_argument('-j', '--workers', type=int, default=os.cpu_count() or 1,
+                       help='同时处理的请求数 (默认: CPU核心数)')
+    parser.add_argument('--max-queue', type=int, default=64,
+                       help='最多排队等待的请求数，超出时返回 503 (默认: 64)')
+    parser.add_argument('--max-body-mb', type=int, default=50,
+                       help='单个请求的最大图片大小（MB） (默认: 50)')
+    parser.add_argument('--watermark', help='水印图片路径 (默认: doubao_ai_watermark.png)')
+    parser.add_argument('-q', '--quiet', action='store_true', help='不输出访问日志')
+    args = parser.parse_args(argv)
+
+    if args.workers < 1 or args.max_queue < 0 or args.max_body_mb < 1:
+        print("错误: 并发数和最大图片大小必须大于 0，排队数不能为负数")
+        sys.exit(1)
+
+    try:
+        watermarker = Watermarker(args.watermark)
+        service = WatermarkService(watermarker, args.workers, args.max_queue,
+                                   args.max_body_mb * 1024 * 1024)
+        server = create_server(service, args.host, args.port, args.unix_socket, args.quiet)
+    except (WatermarkError, OSError, ValueError) as e:
+        print(f"错误: {e}")
+        sys.exit(1)
+
+    if args.unix_socket:
+        print(f"水印服务已启动: unix:{args.unix_socket}")
+    else:
+        host, port = server.server_address[:2]
+        print(f"水印服务已启动: http://{host}:{port}")
+    print(f"参数: 并发数={args.workers}, 排队上限={args.max_queue}")
+
+    # 收到 SIGTERM 时与 Ctrl+C 一样正常退出，确保关闭监听并删除 Unix socket 文件
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n正在停止服务...")
+    finally:
+        server.server_close()
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+AI 水印工具 - 处理阶段统计
+记录解码、水印准备、合成、编码等各阶段的耗时，以及读写字节数和缓存命中情况
+"""
+
+import math
+import time
+from collections import defaultdict
+
+
+class _StageTimer:
+    """计时上下文，退出时把耗时记录到所属的统计对象"""
+
+    __slots__ = ('stats', 'name', 'start')
+
+    def __init__(self, stats, name):
+        self.stats = stats
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stats.add(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class _NullTimer:
+    """不做任何记录的计时上下文"""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class NullStats:
+    """
+    关闭统计时使用的空对象
+
+    所有方法都直接返回，处理流程无需判断是否开启统计，关闭时几乎没有额外开销。
+    """
+
+    enabled = False
+
+    def stage(self, name):
+        return _NULL_TIMER
+
+    def add(self, name, seconds):
+        pass
+
+    def count(self, name, amount=1):
+        pass
+
+
+NULL_STATS = NullStats()
+
+
+def _percentile(sorted_values, percent):
+    """按最近秩法计算百分位数"""
+    if not sorted_values:
+        return 0.0
+    rank = math.ceil(percent / 100 * len(sorted_values))
+    return sorted_values[max(rank, 1) - 1]
+
+
+class StageStats:
+    """各处理阶段的耗时和计数统计"""
+
+    enabled = True
+
+    def __init__(self):
+        self.durations = defaultdict(list)
+        self.counters = defaultdict(int)
+        self.started = time.perf_counter()
+
+    def stage(self, name):
+        """
+        返回对一个处理阶段计时的上下文
+
+        Args:
+            name (str): 阶段名称，如 decode/prepare/composite/encode
+        """
+        return _StageTimer(self, name)
+
+    def add(self, name, seconds):
+        """记录一次阶段耗时（秒）"""
+        self.durations[name].append(seconds)
+
+    def count(self, name, amount=1):
+        """累加计数器，如 bytes_read、cache_hits"""
+        self.counters[name] += amount
+
+    def to_dict(self):
+        """
+        导出原始记录，用于从工作进程传回主进程
+
+        Returns:
+            dict: 包含 durations 和 counters 的字典
+        """
+        return {'durations': dict(self.durations), 'counters': dict(self.counters)}
+
+    def merge(self, data):
+        """合并 to_dict() 导出的记录"""
+        for name, values in data['durations'].items():
+            self.durations[name].extend(values)
+        for name, amount in data['counters'].items():
+            self.counters[name] += amount
+
+    def summary(self):
+        """
+        汇总统计结果
+
+        Returns:
+            dict: 各阶段的次数、总耗时和百分位数，计数器、缓存命中率和总耗时
+        """
+        stages = {}
+        for name, values in self.durations.items():
+            sorted_values = sorted(values)
+            stages[name] = {
+                'count': len(values),
+                'total': sum(values),
+                'mean': sum(values) / len(values),
+                'p50': _percentile(sorted_values, 50),
+                'p90': _percentile(sorted_values, 90),
+                'p99': _percentile(sorted_values, 99),
+                'max': sorted_values[-1],
+            }
+
+        lookups = self.counters.get('cache_hits', 0) + self.counters.get('cache_misses', 0)
+        return {
+            'wall_time': time.perf_counter() - self.started,
+            'stages': stages,
+            'counters': dict(self.counters),
+            'cache_hit_rate': self.counters.get('cache_hits', 0) / lookups if lookups else None,
+        }
+
+    def format_report(self):
+        """
+        生成可读的统计报告
+
+        Returns:
+            str: 多行文本报告
+        """
+        summary = self.summary()
+        stage_total = sum(stage['total'] for stage in summary['stages'].values()) or 1.0
+        lines = [
+            "处理阶段统计:",
+            f"  {'阶段':<10}{'次数':>8}{'总计(s)':>10}{'占比':>8}{'p50(ms)':>10}{'p90(ms)':>10}{'p99(ms)':>10}",
+        ]
+        for name, stage in summary['stages'].items():
+            lines.append(
+                f"  {name:<12}{stage['count']:>8}{stage['total']:>10.3f}"
+                f"{stage['total'] / stage_total:>9.1%}{stage['p50'] * 1000:>10.1f}"
+                f"{stage['p90'] * 1000:>10.1f}{stage['p99'] * 1000:>10.1f}"
+            )
+
+        counters = summary['counters']
+        lines.append(f"  读取: {counters.get('bytes_read', 0) / 1024 / 1024:.2f} MB, "
+                     f"写入: {counters.get('bytes_written', 0) / 1024 / 1024:.2f} MB")
+        if summary['cache_hit_rate'] is not None:
+            lines.append(f"  水印缓存: 命中 {counters.get('cache_hits', 0)} 次, "
+                         f"未命中 {counters.get('cache_misses', 0)} 次, "
+                         f"命中率 {summary['cache_hit_rate']:.1%}")
+        if counters.get('layer_hits') or counters.get('layer_misses'):
+            lines.append(f"  平铺图案: 命中 {counters.get('layer_hits', 0)} 次, "
+                         f"未命中 {counters.get('layer_misses', 0)} 次")
+        if counters.get('lossless') or counters.get('lossless_fallback'):
+            lines.append(f"  JPEG局部重编码: {counters.get('lossless', 0)} 张, "
+                         f"改为完整重新编码 {counters.get('lossless_fallback', 0)} 张")
+        lines.append(f"  总耗时: {summary['wall_time']:.3f} s")
+        return "\n".join(lines)